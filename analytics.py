@@ -0,0 +1,173 @@
+# filepath: analytics.py
+"""Incremental rollups of the query history for /api/stats.
+
+A background thread in every worker folds the rows added to chat_queries and
+queries since the last run into the stats_rollups table: per hour and per day,
+the number of questions by intent, crop, location, answer source (cache,
+knowledge base, LLM provider, rules, api) and channel, plus cache hits and
+misses. Each table has a watermark (the last id folded in), and the counts and
+the watermark are updated in one BEGIN IMMEDIATE transaction, so workers never
+count a row twice and a crash never loses or repeats a batch. Reading the
+stats only touches the rollups, never the raw history.
+
+Buckets use the row timestamps as stored; rows without a timestamp (written
+before the columns existed) are skipped.
+"""
+import os
+import time
+import threading
+from collections import Counter
+
+import logs
+import storage
+import concurrency
+
+ANALYTICS_INTERVAL = float(os.getenv("ANALYTICS_INTERVAL", "60"))  # seconds between rollup runs
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "5000"))  # history rows per transaction
+
+PERIODS = {"hour": 13, "day": 10}  # timestamp prefix length of a bucket
+DIMENSIONS = ("total", "intent", "crop", "location", "source", "channel", "cache")
+
+# history table -> SELECT returning (id, timestamp, intent, crop, location, source, channel)
+_SOURCES = {
+    "chat_queries": "SELECT id, timestamp, intent, crop, location, source, 'chat' FROM chat_queries",
+    "queries": "SELECT id, timestamp, 'general', crop, location, source, query_type FROM queries",
+}
+
+
+def _row_counts(row) -> list:
+    """(dimension, value) pairs one history row adds 1 to."""
+    _, _, intent, crop, location, source, channel = row
+    pairs = [("total", "")]
+    for dimension, value in (("intent", intent), ("crop", crop), ("location", location),
+                             ("source", source), ("channel", channel)):
+        if value:
+            pairs.append((dimension, value))
+    if source:
+        pairs.append(("cache", "hit" if source == "cache" else "miss"))
+    return pairs
+
+
+class Rollups:
+    def __init__(self, interval=ANALYTICS_INTERVAL, batch_size=ANALYTICS_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.rows_processed = 0
+        self.last_run = None
+
+    def _fold_batch(self, conn, table) -> int:
+        """Fold the next batch of table's rows into the rollups; return how many were read."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT last_id FROM stats_watermarks WHERE source_table = ?", (table,)).fetchone()
+            last_id = row[0] if row else 0
+            rows = conn.execute(
+                f"{_SOURCES[table]} WHERE id > ? ORDER BY id LIMIT ?", (last_id, self.batch_size)
+            ).fetchall()
+            if rows:
+                counts = Counter()
+                for history_row in rows:
+                    timestamp = history_row[1]
+                    if not timestamp:
+                        continue
+                    for period, length in PERIODS.items():
+                        for dimension, value in _row_counts(history_row):
+                            counts[(period, timestamp[:length], dimension, value)] += 1
+                conn.executemany(
+                    "INSERT INTO stats_rollups (period, bucket, dimension, value, count) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (period, bucket, dimension, value) DO UPDATE SET count = count + excluded.count",
+                    [key + (count,) for key, count in counts.items()],
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO stats_watermarks (source_table, last_id) VALUES (?, ?)",
+                    (table, rows[-1][0]),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(rows)
+
+    def update(self) -> int:
+        """Fold every history row added since the last run; return the number of rows."""
+        # The BEGIN IMMEDIATE batches can wait on the write lock: off the gevent hub
+        return concurrency.offload(self._update)
+
+    def _update(self) -> int:
+        conn = storage.get_connection()
+        total = 0
+        for table in _SOURCES:
+            while True:
+                count = self._fold_batch(conn, table)
+                total += count
+                if count < self.batch_size:
+                    break
+        self.rows_processed += total
+        self.last_run = time.time()
+        return total
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.update()
+            except Exception as e:
+                logs.error("Analytics rollup failed", error=str(e))
+
+    def start(self):
+        """Start the periodic rollup thread in this process (again after a fork)."""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="analytics-rollups", daemon=True)
+            self._thread.start()
+
+    def report(self, period="day", since=None, until=None, top=10) -> dict:
+        """Totals, top values and the volume series for buckets in [since, until)."""
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of: {', '.join(PERIODS)}")
+        conditions, values = ["period = ?"], [period]
+        if since:
+            conditions.append("bucket >= ?")
+            values.append(since[:PERIODS[period]])
+        if until:
+            conditions.append("bucket < ?")
+            values.append(until[:PERIODS[period]])
+        where = " AND ".join(conditions)
+
+        series = storage.query(
+            f"SELECT bucket, count FROM stats_rollups WHERE {where} AND dimension = 'total' ORDER BY bucket", values
+        )
+        totals = {dimension: {} for dimension in DIMENSIONS if dimension != "total"}
+        for dimension, value, count in storage.query(
+            f"SELECT dimension, value, SUM(count) FROM stats_rollups WHERE {where} AND dimension != 'total' "
+            f"GROUP BY dimension, value ORDER BY SUM(count) DESC",
+            values,
+        ):
+            if dimension in totals:
+                totals[dimension][value] = count
+
+        cache = totals.pop("cache")
+        lookups = cache.get("hit", 0) + cache.get("miss", 0)
+        return {
+            "period": period,
+            "total": sum(count for _, count in series),
+            "series": [{"bucket": bucket, "count": count} for bucket, count in series],
+            "intents": totals["intent"],
+            "top_crops": dict(list(totals["crop"].items())[:top]),
+            "top_locations": dict(list(totals["location"].items())[:top]),
+            "sources": totals["source"],
+            "channels": totals["channel"],
+            "cache": {"hits": cache.get("hit", 0), "misses": cache.get("miss", 0),
+                      "hit_rate": round(cache.get("hit", 0) / lookups, 4) if lookups else None},
+        }
+
+    def stats(self) -> dict:
+        return {"rows_processed": self.rows_processed, "last_run": self.last_run}
+
+
+rollups = Rollups()
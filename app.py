@@ -1,96 +1,85 @@
 # filepath: app.py
 import os
-import sqlite3
 import json
-import requests
-import io
-import base64
+import uuid
+import time
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, Response, send_from_directory
+from flask import Flask, render_template, request, jsonify, Response, send_from_directory, stream_with_context, g
 from werkzeug.utils import secure_filename
-import whisper
-import numpy as np
-from PIL import Image
-import matplotlib.pyplot as plt
-import pandas as pd
-from geopy.geocoders import Nominatim
-
-# Optional imports
-try:
-    import openai
-except ImportError:
-    openai = None
-
-try:
-    import google.generativeai as genai
-    from google.generativeai.types import HarmCategory, HarmBlockThreshold
-except ImportError:
-    genai = None
 
-try:
-    import speech_recognition as sr
-except ImportError:
-    sr = None
+import lazy
+import logs
+import metrics
+import storage
+import migrations
+import history
+import analytics
+import export
+import clients
+import jobs
+import intents
+import images
+import tts
+import translation
+import geocoding
+import weather
+import market
+import seasonal
+import knowledge
+import ratelimit
+import singleflight
+import concurrency
+import providers
+import transcription
+from response_cache import ResponseCache, normalize_query
 
-try:
-    import pyttsx3
-except ImportError:
-    pyttsx3 = None
+# Optional imports, loaded on first use (falsy when not installed, see lazy.py)
+from clients import genai, openai
+sr = lazy.module("speech_recognition")
 
 app = Flask(__name__, static_url_path='/static', static_folder='static')
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['AUDIO_FOLDER'] = 'static/audio'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 
-# Load Whisper model for audio transcription
-whisper_model = whisper.load_model("base")
-
 # API keys from environment
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY", "demo_key")  # Default to demo key if not provided
 
-if OPENAI_API_KEY and openai:
-    openai.api_key = OPENAI_API_KEY
+# The SDKs get their API keys when they are first imported (see clients.py)
 
-if GEMINI_API_KEY and genai:
-    genai.configure(api_key=GEMINI_API_KEY)
-    
-# Configure Gemini safety settings
+# Configure Gemini safety settings (names instead of the SDK enums, so the SDK isn't imported here)
 safety_settings = [
-    {"category": HarmCategory.HARM_CATEGORY_HARASSMENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-    {"category": HarmCategory.HARM_CATEGORY_HATE_SPEECH, "threshold": HarmBlockThreshold.BLOCK_NONE},
-    {"category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-    {"category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
 ]
 # --- Image Analysis with Gemini ---
 def analyze_image(image_path):
-    print(f"Starting image analysis for: {image_path}")
+    logs.info("Image analysis started", image=image_path)
     
     if not GEMINI_API_KEY:
-        print("Error: GEMINI_API_KEY not configured")
+        logs.error("Image analysis unavailable: GEMINI_API_KEY not configured")
         return "Image analysis requires Gemini API key. Please configure your API key."
     
     if not genai:
-        print("Error: google.generativeai module not available")
+        logs.error("Image analysis unavailable: google.generativeai not installed")
         return "Required module 'google.generativeai' is not available."
     
     try:
         # Check if file exists
         if not os.path.exists(image_path):
-            print(f"Error: Image file not found at path: {image_path}")
+            logs.error("Image file not found", image=image_path)
             return "Error: Image file not found."
         
-        print("Loading and preparing image...")
-        # Load and prepare the image
-        img = Image.open(image_path)
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='JPEG')
-        img_bytes = img_byte_arr.getvalue()
+        # Downscale, strip EXIF and re-encode; the model doesn't need 12 MP
+        img_bytes, prep = concurrency.offload(images.prepare_for_vision, image_path)
+        logs.info("Image prepared for vision", image=image_path, **prep)
         
-        print("Creating Gemini model instance...")
-        # Create a Gemini model instance for image analysis
-        model = genai.GenerativeModel('gemini-pro-vision')
+        # Shared Gemini vision model (built once per worker)
+        model = clients.gemini_model('gemini-pro-vision')
         
         # Prepare the prompt for crop disease detection
         prompt = """
@@ -104,7 +93,8 @@ def analyze_image(image_path):
         """
         
         # Generate content with the image
-        response = model.generate_content([prompt, img_bytes], safety_settings=safety_settings)
+        response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": img_bytes}],
+                                          safety_settings=safety_settings)
         
         # Check if response has text attribute
         if hasattr(response, 'text'):
@@ -113,206 +103,228 @@ def analyze_image(image_path):
             # Handle case where response might be in a different format
             return str(response)
     except Exception as e:
-        print(f"Image analysis error: {e}")
+        logs.error("Image analysis failed", image=image_path, error=str(e))
         return f"Error analyzing image: {str(e)}"
 
+# Diagnoses of identical or near-identical photos are reused (see images.py)
+image_cache = images.ImageAnalysisCache()
+
+def analyze_crop_image(image_path, digest):
+    """analyze_image behind the content hash / perceptual hash cache; records the result"""
+    cached, phash = image_cache.lookup(image_path, digest)
+    if cached is not None:
+        # Cache hits are logged too, so image_analysis keeps every upload (not indexed again)
+        image_cache.record(image_path, cached, digest, None)
+        return cached
+    
+    result = analyze_image(image_path)
+    if is_cacheable(result):
+        image_cache.record(image_path, result, digest, phash)
+    else:
+        save_image_analysis(image_path, result)
+    return result
+
 # --- Image Analysis Endpoint ---
 @app.route('/analyze_image', methods=['POST'])
+@ratelimit.limited(ratelimit.image, lambda message: {'result': message})
 def analyze_image_endpoint():
-    print("Received image analysis request")
-    
     if 'image' not in request.files:
-        print("Error: No image file in request")
+        logs.warning("Image analysis request without an image file")
         return jsonify({'result': 'Please upload an image file'})
     
     image_file = request.files['image']
     if image_file.filename == '':
-        print("Error: Empty filename")
+        logs.warning("Image analysis request with an empty filename")
         return jsonify({'result': 'No file selected'})
     
     try:
-        # Ensure uploads directory exists
-        upload_dir = app.config['UPLOAD_FOLDER']
-        print(f"Ensuring upload directory exists: {upload_dir}")
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Create a secure filename and save the file
-        filename = secure_filename(image_file.filename)
-        image_path = os.path.join(upload_dir, filename)
-        print(f"Saving image to: {image_path}")
-        image_file.save(image_path)
-        
-        # Analyze the image
-        print("Starting image analysis...")
-        result = analyze_image(image_path)
-        print(f"Analysis result: {result[:100]}...")  # Print first 100 chars of result
-        
-        return jsonify({'result': result})
+        # Store the upload under its content hash (resent photos reuse the same file)
+        image_path, digest = images.save_upload(image_file, app.config['UPLOAD_FOLDER'])
+        logs.info("Image upload saved", image=image_path)
+        
+        # Analyze the image in the background; the client polls /api/jobs/<id>
+        return job_accepted(jobs.queue.submit("image_analysis", image_path, digest))
+    except jobs.QueueFull as e:
+        return jsonify({'result': str(e)}), 503
     except Exception as e:
-        print(f"Error in image analysis endpoint: {str(e)}")
+        logs.error("Image analysis request failed", error=str(e))
         return jsonify({'result': f"Sorry, there was an error analyzing the image: {str(e)}"})
 
 # --- Weather Forecast with Gemini ---
+def fetch_weather_forecast(lat, lon):
+    """Fetch the 5-day forecast for a point and the farming advice for it (uncached)"""
+    # Get weather data from OpenWeatherMap API
+    weather_url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric"
+    with concurrency.upstream("weather"), metrics.timer("weather_fetch"):
+        response = clients.http_get(weather_url)
+    
+    if response.status_code != 200:
+        return None
+    
+    weather_data = response.json()
+    
+    # Group by day
+    daily_forecasts = {}
+    for item in weather_data.get('list', []):
+        date = datetime.fromtimestamp(item['dt']).strftime('%Y-%m-%d')
+        if date not in daily_forecasts:
+            daily_forecasts[date] = []
+        daily_forecasts[date].append(item)
+    
+    # Create summary for each day
+    summary = ""
+    for date, items in list(daily_forecasts.items())[:5]:  # Limit to 5 days
+        day_name = datetime.strptime(date, '%Y-%m-%d').strftime('%A')
+        temps = [item['main']['temp'] for item in items]
+        humidity = [item['main']['humidity'] for item in items]
+        descriptions = [item['weather'][0]['description'] for item in items]
+        
+        summary += f"{day_name} ({date}):\n"
+        summary += f"  Temperature: {min(temps):.1f}°C to {max(temps):.1f}°C\n"
+        summary += f"  Humidity: {sum(humidity)//len(humidity)}%\n"
+        summary += f"  Conditions: {', '.join(set(descriptions))}\n\n"
+    
+    # Get farming advice based on weather using Gemini
+    farming_advice = ""
+    if GEMINI_API_KEY and genai:
+        model = clients.gemini_model('gemini-1.5-flash')
+        prompt = f"""
+        Based on this weather forecast, provide farming advice:
+        
+        Weather forecast (next 5 days):
+        
+        {summary}
+        
+        What agricultural activities should farmers consider? What precautions should they take?
+        Focus on practical advice related to irrigation, pest control, harvesting, and crop protection.
+        """
+        
+        response = model.generate_content(prompt, safety_settings=safety_settings)
+        farming_advice = response.text
+    
+    return weather.Forecast(summary, farming_advice, time.time())
+
+# Forecasts and advice are shared by everyone asking from the same grid cell
+weather_cache = weather.WeatherCache(fetch_weather_forecast)
+
 def get_weather_forecast(location):
     try:
-        # Get coordinates from location name
-        geolocator = Nominatim(user_agent="farmer_advisory_app")
-        location_data = geolocator.geocode(location)
+        # Get coordinates from location name (cached, gazetteer first, Nominatim last)
+        with metrics.timer("geocoding"):
+            location_data = geocoding.geocode(location)
         
         if not location_data:
             return "Location not found. Please try a different location name."
         
         lat, lon = location_data.latitude, location_data.longitude
         
-        # Get weather data from OpenWeatherMap API
-        weather_url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric"
-        response = requests.get(weather_url)
+        # Cached per grid cell; stale entries are served while a refresh runs
+        forecast = weather_cache.get(lat, lon)
         
-        if response.status_code != 200:
+        if forecast is None:
             return "Weather data unavailable. Please try again later."
         
-        weather_data = response.json()
-        
-        # Process weather data for Gemini
-        forecast_text = f"Weather forecast for {location} (next 5 days):\n\n"
-        
-        # Group by day
-        daily_forecasts = {}
-        for item in weather_data.get('list', []):
-            date = datetime.fromtimestamp(item['dt']).strftime('%Y-%m-%d')
-            if date not in daily_forecasts:
-                daily_forecasts[date] = []
-            daily_forecasts[date].append(item)
-        
-        # Create summary for each day
-        for date, items in list(daily_forecasts.items())[:5]:  # Limit to 5 days
-            day_name = datetime.strptime(date, '%Y-%m-%d').strftime('%A')
-            temps = [item['main']['temp'] for item in items]
-            humidity = [item['main']['humidity'] for item in items]
-            descriptions = [item['weather'][0]['description'] for item in items]
-            
-            forecast_text += f"{day_name} ({date}):\n"
-            forecast_text += f"  Temperature: {min(temps):.1f}°C to {max(temps):.1f}°C\n"
-            forecast_text += f"  Humidity: {sum(humidity)//len(humidity)}%\n"
-            forecast_text += f"  Conditions: {', '.join(set(descriptions))}\n\n"
-        
-        # Get farming advice based on weather using Gemini
-        if GEMINI_API_KEY and genai:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            prompt = f"""
-            Based on this weather forecast, provide farming advice:
-            
-            {forecast_text}
-            
-            What agricultural activities should farmers consider? What precautions should they take?
-            Focus on practical advice related to irrigation, pest control, harvesting, and crop protection.
-            """
-            
-            response = model.generate_content(prompt, safety_settings=safety_settings)
-            farming_advice = response.text
-            
-            return f"{forecast_text}\n\nFARMING RECOMMENDATIONS:\n{farming_advice}"
+        forecast_text = f"Weather forecast for {location} (next 5 days):\n\n{forecast.summary}"
+        
+        if forecast.advice:
+            return f"{forecast_text}\n\nFARMING RECOMMENDATIONS:\n{forecast.advice}"
         
         return forecast_text
     
     except Exception as e:
-        print(f"Weather forecast error: {e}")
+        logs.error("Weather forecast failed", location=location, error=str(e))
         return f"Error getting weather forecast: {str(e)}"
 
 # --- Market Price Tracking ---
-def get_crop_prices(crop_name):
+def gemini_market_advice(summary) -> str:
+    """Market advisory for a crop's price summary (cached per crop and trend, see market.py)"""
+    if not (GEMINI_API_KEY and genai):
+        return None
+    model = clients.gemini_model('gemini-1.5-flash')
+    prompt = f"""
+    Based on these market prices for {summary.crop}:
+    - Minimum: ₹{summary.min:.0f} per quintal
+    - Maximum: ₹{summary.max:.0f} per quintal
+    - Average: ₹{summary.avg:.0f} per quintal
+    - Price Trend: {summary.trend}
+    
+    Provide advice to farmers about:
+    1. Whether this is a good time to sell their {summary.crop} crop
+    2. Market outlook for the coming weeks
+    3. Storage recommendations if applicable
+    4. Alternative markets or value-addition opportunities
+    
+    Keep the advice practical and actionable for Indian farmers.
+    """
+    return model.generate_content(prompt, safety_settings=safety_settings).text
+
+market_advice = market.AdvisoryCache(gemini_market_advice)
+
+def get_crop_prices(crop_name, location=None):
     try:
-        # This would ideally connect to a real agricultural price API
-        # For demonstration, we'll use a simulated response
-        
-        # Simulate API call with mock data
-        crops_data = {
-            "rice": {"min": 1800, "max": 2200, "avg": 2000, "trend": "stable"},
-            "wheat": {"min": 1900, "max": 2300, "avg": 2100, "trend": "rising"},
-            "cotton": {"min": 5500, "max": 6200, "avg": 5800, "trend": "falling"},
-            "sugarcane": {"min": 280, "max": 320, "avg": 300, "trend": "stable"},
-            "maize": {"min": 1700, "max": 1900, "avg": 1800, "trend": "rising"},
-            "potato": {"min": 1200, "max": 1800, "avg": 1500, "trend": "volatile"},
-            "tomato": {"min": 1500, "max": 2500, "avg": 2000, "trend": "falling"},
-            "onion": {"min": 1800, "max": 2800, "avg": 2300, "trend": "rising"},
-        }
+        # Summary from the in-memory mandi price index (see market.py)
+        summary = market.prices.summary(crop_name, location)
+        if summary is None:
+            return f"Price data for {crop_name} is not available. Please try another crop."
         
-        # Normalize crop name for lookup
-        crop_name = crop_name.lower().strip()
+        # Format the response
+        response = f"Current market prices for {summary.crop.title()} ({summary.scope}"
+        if summary.markets > 1:
+            response += f", {summary.markets} markets, {summary.start:%d %b} - {summary.end:%d %b %Y}"
+        response += "):\n"
+        response += f"Minimum: ₹{summary.min:.0f} per quintal\n"
+        response += f"Maximum: ₹{summary.max:.0f} per quintal\n"
+        response += f"Average: ₹{summary.avg:.0f} per quintal\n"
+        if summary.end > summary.start:
+            response += f"Latest: ₹{summary.latest:.0f} per quintal (7-day average ₹{summary.ma_short:.0f})\n"
+        response += f"Price Trend: {summary.trend.title()}\n\n"
         
-        if crop_name in crops_data:
-            data = crops_data[crop_name]
-            
-            # Format the response
-            response = f"Current market prices for {crop_name.title()}:\n"
-            response += f"Minimum: ₹{data['min']} per quintal\n"
-            response += f"Maximum: ₹{data['max']} per quintal\n"
-            response += f"Average: ₹{data['avg']} per quintal\n"
-            response += f"Price Trend: {data['trend'].title()}\n\n"
-            
-            # Get market advice using Gemini
-            if GEMINI_API_KEY and genai:
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                prompt = f"""
-                Based on these market prices for {crop_name}:
-                - Minimum: ₹{data['min']} per quintal
-                - Maximum: ₹{data['max']} per quintal
-                - Average: ₹{data['avg']} per quintal
-                - Price Trend: {data['trend']}
-                
-                Provide advice to farmers about:
-                1. Whether this is a good time to sell their {crop_name} crop
-                2. Market outlook for the coming weeks
-                3. Storage recommendations if applicable
-                4. Alternative markets or value-addition opportunities
-                
-                Keep the advice practical and actionable for Indian farmers.
-                """
-                
-                response_obj = model.generate_content(prompt, safety_settings=safety_settings)
-                market_advice = response_obj.text
-                
-                response += f"MARKET ADVISORY:\n{market_advice}"
-            
-            return response
-        else:
-            return f"Price data for {crop_name} is not available. Please try another crop."
+        # Market advice (Gemini), reused for the same crop and trend
+        market_advice_text = market_advice.get(summary)
+        if market_advice_text:
+            response += f"MARKET ADVISORY:\n{market_advice_text}"
+        
+        return response
     
     except Exception as e:
-        print(f"Market price error: {e}")
+        logs.error("Market prices failed", crop=crop_name, location=location, error=str(e))
         return f"Error retrieving market prices: {str(e)}"
 
 # --- Seasonal Crops Advisory ---
+def gemini_seasonal_advice(region, season):
+    """Region and season specific crop recommendations; None without Gemini.
+
+    Changing this prompt should come with a SEASONAL_ADVICE_VERSION bump so the
+    stored answers are regenerated.
+    """
+    if not (GEMINI_API_KEY and genai):
+        return None
+    model = clients.gemini_model('gemini-1.5-flash')
+    prompt = f"""
+    Provide detailed seasonal crop recommendations for farmers in {region} during {season} season.
+    
+    Include:
+    1. Top 5 recommended crops to plant now in {region} during {season}
+    2. Optimal planting times and methods
+    3. Expected water requirements
+    4. Common challenges during this season and how to address them
+    5. Intercropping opportunities if applicable
+    
+    Format your response in a clear, structured way that would be helpful for a farmer.
+    """
+    
+    response = model.generate_content(prompt, safety_settings=safety_settings)
+    return response.text
+
+# Precomputed per (region, season), generated on demand for regions not in SEASONAL_REGIONS
+seasonal_advice = seasonal.SeasonalAdvisory(gemini_seasonal_advice, regions=seasonal.SEASONAL_REGIONS)
+
 def get_seasonal_crops_advice(region, season=None):
     try:
-        # Determine current season if not provided
-        if not season:
-            current_month = datetime.now().month
-            if 3 <= current_month <= 6:
-                season = "summer"
-            elif 7 <= current_month <= 10:
-                season = "monsoon"
-            else:
-                season = "winter"
-        
-        # Use Gemini to provide region and season specific crop recommendations
-        if GEMINI_API_KEY and genai:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            prompt = f"""
-            Provide detailed seasonal crop recommendations for farmers in {region} during {season} season.
-            
-            Include:
-            1. Top 5 recommended crops to plant now in {region} during {season}
-            2. Optimal planting times and methods
-            3. Expected water requirements
-            4. Common challenges during this season and how to address them
-            5. Intercropping opportunities if applicable
-            
-            Format your response in a clear, structured way that would be helpful for a farmer.
-            """
-            
-            response = model.generate_content(prompt, safety_settings=safety_settings)
-            return response.text
+        season = seasonal.normalize_season(season)
+        advice = seasonal_advice.get(region, season)
+        if advice:
+            return advice
         else:
             # Fallback if Gemini is not available
             seasonal_crops = {
@@ -330,16 +342,48 @@ def get_seasonal_crops_advice(region, season=None):
             return response
     
     except Exception as e:
-        print(f"Seasonal crops advice error: {e}")
+        logs.error("Seasonal crops advice failed", region=region, season=season, error=str(e))
         return f"Error getting seasonal crops advice: {str(e)}"
 
 # --- Translation with Gemini ---
+def gemini_translate_batch(segments, target_language):
+    """Translate a list of sentences in one request; None if the reply can't be parsed"""
+    model = clients.gemini_model('gemini-1.5-flash')
+    if len(segments) == 1:
+        prompt = f"""
+        Translate the following text to {target_language}:
+        
+        {segments[0]}
+        
+        Provide only the translated text without any additional explanations.
+        """
+        response = model.generate_content(prompt, safety_settings=safety_settings)
+        return [response.text.strip()]
+    
+    prompt = f"""
+    Translate each string in the following JSON array to {target_language}.
+    Reply with only a JSON array of the translated strings, in the same order and with the same number of items.
+    
+    {json.dumps(segments, ensure_ascii=False)}
+    """
+    response = model.generate_content(prompt, safety_settings=safety_settings)
+    return translation.parse_batch_reply(response.text, len(segments))
+
+# Sentences already translated into a language are reused (see translation.py)
+translation_memory = translation.TranslationMemory(gemini_translate_batch)
+
 def translate_text(text, target_language="Malayalam"):
     if not (GEMINI_API_KEY and genai):
         return "Translation requires Gemini API. Please configure your API key."
     
+    started = time.perf_counter()
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        translated = translation_memory.translate(text, target_language)
+        if translated is not None:
+            return translated
+        
+        # The batched reply was malformed; translate the whole text in one go
+        model = clients.gemini_model('gemini-1.5-flash')
         prompt = f"""
         Translate the following text to {target_language}:
         
@@ -352,23 +396,20 @@ def translate_text(text, target_language="Malayalam"):
         return response.text
     
     except Exception as e:
-        print(f"Translation error: {e}")
+        logs.error("Translation failed", language=target_language, error=str(e))
         return f"Error translating text: {str(e)}"
+    finally:
+        metrics.observe("stage_duration_seconds", time.perf_counter() - started, stage="translation")
 
 # --- Voice Synthesis ---
-def text_to_speech(text):
-    if not pyttsx3:
-        return None
-    
+def text_to_speech(text, language=None, voice=None):
     try:
-        engine = pyttsx3.init()
-        # Save to a temporary file
-        temp_file = os.path.join("uploads", "response.mp3")
-        engine.save_to_file(text, temp_file)
-        engine.runAndWait()
-        return temp_file
+        # One engine per worker; files are cached by (text, voice, language) in static/audio
+        # pyttsx3 blocks in native code, so under gevent it runs on a real thread
+        with metrics.timer("tts"):
+            return concurrency.offload(tts.synthesizer.synthesize, text, voice=voice, language=language)
     except Exception as e:
-        print(f"Text-to-speech error: {e}")
+        logs.error("Text-to-speech failed", language=language, voice=voice, error=str(e))
         return None
 
 # --- Speech Recognition ---
@@ -379,7 +420,7 @@ def recognize_speech():
     recognizer = sr.Recognizer()
     try:
         with sr.Microphone() as source:
-            print("Listening...")
+            logs.info("Listening for speech")
             audio = recognizer.listen(source)
             text = recognizer.recognize_google(audio)
             return text
@@ -388,129 +429,236 @@ def recognize_speech():
     except sr.RequestError:
         return "Could not request results"
     except Exception as e:
-        print(f"Speech recognition error: {e}")
+        logs.error("Speech recognition failed", error=str(e))
         return f"Error: {str(e)}"
 
-# --- Rule-based fallback logic ---
+# --- Offline fallback logic ---
 def rule_based_advice(query: str) -> str:
-    query = query.lower()
-    if "pest" in query:
-        return "Use eco-friendly pesticides and monitor crop leaves daily."
-    elif "water" in query or "irrigation" in query:
-        return "Ensure drip irrigation and avoid overwatering."
-    elif "soil" in query:
-        return "Test soil pH and enrich with organic compost."
-    elif "weather" in query or "rain" in query:
-        return "Check the local forecast; consider protective covering for crops."
-    elif "subsidy" in query or "scheme" in query:
-        return "Visit your Krishibhavan office for the latest subsidy and scheme details."
-    else:
-        return "Consult your nearest agricultural office for expert advice."
+    """Best answer from the local FAQ corpus (see knowledge.py) when the LLMs are unavailable"""
+    match = knowledge.base.answer(query, knowledge.KNOWLEDGE_FALLBACK_CONFIDENCE)
+    if match:
+        return match.answer
+    return "Consult your nearest agricultural office for expert advice."
 
 # --- Gemini integration ---
 def gemini_based_advice(prompt: str) -> str:
     if not (GEMINI_API_KEY and genai):
         return ""
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        resp = model.generate_content(prompt, safety_settings=safety_settings)
+        model = clients.gemini_model("gemini-1.5-flash")
+        resp = model.generate_content(prompt, safety_settings=safety_settings,
+                                      request_options={"timeout": providers.LLM_TIMEOUT})
         return resp.text if hasattr(resp, "text") else str(resp)
     except Exception as e:
-        print("Gemini API failed:", e)
+        logs.error("Gemini API failed", error=str(e))
         return ""
 
+def gemini_stream_advice(prompt: str):
+    """Yield Gemini's answer in chunks as they are generated"""
+    if not (GEMINI_API_KEY and genai):
+        return
+    model = clients.gemini_model("gemini-1.5-flash")
+    # The upstream slot is held until the whole answer has arrived
+    with concurrency.upstream("gemini"), metrics.timer("llm", provider="gemini", model="gemini-1.5-flash"):
+        resp = model.generate_content(prompt, safety_settings=safety_settings, stream=True,
+                                      request_options={"timeout": providers.LLM_TIMEOUT})
+        for chunk in resp:
+            yield chunk.text
+
 # --- OpenAI integration ---
 def openai_based_advice(prompt: str) -> str:
     if not (OPENAI_API_KEY and openai):
         return ""
     try:
+        with concurrency.upstream("openai"), metrics.timer("llm", provider="openai", model="gpt-3.5-turbo"):
+            resp = openai.ChatCompletion.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "You are an agricultural advisor for Indian farmers. Give concise, clear advice in simple language."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=200,
+                request_timeout=providers.LLM_TIMEOUT
+            )
+        return resp.choices[0].message["content"].strip()
+    except Exception as e:
+        logs.error("OpenAI API failed", error=str(e))
+        return ""
+
+def openai_stream_advice(prompt: str):
+    """Yield OpenAI's answer in chunks as they are generated"""
+    if not (OPENAI_API_KEY and openai):
+        return
+    with concurrency.upstream("openai"), metrics.timer("llm", provider="openai", model="gpt-3.5-turbo"):
         resp = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an agricultural advisor for Indian farmers. Give concise, clear advice in simple language."},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=200
+            max_tokens=200,
+            request_timeout=providers.LLM_TIMEOUT,
+            stream=True
         )
-        return resp.choices[0].message["content"].strip()
-    except Exception as e:
-        print("OpenAI API failed:", e)
-        return ""
+        for chunk in resp:
+            yield chunk["choices"][0]["delta"].get("content", "")
+
+# --- Response cache ---
+def query_entities(query: str):
+    """Crop, season and place a query names; a near-duplicate cached answer must name the same"""
+    route = intent_router.route(query)
+    return route.crop, route.season, route.location or route.place
+
+response_cache = ResponseCache(entities=query_entities)
+
+# Responses that signal a failure rather than an answer; these are never cached
+UNCACHEABLE_PREFIXES = (
+    "Error",
+    "I'm sorry",
+    "Location not found",
+    "Weather data unavailable",
+    "Price data for",
+    "Translation requires",
+    "Image analysis requires",
+    "Required module",
+)
+
+def is_cacheable(response: str, query: str = "") -> bool:
+    if not response or response.startswith(UNCACHEABLE_PREFIXES):
+        return False
+    # A rule-based answer means the LLMs were unavailable; ask them again next time
+    return not (query and response == rule_based_advice(query))
 
 # --- Unified advisory logic ---
-def get_advice(query: str) -> str:
+# Gemini first; OpenAI is started as a hedge if Gemini is slow, or at once if it fails
+# (unconfigured providers are left out so they don't trip their circuit breakers)
+llm_providers = providers.ProviderChain(
+    ([providers.Provider("gemini", gemini_based_advice, stream=gemini_stream_advice)] if GEMINI_API_KEY and genai else [])
+    + ([providers.Provider("openai", openai_based_advice, stream=openai_stream_advice)] if OPENAI_API_KEY and openai else [])
+)
+
+# Concurrent identical questions share one upstream call, also across workers (see singleflight.py)
+coalescer = singleflight.SingleFlight()
+
+def knowledge_answer(query: str):
+    """The FAQ answer if the query closely matches an FAQ question, so the LLM can be skipped"""
+    if not knowledge.KNOWLEDGE_FAST_PATH:
+        return None
+    match = knowledge.base.answer(query)
+    return match.answer if match else None
+
+def generate_advice(query: str) -> tuple:
+    """Return (advice, source); source is "cache", "knowledge", the LLM provider's name or "rules" (for analytics)"""
     if not query:
-        return "Please enter a valid farming question."
+        return "Please enter a valid farming question.", None
 
-    # Try Gemini first
-    advice = gemini_based_advice(query)
-    if advice:
-        return advice
+    cached = response_cache.get(query, "general")
+    if cached is not None:
+        return cached, "cache"
+
+    answer = knowledge_answer(query)
+    if answer:
+        return answer, "knowledge"
 
-    # Then OpenAI
-    advice = openai_based_advice(query)
+    advice, provider = coalescer.do(("general", normalize_query(query)), lambda: llm_providers.ask(query))
     if advice:
-        return advice
+        response_cache.put(query, "general", advice)
+        return advice, provider
 
     # Fallback to rules
-    return rule_based_advice(query)
+    metrics.inc("rule_based_fallbacks_total")
+    return rule_based_advice(query), "rules"
+
+def stream_advice(query: str):
+    """Like generate_advice, but yields (chunk, source) pairs as the LLM produces the answer"""
+    if not query:
+        yield "Please enter a valid farming question.", None
+        return
+
+    cached = response_cache.get(query, "general")
+    if cached is not None:
+        yield cached, "cache"
+        return
+
+    answer = knowledge_answer(query)
+    if answer:
+        yield answer, "knowledge"
+        return
+
+    # A provider failing mid-answer raises out of this loop (and the coalescer shares no
+    # result), so a truncated answer is never cached
+    chunks = []
+    for chunk, provider in coalescer.stream(("general", normalize_query(query)), lambda: llm_providers.stream(query)):
+        chunks.append(chunk)
+        yield chunk, provider
+    if chunks:
+        response_cache.put(query, "general", "".join(chunks))
+        return
+
+    # Fallback to rules
+    metrics.inc("rule_based_fallbacks_total")
+    yield rule_based_advice(query), "rules"
     
 # --- Chatbot functionality ---
+# Keyword, crop, season and gazetteer place dictionaries compiled once (see intents.py)
+intent_router = intents.IntentRouter(
+    {name: point.name for name, point in geocoding.geocoder.gazetteer.places.items()},
+    resolve=geocoding.known_place,
+)
+
+def route_query(query: str):
+    """intent_router.route, timed as the intent_routing stage"""
+    with metrics.timer("intent_routing"):
+        return intent_router.route(query)
+
+def detect_intent(query: str) -> str:
+    """Classify a chat query as weather, market, seasonal or general"""
+    return route_query(query).intent
+
+def api_answer(query: str, route) -> str:
+    """Answer a weather, market or seasonal query from the APIs and the LLM advice built on them"""
+    # Check if query is about weather
+    if route.intent == "weather":
+        # An unrecognised place name is still worth a geocoder lookup for the forecast
+        return get_weather_forecast(route.location or route.place or intent_router.default_location)
+
+    # Check if query is about market prices
+    elif route.intent == "market":
+        crop = route.crop or market.prices.index.find_in_text(query) or intent_router.default_crop
+        return get_crop_prices(crop, route.location)
+
+    # Check if query is about seasonal crops
+    else:
+        return get_seasonal_crops_advice(route.location or intent_router.default_location, route.season)
+
+def answer_query(query: str, route) -> tuple:
+    """Produce the chatbot answer for an already routed query, as (answer, source)"""
+    # General queries use the general advice function (cached and coalesced there)
+    if route.intent == "general":
+        return generate_advice(query)
+    return coalescer.do((route.intent, normalize_query(query)), lambda: api_answer(query, route)), "api"
+
+def log_chat(query: str, response: str, route, source: str = None) -> str:
+    """Store the query and response for future reference (written in the background)"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    storage.write('INSERT INTO chat_queries (query, response, timestamp, intent, crop, location, source) VALUES (?, ?, ?, ?, ?, ?, ?)', 
+                  (query, response, timestamp, route.intent, route.crop, route.location, source))
+    return timestamp
+
 def get_chatbot_response(query: str) -> dict:
     """Process a chat query and return a structured response for the chatbot interface"""
     try:
-        # Store the query in database for future reference
-        conn = sqlite3.connect('queries.db')
-        cursor = conn.cursor()
-        cursor.execute('CREATE TABLE IF NOT EXISTS chat_queries (id INTEGER PRIMARY KEY, query TEXT, response TEXT, timestamp TEXT)')
-        
         # Process the query based on its content
-        response = ""
-        
-        # Check if query is about weather
-        if any(keyword in query.lower() for keyword in ['weather', 'rain', 'forecast', 'climate']):
-            # Extract location from query or use default
-            location = "Kerala"  # Default location
-            location_keywords = ["in", "at", "for", "near"]
-            for keyword in location_keywords:
-                if f" {keyword} " in query.lower():
-                    location = query.lower().split(f" {keyword} ")[1].split()[0]
-                    location = location.strip("?.,!").title()
-            response = get_weather_forecast(location)
-            
-        # Check if query is about market prices
-        elif any(keyword in query.lower() for keyword in ['price', 'market', 'sell', 'cost', 'rate']):
-            # Extract crop name from query or use default
-            crop = "rice"  # Default crop
-            common_crops = ["rice", "wheat", "cotton", "sugarcane", "maize", "potato", "tomato", "onion"]
-            for c in common_crops:
-                if c in query.lower():
-                    crop = c
-                    break
-            response = get_crop_prices(crop)
-            
-        # Check if query is about seasonal crops
-        elif any(keyword in query.lower() for keyword in ['season', 'crop', 'plant', 'grow', 'cultivate']):
-            # Extract region from query or use default
-            region = "Kerala"  # Default region
-            season = None
-            seasons = ["summer", "winter", "monsoon", "rainy"]
-            for s in seasons:
-                if s in query.lower():
-                    season = s
-                    break
-            response = get_seasonal_crops_advice(region, season)
-            
-        # For all other queries, use the general advice function
-        else:
-            response = get_advice(query)
+        route = route_query(query)
+        intent = route.intent
+        response = response_cache.get(query, intent) if intent != "general" else None
+        source = "cache"
+        if response is None:
+            response, source = answer_query(query, route)
+            if intent != "general" and is_cacheable(response, query):
+                response_cache.put(query, intent, response)
         
-        # Save the query and response to database
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('INSERT INTO chat_queries (query, response, timestamp) VALUES (?, ?, ?)', 
-                      (query, response, timestamp))
-        conn.commit()
-        conn.close()
+        timestamp = log_chat(query, response, route, source)
         
         return {
             "response": response,
@@ -518,149 +666,107 @@ def get_chatbot_response(query: str) -> dict:
         }
         
     except Exception as e:
-        print(f"Chatbot error: {e}")
+        logs.error("Chatbot answer failed", error=str(e))
         return {
             "response": f"I'm sorry, I encountered an error: {str(e)}. Please try again.",
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
 
+def stream_chatbot_response(query: str):
+    """Yield the chatbot answer in chunks; the full text is logged once it is complete.
+
+    Only general questions are streamed token by token. Weather, market and
+    seasonal answers combine API data with LLM advice and arrive in one chunk.
+    The generator's return value is the same dict get_chatbot_response returns.
+    """
+    route = route_query(query)
+    if route.intent != "general":
+        result = get_chatbot_response(query)
+        yield result["response"]
+        return result
+
+    chunks = []
+    source = None
+    try:
+        for chunk, source in stream_advice(query):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        logs.error("Chatbot stream failed", error=str(e))
+        chunk = f"I'm sorry, I encountered an error: {str(e)}. Please try again."
+        chunks.append(chunk)
+        yield chunk
+    response = "".join(chunks)
+    return {
+        "response": response,
+        "timestamp": log_chat(query, response, route, source)
+    }
+
 # --- Audio transcription ---
-def transcribe_audio(file_path: str) -> str:
+def transcribe_audio(file_path: str, language: str = None) -> str:
     try:
-        result = whisper_model.transcribe(file_path)
-        return result.get("text", "").strip()
+        # The Whisper model lives in a shared transcription server that is
+        # started and loaded on first use (see transcription.py); its connection
+        # reads (or an in-process model) would block a gevent worker, so it runs
+        # on a real thread there
+        with metrics.timer("transcription"):
+            return concurrency.offload(transcription.transcribe, file_path, language)
     except Exception as e:
-        print(f"Audio transcription error: {e}")
+        logs.error("Audio transcription failed", audio=file_path, error=str(e))
         return ""
 
+# Language hints accepted by /api/speech-to-text, as codes or names, mapped to Whisper codes
+SPEECH_LANGUAGES = {
+    "en": "en", "english": "en",
+    "ml": "ml", "malayalam": "ml",
+    "hi": "hi", "hindi": "hi",
+    "ta": "ta", "tamil": "ta",
+    "te": "te", "telugu": "te",
+}
+
 # --- Database setup ---
 def init_db():
-    conn = sqlite3.connect("queries.db")
-    c = conn.cursor()
-    
-    # Main queries table
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS queries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question TEXT,
-            response TEXT,
-            query_type TEXT DEFAULT 'general',
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )"""
-    )
-    
-    # Image analysis table
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS image_analysis (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_path TEXT,
-            analysis_result TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )"""
-    )
-    
-    # Weather forecasts table
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS weather_forecasts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            location TEXT,
-            forecast_data TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )"""
-    )
-    
-    # Market prices table
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS market_prices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            crop_name TEXT,
-            price_data TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )"""
-    )
-    
-    # Seasonal crops advice table
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS seasonal_crops (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            region TEXT,
-            season TEXT,
-            advice TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )"""
-    )
-    
-    conn.commit()
-    conn.close()
+    # Tables and indexes are created by the versioned migrations in migrations.py
+    concurrency.offload(lambda: migrations.migrate(storage.get_connection()))
 
-def save_to_db(question: str, response: str, query_type: str = "general"):
-    conn = sqlite3.connect("queries.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO queries (question, response, query_type) VALUES (?, ?, ?)", 
-              (question, response, query_type))
-    conn.commit()
-    conn.close()
+def save_to_db(question: str, response: str, query_type: str = "general", source: str = None):
+    # crop and location make the admin history filterable
+    route = route_query(question)
+    storage.write("INSERT INTO queries (question, response, query_type, crop, location, source) VALUES (?, ?, ?, ?, ?, ?)", 
+                  (question, response, query_type, route.crop, route.location, source))
     
 def save_image_analysis(image_path: str, analysis_result: str):
-    conn = sqlite3.connect("queries.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO image_analysis (image_path, analysis_result) VALUES (?, ?)", 
-              (image_path, analysis_result))
-    conn.commit()
-    conn.close()
+    storage.write("INSERT INTO image_analysis (image_path, analysis_result) VALUES (?, ?)", 
+                  (image_path, analysis_result))
     
 def save_weather_forecast(location: str, forecast_data: str):
-    conn = sqlite3.connect("queries.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO weather_forecasts (location, forecast_data) VALUES (?, ?)", 
-              (location, forecast_data))
-    conn.commit()
-    conn.close()
+    storage.write("INSERT INTO weather_forecasts (location, forecast_data) VALUES (?, ?)", 
+                  (location, forecast_data))
     
 def save_market_price(crop_name: str, price_data: str):
-    conn = sqlite3.connect("queries.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO market_prices (crop_name, price_data) VALUES (?, ?)", 
-              (crop_name, price_data))
-    conn.commit()
-    conn.close()
+    storage.write("INSERT INTO market_prices (crop_name, price_data) VALUES (?, ?)", 
+                  (crop_name, price_data))
     
 def save_seasonal_crops_advice(region: str, season: str, advice: str):
-    conn = sqlite3.connect("queries.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO seasonal_crops (region, season, advice) VALUES (?, ?, ?)", 
-              (region, season, advice))
-    conn.commit()
-    conn.close()
-    
-def save_to_csv(query: str, response: str):
-    """Save query and response to CSV file"""
-    import csv
-    import os
-    from datetime import datetime
+    storage.write("INSERT INTO seasonal_crops (region, season, advice) VALUES (?, ?, ?)", 
+                  (region, season, advice))
     
-    # Create data directory if it doesn't exist
-    os.makedirs('data', exist_ok=True)
-    
-    # CSV file path
-    csv_file = os.path.join('data', 'queries.csv')
-    
-    # Check if file exists to determine if we need to write headers
-    file_exists = os.path.isfile(csv_file)
-    
-    # Current timestamp
-    timestamp = datetime.now().isoformat()
-    
-    # Write to CSV file
-    with open(csv_file, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        
-        # Write headers if file doesn't exist
-        if not file_exists:
-            writer.writerow(['timestamp', 'query', 'response'])
-        
-        # Write data
-        writer.writerow([timestamp, query, response])
+# --- Request ids and timing ---
+@app.before_request
+def start_request():
+    # nginx passes its $request_id; the id is on every log line of the request
+    logs.new_request_id(request.headers.get("X-Request-ID"))
+    g.started = time.perf_counter()
+
+@app.after_request
+def finish_request(response):
+    if "started" in g:
+        response.headers["X-Request-ID"] = logs.request_id()
+        # Streamed answers are timed to their first byte; their stages are timed on their own
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - g.started,
+                        route=route, method=request.method, status=response.status_code)
+    return response
 
 # --- Routes ---
 @app.route("/", methods=["GET", "POST"])
@@ -693,8 +799,8 @@ def index():
                         user_query = (user_query or "") + " " + transcribed_text
 
             if user_query:
-                response = get_advice(user_query)
-                save_to_db(user_query, response, "general")
+                response, source = generate_advice(user_query)
+                save_to_db(user_query, response, "general", source)
                 
                 # Generate translated response if requested
                 if request.form.get("translate") == "on":
@@ -710,21 +816,12 @@ def index():
             if "crop_image" in request.files:
                 image_file = request.files["crop_image"]
                 if image_file.filename:
-                    # Ensure uploads directory exists
-                    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                    
-                    # Create a secure filename and save the file
-                    from werkzeug.utils import secure_filename
-                    filename = secure_filename(image_file.filename)
-                    image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    image_file.save(image_path)
-                    
-                    # Analyze the image and save the result
+                    # Analyze the image (cached by content) and save the result
                     try:
-                        image_analysis_result = analyze_image(image_path)
-                        save_image_analysis(image_path, image_analysis_result)
+                        image_path, digest = images.save_upload(image_file, app.config['UPLOAD_FOLDER'])
+                        image_analysis_result = analyze_crop_image(image_path, digest)
                     except Exception as e:
-                        print(f"Error in image analysis route: {e}")
+                        logs.error("Image analysis request failed", error=str(e))
                         image_analysis_result = f"Error analyzing image: {str(e)}"
         
         # Handle weather forecast
@@ -753,8 +850,8 @@ def index():
         elif request_type == "voice_input":
             voice_text = recognize_speech()
             if voice_text:
-                response = get_advice(voice_text)
-                save_to_db(voice_text, response, "voice")
+                response, source = generate_advice(voice_text)
+                save_to_db(voice_text, response, "voice", source)
                 
                 # Generate translated response if requested
                 if request.form.get("translate") == "on":
@@ -775,70 +872,135 @@ def index():
         seasonal_crops_result=seasonal_crops_result
     )
     
+def sse_event(data: dict, event: str = None) -> str:
+    """Format one Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
+@ratelimit.limited(ratelimit.chat, lambda message: {"error": message})
 def chat_endpoint():
     data = request.json
     query = data.get('message', '')
     
     if not query:
         return jsonify({"error": "No message provided"}), 400
+    
+    # Streaming mode: {"stream": true} or Accept: text/event-stream
+    if data.get('stream') or request.accept_mimetypes.best == 'text/event-stream':
+        def events():
+            chunks = stream_chatbot_response(query)
+            while True:
+                try:
+                    yield sse_event({"delta": next(chunks)})
+                except StopIteration as done:
+                    result = done.value
+                    break
+            export.csv_log.record(query, result["response"])
+            yield sse_event(result, event="done")
+        
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
         
     response = get_chatbot_response(query)
     
-    # Save to CSV file
-    save_to_csv(query, response["response"])
+    # Append to the CSV query log (buffered, written in the background)
+    export.csv_log.record(query, response["response"])
     
     return jsonify(response)
 
+@app.route("/api/cache/stats")
+def cache_stats_api():
+    stats = response_cache.stats()
+    stats["weather"] = weather_cache.stats()
+    stats["images"] = image_cache.stats()
+    stats["tts"] = tts.synthesizer.stats()
+    stats["translation"] = translation_memory.stats()
+    stats["market_advice"] = market_advice.stats()
+    stats["market_prices"] = market.prices.stats()
+    stats["seasonal_advice"] = seasonal_advice.stats()
+    stats["knowledge"] = knowledge.base.stats()
+    return jsonify(stats)
+
+@app.route("/api/stats")
+def stats_api():
+    # Served from the rollup tables only (see analytics.py); since/until as on /api/admin
+    try:
+        since = request.args.get("since")
+        until = request.args.get("until")
+        return jsonify(analytics.rollups.report(
+            period=request.args.get("period", "day"),
+            since=history.parse_date(since) if since else None,
+            until=history.parse_date(until, end=True) if until else None,
+            top=request.args.get("top", 10, type=int),
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/providers/stats")
+def provider_stats_api():
+    stats = llm_providers.stats()
+    stats["coalescing"] = coalescer.stats()
+    stats["concurrency"] = concurrency.stats()
+    stats["rate_limits"] = {bucket.name: bucket.stats() for bucket in (ratelimit.chat, ratelimit.image, ratelimit.speech)}
+    return jsonify(stats)
+
+@app.route("/metrics")
+def metrics_api():
+    # Prometheus scrape target; adds up the metrics of all workers (see metrics.py)
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route("/admin")
 def admin():
-    conn = sqlite3.connect("queries.db")
-    c = conn.cursor()
-    
-    # Get general queries
-    c.execute("SELECT * FROM queries ORDER BY id DESC LIMIT 50")
-    queries = c.fetchall()
-    
-    # Get image analyses
-    c.execute("SELECT * FROM image_analysis ORDER BY id DESC LIMIT 20")
-    image_analyses = c.fetchall()
-    
-    # Get weather forecasts
-    c.execute("SELECT * FROM weather_forecasts ORDER BY id DESC LIMIT 20")
-    weather_forecasts = c.fetchall()
-    
-    # Get market prices
-    c.execute("SELECT * FROM market_prices ORDER BY id DESC LIMIT 20")
-    market_prices = c.fetchall()
-    
-    # Get seasonal crops advice
-    c.execute("SELECT * FROM seasonal_crops ORDER BY id DESC LIMIT 20")
-    seasonal_crops = c.fetchall()
-    
-    conn.close()
-    
-    return render_template(
-        "admin.html", 
-        queries=queries,
-        image_analyses=image_analyses,
-        weather_forecasts=weather_forecasts,
-        market_prices=market_prices,
-        seasonal_crops=seasonal_crops
-    )
+    # One indexed page of recent queries; the other tables, filters and older
+    # pages are loaded by the dashboard from /api/admin/<kind>
+    return render_template("admin.html", kinds=list(history.TABLES), first_page=history.page("queries"))
+
+@app.route("/api/admin/<kind>")
+def admin_history_api(kind):
+    if kind not in history.TABLES:
+        return jsonify({"error": f"Unknown history type: {kind}"}), 404
+    try:
+        return jsonify(history.page(kind, request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/admin/export/<kind>")
+def admin_export_api(kind):
+    # CSV download of a history table, streamed in batches (see export.py)
+    if kind not in history.TABLES:
+        return jsonify({"error": f"Unknown history type: {kind}"}), 404
+    since, until = request.args.get("since"), request.args.get("until")
+    try:
+        # Validate before streaming; errors inside the generator would cut the download short
+        for value in (since, until):
+            if value:
+                history.parse_date(value)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(stream_with_context(export.iter_csv(kind, since, until)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{kind}.csv"'})
 
 # API routes for AJAX requests
 @app.route("/api/speech-to-text", methods=["POST"])
+@ratelimit.limited(ratelimit.speech, lambda message: {"success": False, "error": message})
 def speech_to_text_api():
     try:
         if "audio" in request.files:
             audio_file = request.files["audio"]
             if audio_file.filename:
-                audio_path = os.path.join("uploads", audio_file.filename)
+                filename = f"{uuid.uuid4().hex[:12]}_{secure_filename(audio_file.filename)}"
+                audio_path = os.path.join("uploads", filename)
                 os.makedirs("uploads", exist_ok=True)
                 audio_file.save(audio_path)
-                transcribed_text = transcribe_audio(audio_path)
-                return jsonify({"success": True, "text": transcribed_text})
+                # Optional spoken language hint ("ml", "hi", ...) skips language detection
+                language = SPEECH_LANGUAGES.get(request.form.get("language", "").lower())
+                return job_accepted(jobs.queue.submit("transcription", audio_path, language))
         return jsonify({"success": False, "error": "No audio file provided"})
+    except jobs.QueueFull as e:
+        return jsonify({"success": False, "error": str(e)}), 503
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
@@ -848,18 +1010,76 @@ def text_to_speech_api():
         data = request.get_json()
         text = data.get("text")
         if text:
-            audio_path = text_to_speech(text)
-            if audio_path:
-                return jsonify({"success": True, "audio_path": audio_path})
-        return jsonify({"success": False, "error": "Failed to generate speech"})
+            return job_accepted(jobs.queue.submit("tts", text, data.get("language"), data.get("voice")))
+        return jsonify({"success": False, "error": "No text provided"})
+    except jobs.QueueFull as e:
+        return jsonify({"success": False, "error": str(e)}), 503
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+def job_accepted(job_id: str):
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": jobs.QUEUED,
+        "status_url": f"/api/jobs/{job_id}"
+    }), 202
+
+@app.route("/api/jobs/<job_id>")
+def job_status_api(job_id):
+    job = jobs.queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
 @app.route("/audio/<filename>")
 def serve_audio(filename):
+    if os.path.exists(os.path.join(tts.synthesizer.directory, filename)):
+        # Synthesized files are named by content hash and never change
+        response = send_from_directory(tts.synthesizer.directory, filename, max_age=365 * 24 * 3600)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
     return send_from_directory("uploads", filename)
 
+# --- Background jobs ---
+def image_analysis_job(image_path: str, digest: str) -> dict:
+    return {"result": analyze_crop_image(image_path, digest)}
+
+def transcription_job(audio_path: str, language: str = None) -> dict:
+    return {"text": transcribe_audio(audio_path, language)}
+
+def tts_job(text: str, language: str = None, voice: str = None) -> dict:
+    audio_path = text_to_speech(text, language, voice)
+    if not audio_path:
+        raise RuntimeError("Failed to generate speech")
+    return {"audio_path": audio_path, "audio_url": f"/audio/{os.path.basename(audio_path)}"}
+
+jobs.queue.register("image_analysis", image_analysis_job, workers=jobs.JOB_WORKERS_IMAGE)
+jobs.queue.register("transcription", transcription_job, workers=jobs.JOB_WORKERS_TRANSCRIPTION)
+# pyttsx3 drives one speech engine per process, so synthesis is never run concurrently
+jobs.queue.register("tts", tts_job, workers=1)
+
+# Make sure the schema exists in every gunicorn worker, not only under `python app.py`
+init_db()
+geocoding.geocoder.preload()
+jobs.queue.purge()
+analytics.rollups.start()
+market.prices.start()
+seasonal_advice.start()
+knowledge.base.load()
+
+# Cache hits and misses on /metrics come from the caches' own counters
+for name, cache in (("response", response_cache), ("weather", weather_cache), ("images", image_cache),
+                    ("tts", tts.synthesizer), ("translation", translation_memory),
+                    ("market_advice", market_advice), ("seasonal_advice", seasonal_advice)):
+    metrics.registry.register_cache(name, cache.stats)
+
+# Warm the response cache from the stored query history
+try:
+    response_cache.warm_from_db(storage.get_connection(), classify=detect_intent, is_cacheable=is_cacheable)
+except Exception as e:
+    logs.error("Response cache warm-up failed", error=str(e))
+
 # --- Main ---
 if __name__ == "__main__":
-    init_db()
     app.run(debug=True)
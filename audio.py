@@ -0,0 +1,140 @@
+# filepath: audio.py
+"""Audio preparation for Whisper: decode, trim silence, cut into 30 s chunks.
+
+Uploads are decoded in memory to 16 kHz mono float32 NumPy buffers, using
+soundfile (WAV/FLAC/OGG/MP3) or PyAV (WebM/Opus from browsers, M4A, ...) when
+installed, and the ffmpeg command line only as a last resort. An energy-based
+voice activity detector then drops leading/trailing silence and long pauses,
+and the remaining speech is packed into chunks of at most one Whisper window
+(30 s), which the transcription server decodes as a single batch.
+"""
+import os
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # what Whisper expects
+CHUNK_SECONDS = 30  # Whisper's input window
+
+VAD_FRAME_MS = 30
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "12"))  # speech must be this much louder than the noise floor
+VAD_MIN_DB = -55.0  # quieter frames are never speech
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "200"))  # kept around each speech segment
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "600"))  # shorter pauses stay in the segment
+SEGMENT_GAP_MS = 100  # silence inserted between segments packed into one chunk
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+def _lowpass(samples, rate):
+    """Windowed-sinc anti-aliasing filter at 8 kHz before downsampling to 16 kHz."""
+    cutoff = (SAMPLE_RATE / 2) / rate
+    n = np.arange(-32, 33)
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(len(n))
+    return np.convolve(samples, (taps / taps.sum()).astype(np.float32), mode="same")
+
+
+def resample(samples, rate):
+    if rate == SAMPLE_RATE or not len(samples):
+        return samples.astype(np.float32, copy=False)
+    if rate > SAMPLE_RATE:
+        samples = _lowpass(samples, rate)
+    duration = len(samples) / rate
+    positions = np.arange(int(duration * SAMPLE_RATE)) * (rate / SAMPLE_RATE)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def _decode_soundfile(path):
+    data, rate = soundfile.read(path, dtype="float32", always_2d=True)
+    return data.mean(axis=1), rate
+
+
+def _decode_av(path):
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+    frames = []
+    with av.open(path) as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                frames.append(out.to_ndarray().reshape(-1))
+        for out in resampler.resample(None):
+            frames.append(out.to_ndarray().reshape(-1))
+    return (np.concatenate(frames) if frames else np.zeros(0, dtype=np.float32)), SAMPLE_RATE
+
+
+def _decode_ffmpeg(path):
+    import whisper
+    return whisper.load_audio(path, sr=SAMPLE_RATE), SAMPLE_RATE
+
+
+def decode(path) -> np.ndarray:
+    """Return the audio file as 16 kHz mono float32 samples in [-1, 1]."""
+    errors = []
+    for decoder, available in ((_decode_soundfile, soundfile), (_decode_av, av), (_decode_ffmpeg, True)):
+        if not available:
+            continue
+        try:
+            samples, rate = decoder(path)
+            return resample(np.asarray(samples, dtype=np.float32), rate)
+        except Exception as e:
+            errors.append(f"{decoder.__name__}: {e}")
+    raise RuntimeError(f"Could not decode {path} ({'; '.join(errors)})")
+
+
+def speech_segments(samples):
+    """Return [(start, end)] sample ranges that contain speech."""
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return [(0, len(samples))] if len(samples) else []
+
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    threshold = max(np.percentile(db, 10) + VAD_MARGIN_DB, VAD_MIN_DB)
+    voiced = np.flatnonzero(db > threshold)
+    if not len(voiced):
+        # Nothing stands out from the noise floor; let Whisper decide
+        return [(0, len(samples))] if db.max() > VAD_MIN_DB else []
+
+    # Split where the pause between voiced frames is long enough
+    max_gap = VAD_MIN_SILENCE_MS // VAD_FRAME_MS
+    breaks = np.flatnonzero(np.diff(voiced) > max_gap)
+    starts = np.concatenate([[voiced[0]], voiced[breaks + 1]])
+    ends = np.concatenate([voiced[breaks], [voiced[-1]]]) + 1
+
+    pad = SAMPLE_RATE * VAD_PADDING_MS // 1000
+    return [(max(0, s * frame - pad), min(len(samples), e * frame + pad)) for s, e in zip(starts, ends)]
+
+
+def pack_chunks(samples, segments):
+    """Concatenate speech segments into chunks no longer than one Whisper window."""
+    limit = SAMPLE_RATE * CHUNK_SECONDS
+    gap = np.zeros(SAMPLE_RATE * SEGMENT_GAP_MS // 1000, dtype=np.float32)
+    chunks, current, length = [], [], 0
+    for start, end in segments:
+        # Segments longer than a window are split at window boundaries
+        for piece_start in range(start, end, limit):
+            piece = samples[piece_start:min(end, piece_start + limit)]
+            if current and length + len(gap) + len(piece) > limit:
+                chunks.append(np.concatenate(current))
+                current, length = [], 0
+            if current:
+                current.append(gap)
+                length += len(gap)
+            current.append(piece)
+            length += len(piece)
+    if current:
+        chunks.append(np.concatenate(current))
+    return chunks
+
+
+def speech_chunks(path):
+    """Decode an audio file and return (speech chunks, original duration in seconds)."""
+    samples = decode(path)
+    return pack_chunks(samples, speech_segments(samples)), len(samples) / SAMPLE_RATE
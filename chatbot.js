@@ -337,6 +337,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     body: formData
                 })
                 .then(response => response.json())
+                .then(data => waitForJob(data))
                 .then(data => {
                     removeTypingIndicator();
                     addBotMessage(data.result || translations[currentLanguage].analyzeError);
@@ -406,6 +407,7 @@ document.addEventListener('DOMContentLoaded', function() {
         `;
         chatMessages.appendChild(messageElement);
         scrollToBottom();
+        return messageElement;
     }
     
     // Function to show typing indicator
@@ -439,16 +441,22 @@ document.addEventListener('DOMContentLoaded', function() {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
             },
-            body: JSON.stringify({ message: message })
+            body: JSON.stringify({ message: message, stream: true })
         })
-        .then(response => response.json())
-        .then(data => {
-            // Remove typing indicator
-            removeTypingIndicator();
-            
-            // Add bot response to chat
-            addBotMessage(data.response);
+        .then(response => {
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.body || !contentType.startsWith('text/event-stream')) {
+                return response.json().then(data => {
+                    // Remove typing indicator
+                    removeTypingIndicator();
+                    
+                    // Add bot response to chat
+                    addBotMessage(data.response || data.error);
+                });
+            }
+            return readChatStream(response.body.getReader());
         })
         .catch(error => {
             console.error('Error:', error);
@@ -457,6 +465,53 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Function to render a streamed (Server-Sent Events) response as it arrives
+    function readChatStream(reader) {
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let messageText = null;
+        
+        function handleEvent(frame) {
+            let event = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (!data) return;
+            const payload = JSON.parse(data);
+            
+            if (!messageText) {
+                // First chunk: replace the typing indicator with the bot message
+                removeTypingIndicator();
+                messageText = addBotMessage('').querySelector('p');
+            }
+            if (event === 'done') {
+                messageText.textContent = payload.response;
+            } else {
+                messageText.textContent += payload.delta;
+            }
+            scrollToBottom();
+        }
+        
+        function pump() {
+            return reader.read().then(({ done, value }) => {
+                buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+                const frames = buffer.split('\n\n');
+                buffer = frames.pop();
+                frames.forEach(handleEvent);
+                if (done) {
+                    if (buffer.trim()) handleEvent(buffer);
+                    if (!messageText) throw new Error('Empty response stream');
+                    return;
+                }
+                return pump();
+            });
+        }
+        
+        return pump();
+    }
+    
     // Function to scroll chat to bottom
     function scrollToBottom() {
         chatMessages.scrollTop = chatMessages.scrollHeight;
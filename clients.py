@@ -0,0 +1,124 @@
+# filepath: clients.py
+"""Per-worker registry of upstream API clients.
+
+Gemini model handles are built once per model name and shared by all threads
+of a worker (they hold no per-request state). HTTP calls go through a
+keep-alive requests.Session with a bounded connection pool, so repeated
+OpenWeatherMap requests reuse the TLS connection instead of handshaking every
+time. requests does not promise that a Session is thread-safe, so each thread
+gets its own; both registries are rebuilt after a fork so gunicorn workers
+never share sockets with the master process.
+
+The Gemini and OpenAI SDKs take about a second to import, so they are loaded
+(and given their API keys) on the first call that needs them; see lazy.py.
+
+In a gevent worker (see concurrency.py) thread-locals are per greenlet, i.e.
+per request, so the worker shares one session instead, and Gemini uses its
+REST transport because gRPC does not cooperate with gevent. Non-streaming
+Gemini calls hold a slot of the "gemini" upstream limit; streaming callers
+hold it themselves for the length of the stream.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import lazy
+import metrics
+import concurrency
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))  # connections kept per host
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))  # seconds, default for http_get
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))  # retries on connection errors and 502/503/504
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+
+def _configure_gemini(module):
+    if GEMINI_API_KEY:
+        if concurrency.gevent_active():
+            module.configure(api_key=GEMINI_API_KEY, transport="rest")
+        else:
+            module.configure(api_key=GEMINI_API_KEY)
+
+
+def _configure_openai(module):
+    if OPENAI_API_KEY:
+        module.api_key = OPENAI_API_KEY
+
+
+genai = lazy.module("google.generativeai", on_import=_configure_gemini)
+openai = lazy.module("openai", on_import=_configure_openai)
+
+_local = threading.local()
+_shared_session = (None, None)  # (pid, session) used in gevent workers
+_models = {}
+_models_lock = threading.Lock()
+_models_pid = os.getpid()
+
+
+def _new_session():
+    session = requests.Session()
+    retry = Retry(total=HTTP_RETRIES, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset(["GET", "HEAD"]))
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def http_session():
+    """Return this thread's keep-alive session, creating it on first use."""
+    global _shared_session
+    if concurrency.gevent_active():
+        # Greenlets never run at the same time, and the pool hands each one its own connection
+        pid, session = _shared_session
+        if pid != os.getpid():
+            session = _new_session()
+            _shared_session = (os.getpid(), session)
+        return session
+    session = getattr(_local, "session", None)
+    if session is None or _local.pid != os.getpid():
+        session = _new_session()
+        _local.session = session
+        _local.pid = os.getpid()
+    return session
+
+
+def http_get(url, timeout=None, **kwargs):
+    return http_session().get(url, timeout=timeout or HTTP_TIMEOUT, **kwargs)
+
+
+class BoundedModel:
+    """A GenerativeModel whose non-streaming calls wait for a slot of the "gemini" upstream limit.
+
+    The calls are timed as the llm stage (see metrics.py); streams are timed by their consumers.
+    """
+
+    def __init__(self, name, model):
+        self._name = name
+        self._model = model
+
+    def generate_content(self, *args, **kwargs):
+        if kwargs.get("stream"):
+            return self._model.generate_content(*args, **kwargs)
+        with concurrency.upstream("gemini"), metrics.timer("llm", provider="gemini", model=self._name):
+            return self._model.generate_content(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._model, attr)
+
+
+def gemini_model(name: str):
+    """Return the shared genai.GenerativeModel (wrapped in BoundedModel) for a model name."""
+    global _models_pid
+    with _models_lock:
+        if _models_pid != os.getpid():
+            _models.clear()
+            _models_pid = os.getpid()
+        model = _models.get(name)
+        if model is None:
+            model = _models[name] = BoundedModel(name, genai.GenerativeModel(name))
+        return model
@@ -0,0 +1,105 @@
+# filepath: concurrency.py
+"""Serving concurrency: the gevent worker mode and per-upstream limits.
+
+With the gthread workers (4 workers x 2 threads) at most 8 requests were in
+progress at once, and almost all of that time was spent waiting on Gemini,
+OpenAI, OpenWeatherMap or Nominatim. gunicorn.conf.py now runs gevent
+workers when gevent is installed: gunicorn patches the standard library
+before loading the app, so the existing synchronous Flask views, requests
+sessions and thread pools all become cooperative greenlets, and one worker
+holds up to GUNICORN_WORKER_CONNECTIONS requests that are waiting on I/O.
+Set GUNICORN_WORKER_CLASS=gthread to go back to threads.
+
+With that many requests in flight the upstreams need their own bounds, so
+every outbound call takes a slot of its upstream's semaphore
+(UPSTREAM_LIMIT_<NAME> concurrent calls per worker). A call that cannot get
+a slot within UPSTREAM_WAIT seconds raises UpstreamBusy, which the callers
+handle like any other upstream failure.
+
+Work that blocks inside C code without releasing to the event loop (pyttsx3
+speech synthesis, Pillow image processing, the Whisper server socket, SQLite
+writes that wait on the database lock) goes
+through offload(), which runs it on gevent's native thread pool under gevent
+and calls it directly otherwise.
+"""
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import logs
+
+UPSTREAM_LIMIT_GEMINI = int(os.getenv("UPSTREAM_LIMIT_GEMINI", "16"))  # concurrent calls per worker
+UPSTREAM_LIMIT_OPENAI = int(os.getenv("UPSTREAM_LIMIT_OPENAI", "16"))
+UPSTREAM_LIMIT_WEATHER = int(os.getenv("UPSTREAM_LIMIT_WEATHER", "8"))
+UPSTREAM_WAIT = float(os.getenv("UPSTREAM_WAIT", "10"))  # seconds to wait for a free slot
+
+
+class UpstreamBusy(Exception):
+    pass
+
+
+def gevent_active() -> bool:
+    """True in a gevent worker (the standard library has been monkey-patched)."""
+    monkey = sys.modules.get("gevent.monkey")
+    return bool(monkey and monkey.is_module_patched("threading"))
+
+
+def offload(func, *args, **kwargs):
+    """Run blocking, non-cooperative work without stalling the other greenlets of a gevent worker."""
+    if gevent_active():
+        import gevent
+
+        return gevent.get_hub().threadpool.apply(logs.bind(func), args, kwargs)
+    return func(*args, **kwargs)
+
+
+class Upstream:
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        if not self._semaphore.acquire(timeout=UPSTREAM_WAIT):
+            with self._lock:
+                self.rejected += 1
+            raise UpstreamBusy(f"Too many concurrent {self.name} requests; please try again shortly.")
+        with self._lock:
+            self.active += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": self.limit, "active": self.active, "peak": self.peak,
+                    "calls": self.calls, "rejected": self.rejected}
+
+
+UPSTREAMS = {
+    "gemini": Upstream("gemini", UPSTREAM_LIMIT_GEMINI),
+    "openai": Upstream("openai", UPSTREAM_LIMIT_OPENAI),
+    "weather": Upstream("weather", UPSTREAM_LIMIT_WEATHER),
+}
+
+
+def upstream(name):
+    """Context manager holding one of the named upstream's slots for the duration of a call."""
+    return UPSTREAMS[name].slot()
+
+
+def stats() -> dict:
+    return {"mode": "gevent" if gevent_active() else "threads",
+            "upstreams": {name: u.stats() for name, u in UPSTREAMS.items()}}
@@ -56,7 +56,7 @@ start_app() {
         docker-compose -f "$APP_PATH/docker-compose.yml" up -d
     else
         source "$VENV_PATH/bin/activate"
-        gunicorn -w 4 -b 0.0.0.0:8000 app:app -D
+        gunicorn app:app -D  # settings in gunicorn.conf.py
     fi
 }
 
@@ -0,0 +1,254 @@
+# filepath: export.py
+"""Query log export: a buffered, rotating CSV log and on-demand bulk exports.
+
+The chat endpoint used to open data/queries.csv, append one row and close it
+on every request, and rows from concurrent gunicorn workers could interleave.
+Now record() only appends to an in-memory buffer; a background thread in each
+worker writes the buffer every EXPORT_FLUSH_INTERVAL seconds (or once
+EXPORT_BUFFER_SIZE rows are waiting) in a single write, holding an exclusive
+lock on the export directory so one worker writes at a time. The live file is
+rotated to a timestamped name when the day changes or it grows past
+EXPORT_MAX_MB, and can be gzip-compressed (each flush appends a gzip member,
+which gzip, zcat and pandas read as one stream).
+
+The chat history itself is in chat_queries, so the live log can be turned off
+(EXPORT_ENABLED=0) and any history table exported when it is needed:
+
+    python export.py chats --since 2025-10-01 --format parquet --out chats.parquet
+
+Bulk exports read SQLite in id order, EXPORT_BATCH_ROWS rows at a time, so
+memory stays flat however large the history is. Parquet needs pandas and
+pyarrow (not in requirements.txt).
+"""
+import io
+import os
+import csv
+import gzip
+import time
+import atexit
+import threading
+from datetime import date, datetime
+
+import lazy
+import logs
+import storage
+import history
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: the Flask dev server runs a single process
+
+EXPORT_ENABLED = os.getenv("EXPORT_ENABLED", "1") == "1"
+EXPORT_DIR = os.getenv("EXPORT_DIR", "data")
+EXPORT_FILE = os.getenv("EXPORT_FILE", "queries.csv")
+EXPORT_COMPRESS = os.getenv("EXPORT_COMPRESS", "0") == "1"  # gzip the live file (queries.csv.gz)
+EXPORT_ROTATE_DAILY = os.getenv("EXPORT_ROTATE_DAILY", "1") == "1"
+EXPORT_MAX_MB = float(os.getenv("EXPORT_MAX_MB", "50"))  # 0 = no size limit
+EXPORT_FLUSH_INTERVAL = float(os.getenv("EXPORT_FLUSH_INTERVAL", "5"))  # seconds
+EXPORT_BUFFER_SIZE = int(os.getenv("EXPORT_BUFFER_SIZE", "1000"))  # rows that trigger an early flush
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "5000"))  # rows per read in bulk exports
+
+FORMATS = ("csv", "csv.gz", "parquet")
+
+pd = lazy.module("pandas")
+pa = lazy.module("pyarrow")
+pq = lazy.module("pyarrow.parquet")
+
+
+def _csv_text(rows, header=None) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+class CsvLog:
+    """Buffered CSV log of (timestamp, query, response) rows."""
+
+    HEADER = ["timestamp", "query", "response"]
+
+    def __init__(self, directory=EXPORT_DIR, filename=EXPORT_FILE, compress=EXPORT_COMPRESS,
+                 rotate_daily=EXPORT_ROTATE_DAILY, max_bytes=EXPORT_MAX_MB * 1024 * 1024,
+                 flush_interval=EXPORT_FLUSH_INTERVAL, buffer_size=EXPORT_BUFFER_SIZE, enabled=EXPORT_ENABLED):
+        self.enabled = enabled
+        self.directory = directory
+        self.path = os.path.join(directory, filename + (".gz" if compress else ""))
+        self.compress = compress
+        self.rotate_daily = rotate_daily
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.rotated = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None and self._pid != os.getpid():
+                    # Forked: rows buffered by the parent belong to the parent
+                    self._buffer = []
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="csv-export", daemon=True)
+                self._thread.start()
+
+    def record(self, query: str, response: str):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._buffer.append((datetime.now().isoformat(), query, response))
+            if len(self._buffer) >= self.buffer_size:
+                self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _archive_path(self, mtime):
+        # data/queries.csv.gz -> data/queries-20251017-235959.csv.gz
+        stem, dot, ext = os.path.basename(self.path).partition(".")
+        base = os.path.join(self.directory, f"{stem}-{datetime.fromtimestamp(mtime):%Y%m%d-%H%M%S}")
+        path, n = f"{base}{dot}{ext}", 1
+        while os.path.exists(path):
+            path, n = f"{base}-{n}{dot}{ext}", n + 1
+        return path
+
+    def _rotate_if_needed(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stale = self.rotate_daily and date.fromtimestamp(st.st_mtime) != date.today()
+        if stale or (self.max_bytes and st.st_size >= self.max_bytes):
+            os.replace(self.path, self._archive_path(st.st_mtime))
+            self.rotated += 1
+
+    def _append(self, rows):
+        self._rotate_if_needed()
+        new_file = not os.path.exists(self.path)
+        data = _csv_text(rows, self.HEADER if new_file else None)
+        if self.compress:
+            with open(self.path, "ab") as f:
+                f.write(gzip.compress(data.encode("utf-8")))
+        else:
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                f.write(data)
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, ".export.lock"), "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+                self._append(rows)
+            self.written += len(rows)
+        except OSError as e:
+            self.failed += len(rows)
+            logs.error("CSV query log write failed", rows=len(rows), error=str(e))
+
+
+def iter_history(kind: str, since: str = None, until: str = None, batch_size=EXPORT_BATCH_ROWS):
+    """Yield batches of rows of a history table (see history.TABLES), oldest first.
+
+    since/until are dates or ISO datetimes as accepted by history.parse_date.
+    """
+    spec = history.TABLES[kind]
+    bounds = history.id_bounds(
+        spec.table,
+        history.parse_date(since) if since else None,
+        history.parse_date(until, end=True) if until else None,
+    )
+    if bounds is None:
+        return
+    first_id, end_id = bounds
+    last_id = (first_id or 1) - 1
+    conditions = ["id > ?"] + (["id < ?"] if end_id is not None else []) + ([spec.where] if spec.where else [])
+    while True:
+        rows = storage.query(
+            f"SELECT {', '.join(spec.columns)} FROM {spec.table} WHERE {' AND '.join(conditions)} "
+            f"ORDER BY id LIMIT ?",
+            [last_id] + ([end_id] if end_id is not None else []) + [batch_size],
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def iter_csv(kind: str, since: str = None, until: str = None):
+    """Yield a history table as CSV text, one chunk per batch (for streaming downloads)."""
+    yield _csv_text([], history.TABLES[kind].columns)
+    for rows in iter_history(kind, since, until):
+        yield _csv_text(rows)
+
+
+def export_history(kind: str, out: str, fmt: str = "csv", since: str = None, until: str = None) -> int:
+    """Write a history table to out in the given format; return the number of rows."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    columns = history.TABLES[kind].columns
+    count = 0
+    if fmt == "parquet":
+        writer = None
+        try:
+            for rows in iter_history(kind, since, until):
+                frame = pd.DataFrame.from_records(rows, columns=columns)
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(out, table.schema)
+                writer.write_table(table)
+                count += len(rows)
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+
+    opener = gzip.open if fmt == "csv.gz" else open
+    with opener(out, "wt", newline="", encoding="utf-8") as f:
+        f.write(_csv_text([], columns))
+        for rows in iter_history(kind, since, until):
+            f.write(_csv_text(rows))
+            count += len(rows)
+    return count
+
+
+csv_log = CsvLog()
+atexit.register(csv_log.flush)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export a query history table from queries.db")
+    parser.add_argument("kind", choices=sorted(history.TABLES))
+    parser.add_argument("--since", help="first day (YYYY-MM-DD or ISO datetime)")
+    parser.add_argument("--until", help="last day, inclusive")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--out", help="output file (default: data/<kind>-<today>.<format>)")
+    args = parser.parse_args(argv)
+
+    out = args.out or os.path.join(EXPORT_DIR, f"{args.kind}-{date.today():%Y%m%d}.{args.format}")
+    started = time.perf_counter()
+    count = export_history(args.kind, out, args.format, args.since, args.until)
+    print(f"Exported {count} {args.kind} rows to {out} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# filepath: geocoding.py
+"""Location name -> coordinates lookup with caching.
+
+Lookups go through, in order:
+  1. an in-memory LRU of recent answers
+  2. the geocode_cache table in queries.db (shared by all workers)
+  3. the bundled gazetteer of Indian states and districts (exact name or
+     alias, then unique prefix, then fuzzy match for misspellings)
+  4. Nominatim, rate limited to one request per second as its usage policy asks
+
+Everything found in steps 3-4 is written back to geocode_cache, so the common
+case ("Kerala", district names) never leaves the process.
+"""
+import os
+import re
+import csv
+import time
+import difflib
+import threading
+from collections import OrderedDict, namedtuple
+
+import storage
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "india_gazetteer.csv"))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "1024"))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", "3600"))  # seconds to remember unknown names
+NOMINATIM_MIN_INTERVAL = 1.0  # seconds between requests (Nominatim usage policy)
+
+GeoPoint = namedtuple("GeoPoint", ["name", "latitude", "longitude", "source"])
+
+_SUFFIXES = re.compile(r"\b(district|dist|taluk|state|india)\b")
+
+
+def normalize_location(name: str) -> str:
+    name = (name or "").lower()
+    name = re.sub(r"[^\w\s&]", " ", name)
+    name = _SUFFIXES.sub(" ", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+
+class Gazetteer:
+    """Bundled Indian states/districts with alias, prefix and fuzzy lookup."""
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.places = {}  # normalized name or alias -> GeoPoint
+        self.rows = []
+        if os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                point = GeoPoint(row["name"], float(row["latitude"]), float(row["longitude"]), "gazetteer")
+                self.rows.append(row)
+                names = [row["name"]] + [a for a in (row.get("aliases") or "").split("|") if a]
+                for name in names:
+                    self.places.setdefault(normalize_location(name), point)
+        self._sorted_names = sorted(self.places)
+
+    def lookup(self, key: str):
+        if not key:
+            return None
+        point = self.places.get(key)
+        if point:
+            return point
+
+        # Unique prefix: "thiruvanantha" -> Thiruvananthapuram
+        if len(key) >= 4:
+            matches = {self.places[n] for n in self._sorted_names if n.startswith(key)}
+            if len(matches) == 1:
+                return matches.pop()
+
+        # Misspellings: "trivandram", "kozhicode"
+        close = difflib.get_close_matches(key, self._sorted_names, n=1, cutoff=0.85)
+        if close:
+            return self.places[close[0]]
+        return None
+
+
+class Geocoder:
+    def __init__(self, gazetteer=None, cache_size=GEOCODE_CACHE_SIZE):
+        self.gazetteer = gazetteer or Gazetteer()
+        self.cache_size = cache_size
+        self._lru = OrderedDict()  # normalized name -> (GeoPoint or None, expires_at)
+        self._lock = threading.Lock()
+        self._nominatim = None
+        self._nominatim_lock = threading.Lock()
+        self._last_remote_call = 0.0
+
+    def _remember(self, key, point, ttl=None):
+        with self._lock:
+            self._lru[key] = (point, time.time() + ttl if ttl else None)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+    def _from_memory(self, key):
+        with self._lock:
+            item = self._lru.get(key)
+            if item is None:
+                return False, None
+            point, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._lru[key]
+                return False, None
+            self._lru.move_to_end(key)
+            return True, point
+
+    def _from_db(self, key):
+        rows = storage.query(
+            "SELECT display_name, latitude, longitude, source FROM geocode_cache WHERE name = ?", (key,)
+        )
+        if rows:
+            name, lat, lon, source = rows[0]
+            return GeoPoint(name, lat, lon, source)
+        return None
+
+    def _store(self, key, point):
+        storage.write(
+            "INSERT OR REPLACE INTO geocode_cache (name, display_name, latitude, longitude, source) VALUES (?, ?, ?, ?, ?)",
+            (key, point.name, point.latitude, point.longitude, point.source),
+        )
+
+    def _from_nominatim(self, location):
+        from geopy.geocoders import Nominatim
+
+        with self._nominatim_lock:
+            if self._nominatim is None:
+                self._nominatim = Nominatim(user_agent="farmer_advisory_app", timeout=10)
+            wait = NOMINATIM_MIN_INTERVAL - (time.monotonic() - self._last_remote_call)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                result = self._nominatim.geocode(location)
+            finally:
+                self._last_remote_call = time.monotonic()
+        if not result:
+            return None
+        return GeoPoint(location.strip().title(), result.latitude, result.longitude, "nominatim")
+
+    def geocode(self, location: str):
+        """Return a GeoPoint for the location name, or None if it can't be found."""
+        key = normalize_location(location)
+        if not key:
+            return None
+
+        found, point = self._from_memory(key)
+        if found:
+            return point
+
+        point = self._from_db(key)
+        if point is None:
+            point = self.gazetteer.lookup(key)
+            if point is None:
+                point = self._from_nominatim(location)
+            if point is None:
+                self._remember(key, None, ttl=GEOCODE_NEGATIVE_TTL)
+                return None
+            self._store(key, point)
+
+        self._remember(key, point)
+        return point
+
+    def known(self, location: str):
+        """The gazetteer place with exactly this name or alias, else None.
+
+        Unlike geocode() there is no prefix or fuzzy matching (and no Nominatim),
+        so ordinary words stay words: "sale" is a prefix of Salem but not a place.
+        """
+        return self.gazetteer.places.get(normalize_location(location))
+
+    def preload(self):
+        """Copy the gazetteer into geocode_cache so every worker shares it on disk."""
+        for key, point in self.gazetteer.places.items():
+            storage.write(
+                "INSERT OR IGNORE INTO geocode_cache (name, display_name, latitude, longitude, source) VALUES (?, ?, ?, ?, ?)",
+                (key, point.name, point.latitude, point.longitude, point.source),
+            )
+        return len(self.gazetteer.places)
+
+
+geocoder = Geocoder()
+
+
+def geocode(location: str):
+    return geocoder.geocode(location)
+
+
+def known_place(name: str):
+    """Display name of the gazetteer place called exactly name, else None."""
+    point = geocoder.known(name)
+    return point.name if point else None
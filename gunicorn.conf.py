@@ -0,0 +1,24 @@
+# filepath: gunicorn.conf.py
+"""gunicorn settings, loaded automatically by `gunicorn app:app`.
+
+gevent workers are used when gevent is installed (see concurrency.py): each
+worker then serves up to GUNICORN_WORKER_CONNECTIONS requests at once while
+they wait on the LLM and weather APIs, instead of GUNICORN_THREADS.
+"""
+import os
+from importlib.util import find_spec
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent" if find_spec("gevent") else "gthread")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "500"))  # gevent: concurrent requests per worker
+threads = int(os.getenv("GUNICORN_THREADS", "2"))  # gthread: concurrent requests per worker
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))  # seconds; covers streamed answers and image analysis
+keepalive = 5
+
+
+def on_starting(server):
+    # Snapshots of the previous run's workers would be added to this run's /metrics
+    import metrics
+
+    metrics.reset()
@@ -0,0 +1,166 @@
+# filepath: history.py
+"""Paginated, filterable reads of the history tables for the admin dashboard.
+
+Pages use keyset pagination on id (newest first): the client passes the last
+id it has seen as `before` and gets the next `limit` rows, so page 1000 costs
+the same as page 1 and no OFFSET scan is ever needed. Every filter is backed
+by an index created in migrations.py:
+
+- type/crop/location are equality filters on (column, id) indexes, so a page
+  is a single index range walk already in id order;
+- a date range is first turned into an id range with two lookups on the
+  timestamp index (ids are assigned in insertion order, so id order is time
+  order), which keeps date filters from sorting the matching rows.
+
+Dates are compared as stored: UTC for the queries and API tables, server
+local time for chat_queries.
+"""
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import storage
+
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
+ADMIN_MAX_PAGE_SIZE = int(os.getenv("ADMIN_MAX_PAGE_SIZE", "500"))
+
+# filters: request parameter -> column; where: condition every row must match
+HistoryTable = namedtuple("HistoryTable", ["table", "columns", "filters", "where"])
+
+TABLES = {
+    "queries": HistoryTable(
+        "queries",
+        ["id", "question", "response", "query_type", "crop", "location", "timestamp"],
+        {"type": "query_type", "crop": "crop", "location": "location"},
+        None,
+    ),
+    "chats": HistoryTable(
+        "chat_queries",
+        ["id", "query", "response", "intent", "crop", "location", "timestamp"],
+        {"type": "intent", "crop": "crop", "location": "location"},
+        None,
+    ),
+    "images": HistoryTable("image_analysis", ["id", "image_path", "analysis_result", "timestamp"], {}, None),
+    "weather": HistoryTable(
+        "weather_forecasts",
+        ["id", "location", "forecast_data", "timestamp"],
+        {"location": "location"},
+        "cell IS NULL",  # skip the grid cell cache rows
+    ),
+    "market": HistoryTable("market_prices", ["id", "crop_name", "price_data", "timestamp"], {"crop": "crop_name"}, None),
+    "seasonal": HistoryTable(
+        "seasonal_crops",
+        ["id", "region", "season", "advice", "timestamp"],
+        {"type": "season", "location": "region"},
+        "version IS NULL",  # skip the precomputed advice store (seasonal.py)
+    ),
+}
+
+# Free-text values are matched case-insensitively (the indexes are COLLATE NOCASE)
+_NOCASE_FILTERS = {"crop", "location"}
+
+
+def parse_date(value: str, end: bool = False) -> str:
+    """Normalize "YYYY-MM-DD" or an ISO datetime to the stored timestamp format.
+
+    A bare date used as the end of a range means the whole day, so it becomes
+    the start of the following day (the end bound is exclusive).
+    """
+    value = value.strip()
+    try:
+        parsed = datetime.strptime(value, "%Y-%m-%d")
+        if end:
+            parsed += timedelta(days=1)
+    except ValueError:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid date: {value!r} (expected YYYY-MM-DD or an ISO datetime)")
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _first_id_since(table: str, since: str):
+    rows = storage.query(f"SELECT id FROM {table} WHERE timestamp >= ? ORDER BY timestamp, id LIMIT 1", (since,))
+    return rows[0][0] if rows else None
+
+
+def _last_id_until(table: str, until: str):
+    rows = storage.query(f"SELECT id FROM {table} WHERE timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 1", (until,))
+    return rows[0][0] if rows else None
+
+
+def id_bounds(table: str, since: str = None, until: str = None):
+    """Return (first id, end id) of the rows stamped in [since, until), or None if there are none.
+
+    since/until are stored-format timestamps (see parse_date); an open side of
+    the range gives None for that bound.
+    """
+    first_id = end_id = None
+    if since:
+        first_id = _first_id_since(table, since)
+        if first_id is None:
+            return None
+    if until:
+        last_id = _last_id_until(table, until)
+        if last_id is None:
+            return None
+        end_id = last_id + 1
+    return first_id, end_id
+
+
+def _int_param(value, name, default=None):
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+
+
+def page(kind: str, params=None) -> dict:
+    """Return one page of history rows, newest first.
+
+    params (e.g. request.args): type, crop, location, since, until, before, limit.
+    Raises KeyError for an unknown kind and ValueError for malformed parameters.
+    """
+    spec = TABLES[kind]
+    params = params or {}
+    limit = min(max(_int_param(params.get("limit"), "limit", ADMIN_PAGE_SIZE), 1), ADMIN_MAX_PAGE_SIZE)
+    before = _int_param(params.get("before"), "before")
+
+    conditions = [spec.where] if spec.where else []
+    values = []
+    for name, column in spec.filters.items():
+        value = (params.get(name) or "").strip()
+        if value:
+            conditions.append(f"{column} = ? COLLATE NOCASE" if name in _NOCASE_FILTERS else f"{column} = ?")
+            values.append(value)
+
+    bounds = id_bounds(
+        spec.table,
+        parse_date(params["since"]) if params.get("since") else None,
+        parse_date(params["until"], end=True) if params.get("until") else None,
+    )
+    if bounds is None:
+        return {"kind": kind, "items": [], "next_before": None}
+    first_id, end_id = bounds
+    if first_id is not None:
+        conditions.append("id >= ?")
+        values.append(first_id)
+    if end_id is not None:
+        before = end_id if before is None else min(before, end_id)
+    if before is not None:
+        conditions.append("id < ?")
+        values.append(before)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = storage.query(
+        f"SELECT {', '.join(spec.columns)} FROM {spec.table} {where} ORDER BY id DESC LIMIT ?",
+        values + [limit + 1],
+    )
+    items = [dict(zip(spec.columns, row)) for row in rows[:limit]]
+    return {
+        "kind": kind,
+        "items": items,
+        "next_before": items[-1]["id"] if len(rows) > limit else None,
+    }
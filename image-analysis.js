@@ -46,6 +46,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: formData
             })
             .then(response => response.json())
+            .then(data => waitForJob(data))
             .then(data => {
                 if (data.result) {
                     addBotMessage(data.result);
@@ -0,0 +1,234 @@
+# filepath: images.py
+"""Content-addressed crop image uploads and the image analysis cache.
+
+Uploads are stored under the SHA-256 of their bytes, so resending a photo
+reuses the stored file and two different photos called "image.jpg" no longer
+overwrite each other. Past diagnoses in the image_analysis table are looked up
+first by that content hash and then by a 64-bit perceptual hash (dHash), which
+survives re-compression and resizing by messaging apps; a match within
+IMAGE_PHASH_DISTANCE bits returns the stored diagnosis without a vision call.
+Flat or low-contrast photos hash to (nearly) all-0 or all-1 bits and would
+match each other, so they only ever reuse diagnoses of identical copies.
+
+Photos that do go to the vision model are first shrunk by prepare_for_vision:
+JPEGs are decoded at reduced size (PIL draft mode), the orientation is applied
+and EXIF dropped, the colour mode is normalized to RGB and the longest side
+capped at IMAGE_MAX_SIDE, and the JPEG quality is lowered step by step until
+the payload fits IMAGE_TARGET_BYTES.
+"""
+import io
+import os
+import time
+import hashlib
+import threading
+
+import numpy as np
+from werkzeug.utils import secure_filename
+
+import logs
+import storage
+
+IMAGE_PHASH_DISTANCE = int(os.getenv("IMAGE_PHASH_DISTANCE", "6"))  # differing bits out of 64, -1 disables
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))  # pixels, longest side sent to the vision model
+IMAGE_TARGET_BYTES = int(os.getenv("IMAGE_TARGET_BYTES", str(200 * 1024)))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))  # first quality tried
+IMAGE_MIN_JPEG_QUALITY = 60
+PHASH_MIN_GRADIENT = 2.0  # grey levels; smaller brightness steps are ties and hash as 0
+PHASH_MIN_BITS = 8  # hashes with fewer set (or unset) bits than this describe no shape
+UPLOAD_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".heic", ".tif", ".tiff"}
+
+
+def save_upload(file_storage, upload_dir):
+    """Save an uploaded image under its content hash; return (path, sha256 hex digest)."""
+    data = file_storage.read()
+    digest = hashlib.sha256(data).hexdigest()
+    ext = os.path.splitext(secure_filename(file_storage.filename or ""))[1].lower()
+    if ext not in UPLOAD_EXTENSIONS:
+        ext = ".jpg"
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f"{digest[:32]}{ext}")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return path, digest
+
+
+class PreprocessStats:
+    """Totals over all images prepared by this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def add(self, bytes_in, bytes_out, seconds):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.seconds += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "images": self.images,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "avg_ms": round(self.seconds / self.images * 1000, 1) if self.images else 0.0,
+            }
+
+
+preprocess_stats = PreprocessStats()
+
+
+def _to_rgb(img):
+    if img.mode == "RGB":
+        return img
+    from PIL import Image
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        # Transparent areas become white rather than black
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def prepare_for_vision(image_path, max_side=IMAGE_MAX_SIDE, target_bytes=IMAGE_TARGET_BYTES):
+    """Return (JPEG bytes, stats dict) for an image, downscaled and stripped of metadata."""
+    from PIL import Image, ImageOps
+
+    started = time.perf_counter()
+    bytes_in = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        original_size = img.size
+        # Decode JPEGs at the smallest 1/2, 1/4 or 1/8 scale that is still >= max_side
+        img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img = _to_rgb(img)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    quality = IMAGE_JPEG_QUALITY
+    while True:
+        buffer = io.BytesIO()
+        # No exif= argument, so no EXIF (GPS, camera serial) is written
+        img.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+        if buffer.tell() <= target_bytes or quality <= IMAGE_MIN_JPEG_QUALITY:
+            break
+        quality -= 10
+    data = buffer.getvalue()
+
+    seconds = time.perf_counter() - started
+    preprocess_stats.add(bytes_in, len(data), seconds)
+    return data, {
+        "original_size": original_size,
+        "size": img.size,
+        "bytes_in": bytes_in,
+        "bytes_out": len(data),
+        "quality": quality,
+        "ms": round(seconds * 1000, 1),
+    }
+
+
+def perceptual_hash(image_path) -> int:
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale thumbnail."""
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        img.draft("L", (64, 64))  # JPEGs are decoded at reduced size
+        pixels = np.asarray(img.convert("F").resize((9, 8), Image.LANCZOS), dtype=np.float32)
+    bits = (pixels[:, 1:] - pixels[:, :-1] > PHASH_MIN_GRADIENT).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def is_degenerate(phash) -> bool:
+    """True for hashes of flat or low-contrast images, which near-match each other."""
+    ones = bin(phash).count("1")
+    return ones < PHASH_MIN_BITS or ones > 64 - PHASH_MIN_BITS
+
+
+def _to_sqlite(phash):
+    # SQLite integers are signed 64-bit
+    return phash - (1 << 64) if phash >= (1 << 63) else phash
+
+
+class ImageAnalysisCache:
+    def __init__(self, max_distance=IMAGE_PHASH_DISTANCE):
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._last_id = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _refresh(self):
+        """Pull perceptual hashes recorded since the last lookup (by any worker)."""
+        rows = storage.query(
+            "SELECT id, phash FROM image_analysis WHERE id > ? AND phash IS NOT NULL ORDER BY id", (self._last_id,)
+        )
+        if rows:
+            ids, hashes = zip(*rows)
+            self._ids = np.concatenate([self._ids, np.array(ids, dtype=np.int64)])
+            self._hashes = np.concatenate([self._hashes, np.array(hashes, dtype=np.int64).view(np.uint64)])
+            self._last_id = ids[-1]
+
+    def _nearest(self, phash):
+        with self._lock:
+            self._refresh()
+            if not len(self._hashes):
+                return None
+            xor = self._hashes ^ np.uint64(phash)
+            distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            best = int(np.argmin(distances))
+            if distances[best] <= self.max_distance:
+                return int(self._ids[best])
+        return None
+
+    def lookup(self, image_path, digest):
+        """Return (cached diagnosis or None, perceptual hash of the image or None if it is not indexed)."""
+        rows = storage.query(
+            "SELECT analysis_result FROM image_analysis WHERE content_hash = ? ORDER BY id DESC LIMIT 1", (digest,)
+        )
+        if rows:
+            self.hits += 1
+            return rows[0][0], None
+
+        try:
+            phash = perceptual_hash(image_path)
+        except Exception as e:
+            logs.warning("Perceptual hash failed", image=image_path, error=str(e))
+            self.misses += 1
+            return None, None
+
+        if is_degenerate(phash):
+            self.misses += 1
+            return None, None
+
+        if self.max_distance >= 0:
+            row_id = self._nearest(phash)
+            if row_id is not None:
+                rows = storage.query("SELECT analysis_result FROM image_analysis WHERE id = ?", (row_id,))
+                if rows:
+                    self.near_hits += 1
+                    return rows[0][0], phash
+
+        self.misses += 1
+        return None, phash
+
+    def record(self, image_path, result, digest, phash):
+        storage.write(
+            "INSERT INTO image_analysis (image_path, analysis_result, content_hash, phash) VALUES (?, ?, ?, ?)",
+            (image_path, result, digest, _to_sqlite(phash) if phash is not None else None),
+        )
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "near_hits": self.near_hits, "misses": self.misses,
+                "indexed": len(self._hashes), "preprocessing": preprocess_stats.as_dict()}
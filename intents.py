@@ -0,0 +1,161 @@
+# filepath: intents.py
+"""Intent router for chat queries.
+
+All keyword, crop, season and location dictionaries are compiled into one
+regular expression at start-up (alternatives longest first, on word
+boundaries), so routing a query is a single left-to-right scan of the
+lowercased text. Every match adds to the score of an intent and/or fills an
+entity slot in the same pass; the best scoring intent wins, so "rain-fed crop
+prices" is a market question even though it mentions rain and crops.
+
+Run `python intents.py --bench` for a routing micro-benchmark.
+"""
+import re
+import sys
+import time
+from collections import namedtuple
+
+# location is a recognised place. place is a word that only looked like one ("weather in
+# Smalltown") and could not be resolved: it may be tried with the geocoder, but is never
+# stored or used as a region.
+Route = namedtuple("Route", ["intent", "scores", "crop", "season", "location", "place"], defaults=(None,))
+
+# term -> weight per intent. Terms also match with a trailing "s" ("prices").
+INTENT_KEYWORDS = {
+    "weather": {
+        "weather": 3, "forecast": 3, "rain": 2, "rainfall": 2, "climate": 2, "temperature": 2,
+        "humidity": 2, "storm": 2, "cyclone": 2,
+    },
+    "market": {
+        "price": 3, "market": 3, "mandi": 3, "msp": 3, "sell": 2, "selling": 2, "cost": 2, "rate": 2,
+        "quintal": 2,
+    },
+    "seasonal": {
+        "season": 3, "seasonal": 3, "plant": 2, "planting": 2, "grow": 2, "growing": 2, "cultivate": 2,
+        "cultivation": 2, "sow": 2, "sowing": 2, "crop": 1, "rain-fed": 1, "rainfed": 1,
+    },
+}
+
+CROPS = ["rice", "wheat", "cotton", "sugarcane", "maize", "potato", "tomato", "onion"]
+CROP_ALIASES = {"paddy": "rice", "corn": "maize", "sugar cane": "sugarcane", "potatoe": "potato", "tomatoe": "tomato"}
+
+# Named seasons also count towards the seasonal intent
+SEASONS = {
+    "summer": "summer", "winter": "winter", "monsoon": "monsoon", "rainy": "rainy",
+    "kharif": "monsoon", "rabi": "winter", "zaid": "summer",
+}
+SEASON_WEIGHT = 2
+
+# Fallback for places missing from the location dictionary: the word after one of these.
+# Keywords, crops and seasons are never places ("plant wheat in winter"), nor are these:
+_PLACE_AFTER = re.compile(r"\b(?:in|at|for|near)\s+([a-z][\w-]*)")
+_NOT_PLACES = {
+    "the", "a", "an", "my", "our", "your", "this", "that", "these", "next", "last", "today", "tomorrow",
+    "tonight", "week", "month", "year", "day", "days", "morning", "evening", "time", "farming", "farmers",
+    "agriculture", "agricultural", "field", "fields", "farm", "farms", "soil", "land", "me", "us",
+}
+
+MIN_LOCATION_LENGTH = 3  # skip "up", "mp", "tn": too easily confused with ordinary words
+
+
+class IntentRouter:
+    def __init__(self, locations=None, default_location="Kerala", default_crop="rice", resolve=None):
+        """locations maps lowercased place names and aliases to display names.
+
+        resolve(word) returns the display name of the place called exactly word (e.g.
+        geocoding.known_place), or None; without it fallback words are never locations.
+        """
+        self.default_location = default_location
+        self.default_crop = default_crop
+        self.resolve = resolve
+        self._terms = {}  # term -> list of ("intent", name, weight) / ("crop"|"season"|"location", value, 0)
+        for intent, keywords in INTENT_KEYWORDS.items():
+            for term, weight in keywords.items():
+                self._add(term, ("intent", intent, weight))
+        for crop in CROPS:
+            self._add(crop, ("crop", crop, 0))
+        for alias, crop in CROP_ALIASES.items():
+            self._add(alias, ("crop", crop, 0))
+        for term, season in SEASONS.items():
+            self._add(term, ("season", season, 0))
+        for name, display in (locations or {}).items():
+            # A place named like a keyword ("Mandi") is read as the keyword
+            if len(name) >= MIN_LOCATION_LENGTH and name not in self._terms:
+                self._add(name, ("location", display, 0))
+
+        self._not_places = _NOT_PLACES | {term for term, meanings in self._terms.items()
+                                          if any(kind != "location" for kind, _, _ in meanings)}
+        alternatives = sorted(self._terms, key=len, reverse=True)
+        self._pattern = re.compile(r"\b(" + "|".join(map(re.escape, alternatives)) + r")s?\b")
+
+    def _add(self, term, meaning):
+        self._terms.setdefault(term, []).append(meaning)
+
+    def route(self, query: str) -> Route:
+        text = (query or "").lower()
+        scores = dict.fromkeys(INTENT_KEYWORDS, 0)
+        crop = season = location = place = None
+
+        for match in self._pattern.finditer(text):
+            for kind, value, weight in self._terms[match.group(1)]:
+                if kind == "intent":
+                    scores[value] += weight
+                elif kind == "crop":
+                    crop = crop or value
+                elif kind == "season":
+                    season = season or value
+                    scores["seasonal"] += SEASON_WEIGHT
+                elif kind == "location":
+                    location = location or value
+
+        if location is None:
+            for word in reversed(_PLACE_AFTER.findall(text)):
+                word = word.strip("-")
+                if len(word) < MIN_LOCATION_LENGTH or self._is_term(word):
+                    continue
+                location = self.resolve(word) if self.resolve else None
+                place = None if location else word.title()
+                break
+
+        # Ties go to the earlier intent (weather, market, seasonal), as the keyword chain did
+        intent = max(scores, key=scores.get)
+        if scores[intent] == 0:
+            intent = "general"
+        return Route(intent, scores, crop, season, location, place)
+
+    def _is_term(self, word):
+        return word in self._not_places or (word.endswith("s") and word[:-1] in self._not_places)
+
+
+def benchmark(router, queries, rounds=2000):
+    """Return the mean routing time per query in microseconds."""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            router.route(query)
+    return (time.perf_counter() - started) / (rounds * len(queries)) * 1e6
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        import geocoding
+
+        sample = [
+            "What is the weather forecast in Thrissur this week?",
+            "rain-fed crop prices in Vidarbha",
+            "Which crops should I plant in kharif season in Punjab?",
+            "How do I control pests on my tomato plants?",
+            "Current mandi rate for onions near Nashik",
+            "What are the latest innovations in agricultural technology and how can small farmers adopt them?",
+        ]
+        names = {name: point.name for name, point in geocoding.geocoder.gazetteer.places.items()}
+        router = IntentRouter(names, resolve=geocoding.known_place)
+        for query in sample:
+            print(f"{router.route(query)}  <- {query}")
+        per_query = benchmark(router, sample)
+        short, long = sample[0], " ".join(sample) * 4
+        print(f"\n{per_query:.1f} us/query over {len(sample)} queries, {len(names)} locations")
+        print(f"{benchmark(router, [short]):.1f} us for {len(short)} chars, "
+              f"{benchmark(router, [long], rounds=200):.1f} us for {len(long)} chars")
+    else:
+        print("Usage: python intents.py --bench")
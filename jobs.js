@@ -0,0 +1,19 @@
+// Background job polling shared by the chat and image analysis scripts
+// Waits for a job accepted with 202 (see /api/jobs/<id>) and resolves with its result.
+// Polls with backoff and gives up after maxWait milliseconds.
+function waitForJob(data, { delay = 1000, maxWait = 5 * 60 * 1000 } = {}) {
+    if (!data.job_id) return Promise.resolve(data);
+    const deadline = Date.now() + maxWait;
+    function poll(delay) {
+        return new Promise(resolve => setTimeout(resolve, delay))
+            .then(() => fetch(data.status_url))
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === 'done') return job.result;
+                if (job.status === 'failed' || job.error) throw new Error(job.error || 'Job failed');
+                if (Date.now() >= deadline) throw new Error('Timed out waiting for the result');
+                return poll(Math.min(delay * 1.5, 3000));
+            });
+    }
+    return poll(delay);
+}
@@ -0,0 +1,156 @@
+# filepath: jobs.py
+"""Background job queue for slow endpoints.
+
+Image analysis, transcription and text-to-speech take seconds to minutes, so
+their endpoints only save the upload, submit a job and return its id. The job
+runs on a small thread pool per job kind (bounded concurrency, so one kind
+cannot starve the others or the chat traffic), and its status and result are
+kept in the jobs table so /api/jobs/<id> works from any gunicorn worker.
+
+Jobs live in the worker process that accepted them. If that process exits
+before a job finishes, the job is reported as failed instead of staying
+"running" forever.
+"""
+import os
+import json
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import logs
+import storage
+
+JOB_WORKERS_IMAGE = int(os.getenv("JOB_WORKERS_IMAGE", "2"))  # concurrent jobs per kind and worker
+JOB_WORKERS_TRANSCRIPTION = int(os.getenv("JOB_WORKERS_TRANSCRIPTION", "1"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "20"))  # queued + running jobs per kind and worker
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_FLUSH_TIMEOUT = 5  # seconds to wait for a status change to reach the database
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, max_pending=JOB_MAX_PENDING):
+        self.max_pending = max_pending
+        self._kinds = {}  # kind -> (func, workers)
+        self._executors = {}
+        self._pending = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()  # job id -> job dict, for jobs submitted by this worker
+
+    def register(self, kind, func, workers=1):
+        """func(*args) runs the job and returns a JSON-serializable result."""
+        self._kinds[kind] = (func, workers)
+
+    def _executor(self, kind):
+        # Thread pools don't survive a fork; gunicorn workers build their own
+        if self._pid != os.getpid():
+            self._executors = {}
+            self._pending = {}
+            self._recent.clear()
+            self._pid = os.getpid()
+        executor = self._executors.get(kind)
+        if executor is None:
+            executor = self._executors[kind] = ThreadPoolExecutor(
+                max_workers=self._kinds[kind][1], thread_name_prefix=f"job-{kind}")
+        return executor
+
+    def _remember(self, job):
+        with self._lock:
+            self._recent[job["id"]] = dict(job)
+            self._recent.move_to_end(job["id"])
+            while len(self._recent) > 1000:
+                self._recent.popitem(last=False)
+
+    def _insert(self, job):
+        self._remember(job)
+        # One short transaction of its own: waiting for the write-behind queue to flush
+        # would put a whole batch commit back on the request path
+        storage.execute("INSERT INTO jobs (id, kind, status, pid) VALUES (?, ?, ?, ?)",
+                        (job["id"], job["kind"], job["status"], job["pid"]))
+
+    def _save(self, job):
+        self._remember(job)
+        storage.write(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (job["status"], json.dumps(job["result"]) if job["result"] is not None else None,
+             job["error"], job["id"]),
+        )
+        # Make the new status visible to the other workers answering polls (job threads only)
+        storage.writer.flush(JOB_FLUSH_TIMEOUT)
+
+    def submit(self, kind, *args) -> str:
+        """Queue a job and return its id. Raises QueueFull if too many are pending."""
+        func = self._kinds[kind][0]
+        with self._lock:
+            executor = self._executor(kind)
+            if self._pending.get(kind, 0) >= self.max_pending:
+                raise QueueFull(f"Too many {kind} jobs in progress, please try again shortly.")
+            self._pending[kind] = self._pending.get(kind, 0) + 1
+
+        job = {"id": uuid.uuid4().hex, "kind": kind, "status": QUEUED, "result": None, "error": None,
+               "pid": os.getpid()}
+        try:
+            self._insert(job)
+        except Exception:
+            with self._lock:
+                self._pending[kind] -= 1
+            raise
+        # The job logs under the id of the request that submitted it
+        executor.submit(logs.bind(self._run), job, func, args)
+        return job["id"]
+
+    def _run(self, job, func, args):
+        try:
+            job["status"] = RUNNING
+            self._save(job)
+            job["result"] = func(*args)
+            job["status"] = DONE
+        except Exception as e:
+            logs.error("Background job failed", kind=job["kind"], job_id=job["id"], error=str(e))
+            job["status"] = FAILED
+            job["error"] = str(e)
+        finally:
+            with self._lock:
+                self._pending[job["kind"]] -= 1
+        self._save(job)
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if the id is unknown."""
+        with self._lock:
+            job = self._recent.get(job_id)
+            if job is not None and self._pid == os.getpid():
+                return {k: v for k, v in job.items() if k != "pid"}
+
+        rows = storage.query("SELECT id, kind, status, result, error, pid FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job_id, kind, status, result, error, pid = rows[0]
+        if status in (QUEUED, RUNNING) and not _process_alive(pid):
+            status, error = FAILED, "The server restarted before the job finished. Please try again."
+        return {"id": job_id, "kind": kind, "status": status,
+                "result": json.loads(result) if result else None, "error": error}
+
+    def purge(self, days=JOB_RETENTION_DAYS):
+        storage.write("DELETE FROM jobs WHERE updated_at < datetime('now', ?)", (f"-{days} days",))
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+queue = JobQueue()
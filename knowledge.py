@@ -0,0 +1,353 @@
+# filepath: knowledge.py
+"""Offline agronomy knowledge base: BM25 retrieval over a local FAQ corpus.
+
+When neither LLM could answer, the chatbot used to fall back to a handful of
+keyword rules and otherwise "Consult your nearest agricultural office". It
+now searches a question/answer corpus (data/agronomy_faq.csv by default; a
+Kisan Call Centre export with QueryText/KccAns columns works too) and answers
+with the best match. A match that covers the question well enough
+(KNOWLEDGE_CONFIDENCE) is also served before asking the LLM at all.
+
+The corpus is tokenized (lower case, stop words dropped, plurals folded, crop
+aliases such as "paddy" mapped to "rice") and indexed once into an inverted
+index stored as NumPy arrays in compressed sparse row form: for each term the
+ids of the documents containing it and their precomputed BM25 weights. The
+arrays are written under KNOWLEDGE_INDEX_DIR in a directory named after a
+hash of the corpus and the index settings, so a changed corpus gets a fresh
+index on the next start, and every worker memory-maps the same files instead
+of holding its own copy. A query reads only the postings of its own terms and
+sums them with np.bincount: well under a millisecond (about 75 us on the
+bundled corpus, see --bench).
+
+Confidence compares the query with the matched FAQ question: how much of the
+query the question covers and how much of the question the query covers
+(both weighted by IDF), combined as an F2 score so that a query which asks
+the whole FAQ question plus a place name still counts as a match, while a
+single common word ("grow") matching a longer question does not.
+
+    python knowledge.py "how to control aphids on chilli"
+    python knowledge.py --bench
+"""
+import os
+import re
+import csv
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import Counter, namedtuple
+
+import numpy as np
+
+import logs
+import intents
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+KNOWLEDGE_CORPUS_PATH = os.getenv("KNOWLEDGE_CORPUS_PATH", os.path.join(DATA_DIR, "agronomy_faq.csv"))
+KNOWLEDGE_INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", os.path.join(DATA_DIR, "knowledge_index"))
+KNOWLEDGE_FAST_PATH = os.getenv("KNOWLEDGE_FAST_PATH", "1") == "1"  # answer confident matches before the LLM
+KNOWLEDGE_CONFIDENCE = float(os.getenv("KNOWLEDGE_CONFIDENCE", "0.75"))  # confidence needed to skip the LLM
+KNOWLEDGE_FALLBACK_CONFIDENCE = float(os.getenv("KNOWLEDGE_FALLBACK_CONFIDENCE", "0.25"))  # when the LLMs failed
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "3"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+QUESTION_WEIGHT = 2  # question terms count twice towards a document's term frequencies
+CONFIDENCE_BETA = 2  # F-beta weight of "how much of the FAQ question was asked"
+INDEX_FORMAT = 1  # bump when the files written by build_index change
+
+STOP_WORDS = frozenset("""
+a about after all also am an and any are as at be been before best can could did do does doing for from get
+give good has have having how i if in into is it its me more most my need of on or our please should so some
+tell than that the their them then there these they this to us very was we what when where which who why will
+with would you your
+""".split())
+
+_WORD = re.compile(r"[^\W\d_]+")
+_SEPARATOR = "\x1f"  # between the topic, question and answer of a stored document
+
+# Accepted corpus headers (lower-cased) for each field
+_COLUMNS = {
+    "topic": ("topic", "querytype", "category"),
+    "crops": ("crops", "crop"),
+    "question": ("question", "querytext", "query"),
+    "answer": ("answer", "kccans", "response"),
+}
+
+Match = namedtuple("Match", ["score", "confidence", "topic", "question", "answer"])
+
+
+def _fold(word: str) -> str:
+    # Plurals only: "pests" -> "pest", "varieties" -> "variety", "bunches" -> "bunch"
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for word in _WORD.findall((text or "").lower()):
+        if word in STOP_WORDS or len(word) < 2:
+            continue
+        word = _fold(word)
+        tokens.append(intents.CROP_ALIASES.get(word, word))
+    return tokens
+
+
+def read_corpus(path: str) -> list:
+    """Return (topic, crops, question, answer) tuples from a FAQ CSV file."""
+    docs = []
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        headers = {h.strip().lower(): h for h in reader.fieldnames or []}
+        columns = {field: next((headers[n] for n in names if n in headers), None) for field, names in _COLUMNS.items()}
+        if not (columns["question"] and columns["answer"]):
+            raise ValueError(f"{path}: needs question and answer columns")
+        for row in reader:
+            question = (row.get(columns["question"]) or "").strip()
+            answer = (row.get(columns["answer"]) or "").strip()
+            if question and answer:
+                docs.append(tuple((row.get(columns[field]) or "").strip() if columns[field] else ""
+                                  for field in ("topic", "crops")) + (question, answer))
+    return docs
+
+
+def _fingerprint(path: str) -> str:
+    digest = hashlib.sha1(f"{INDEX_FORMAT}:{BM25_K1}:{BM25_B}:{QUESTION_WEIGHT}".encode())
+    digest.update(json.dumps(intents.CROP_ALIASES, sort_keys=True).encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _csr(rows, values, size):
+    """Group values by row: returns (indptr, values in row order)."""
+    rows = np.asarray(rows, dtype=np.int64)
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, [np.asarray(v)[order] for v in values]
+
+
+def build_index(docs: list, directory: str):
+    """Write the inverted index of docs as .npy files (plus vocab.json) into directory."""
+    vocab = {}
+    term_ids, doc_ids, tfs = [], [], []
+    question_rows, question_terms = [], []
+    doc_len = np.zeros(len(docs), dtype=np.float64)
+    for d, (topic, crops, question, answer) in enumerate(docs):
+        asked = tokenize(question)
+        counts = Counter(asked * QUESTION_WEIGHT + tokenize(answer) + tokenize(crops.replace(",", " ")))
+        doc_len[d] = sum(counts.values())
+        for term, tf in counts.items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            doc_ids.append(d)
+            tfs.append(tf)
+        for term in set(asked):
+            question_rows.append(d)
+            question_terms.append(vocab[term])
+
+    n_docs, n_terms = len(docs), len(vocab)
+    indptr, (doc_ids, tfs) = _csr(term_ids, [np.asarray(doc_ids, dtype=np.int32), np.asarray(tfs, dtype=np.float64)], n_terms)
+    df = np.diff(indptr)
+    idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / max(doc_len.mean(), 1))
+    term_of_posting = np.repeat(np.arange(n_terms), df)
+    weights = idf[term_of_posting] * tfs * (BM25_K1 + 1) / (tfs + norm[doc_ids])
+
+    question_idf = np.bincount(question_rows, weights=idf[question_terms], minlength=n_docs) if question_rows else np.zeros(n_docs)
+    question_indptr, (question_terms,) = _csr(question_rows, [np.asarray(question_terms, dtype=np.int32)], n_docs)
+
+    text = [_SEPARATOR.join(doc[:1] + doc[2:]).encode("utf-8") for doc in docs]
+    text_offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in text], out=text_offsets[1:])
+
+    arrays = {
+        "indptr": indptr,
+        "doc_ids": doc_ids.astype(np.int32),
+        "weights": weights.astype(np.float32),
+        "idf": idf.astype(np.float32),
+        "question_indptr": question_indptr,
+        "question_terms": question_terms.astype(np.int32),
+        "question_idf": question_idf.astype(np.float32),
+        "text": np.frombuffer(b"".join(text), dtype=np.uint8),
+        "text_offsets": text_offsets,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+    with open(os.path.join(directory, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+
+
+class Index:
+    """A built index, memory-mapped read-only from its directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        for name in ("indptr", "doc_ids", "weights", "idf", "question_indptr", "question_terms",
+                     "question_idf", "text", "text_offsets"):
+            # np.asarray keeps the mapping but drops the np.memmap subclass, whose slicing is slow
+            setattr(self, name, np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")))
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        self.size = len(self.text_offsets) - 1
+        self.max_idf = float(np.log(1 + (self.size - 0.5) / 1.5)) if self.size else 0.0  # a term in one document
+
+    def document(self, d: int):
+        start, end = self.text_offsets[d], self.text_offsets[d + 1]
+        return bytes(self.text[start:end]).decode("utf-8").split(_SEPARATOR)
+
+    def search(self, query: str, k: int = KNOWLEDGE_TOP_K) -> list:
+        terms = set(tokenize(query))
+        known = sorted({self.vocab[t] for t in terms if t in self.vocab})
+        if not known:
+            return []
+        # Unknown words count as rare ones, so a query that is mostly unknown is not a confident match
+        query_idf = float(self.idf[known].sum()) + (len(terms) - len(known)) * self.max_idf
+
+        starts, ends = self.indptr[known], self.indptr[np.asarray(known) + 1]
+        docs = np.concatenate([self.doc_ids[s:e] for s, e in zip(starts, ends)])
+        weights = np.concatenate([self.weights[s:e] for s, e in zip(starts, ends)])
+        matched_idf = np.repeat(self.idf[known], ends - starts)
+        candidates, position = np.unique(docs, return_inverse=True)
+        scores = np.bincount(position, weights=weights)
+        coverage = np.bincount(position, weights=matched_idf) / query_idf
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        known = set(known)
+        matches = []
+        for i in top:
+            d = candidates[i]
+            asked = self.question_terms[self.question_indptr[d]:self.question_indptr[d + 1]].tolist()
+            question_idf = float(self.question_idf[d])
+            recall = float(self.idf[[t for t in asked if t in known]].sum()) / question_idf if question_idf else 0.0
+            precision = float(coverage[i])
+            beta2 = CONFIDENCE_BETA ** 2
+            confidence = (1 + beta2) * precision * recall / (beta2 * precision + recall) if precision and recall else 0.0
+            topic, question, answer = self.document(d)
+            matches.append(Match(float(scores[i]), round(confidence, 3), topic, question, answer))
+        return matches
+
+
+class KnowledgeBase:
+    """The FAQ corpus index, built or opened on first use."""
+
+    def __init__(self, corpus_path=KNOWLEDGE_CORPUS_PATH, index_dir=KNOWLEDGE_INDEX_DIR):
+        self.corpus_path = corpus_path
+        self.index_dir = index_dir
+        self._index = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.answered = 0
+        self.search_seconds = 0.0
+
+    def _build(self, directory: str):
+        docs = read_corpus(self.corpus_path)
+        if not docs:
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".build-", dir=self.index_dir)
+        try:
+            build_index(docs, tmp)
+            os.rename(tmp, directory)
+            logs.info("Built knowledge index", answers=len(docs), directory=directory)
+        except OSError:
+            # Another worker finished the same index first
+            if not os.path.isdir(directory):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        for name in os.listdir(self.index_dir):
+            # Indexes of earlier corpus versions; workers still mapping them keep their pages
+            if name != os.path.basename(directory) and not name.startswith("."):
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return self._index
+            self._loaded = True
+            if not os.path.exists(self.corpus_path):
+                logs.warning("Knowledge corpus not found; offline answers are disabled", corpus=self.corpus_path)
+                return None
+            try:
+                directory = os.path.join(self.index_dir, _fingerprint(self.corpus_path))
+                if not os.path.isdir(directory):
+                    self._build(directory)
+                if os.path.isdir(directory):
+                    self._index = Index(directory)
+            except (OSError, ValueError) as e:
+                logs.error("Knowledge index load failed", error=str(e))
+            return self._index
+
+    @property
+    def index(self):
+        return self._index if self._loaded else self.load()
+
+    def search(self, query: str, k: int = KNOWLEDGE_TOP_K) -> list:
+        index = self.index
+        if index is None or not query:
+            return []
+        started = time.perf_counter()
+        matches = index.search(query, k)
+        self.search_seconds += time.perf_counter() - started
+        self.searches += 1
+        return matches
+
+    def answer(self, query: str, min_confidence: float = KNOWLEDGE_CONFIDENCE):
+        """Return the best Match if its confidence is at least min_confidence, else None."""
+        matches = self.search(query, 1)
+        if matches and matches[0].confidence >= min_confidence:
+            self.answered += 1
+            return matches[0]
+        return None
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            "documents": index.size if index else 0,
+            "terms": len(index.vocab) if index else 0,
+            "searches": self.searches,
+            "answered": self.answered,
+            "avg_search_ms": round(self.search_seconds / self.searches * 1000, 3) if self.searches else 0.0,
+        }
+
+
+base = KnowledgeBase()
+
+
+def _bench(rounds=200):
+    index = base.load()
+    if index is None:
+        return
+    queries = [index.document(d)[1] for d in range(index.size)]
+    queries += [q.lower().replace("how do i", "best way to") + " in kerala" for q in queries]
+    timings = []
+    for _ in range(rounds):
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query)
+            timings.append(time.perf_counter() - started)
+    timings = np.asarray(timings) * 1e6
+    print(f"{index.size} answers, {len(index.vocab)} terms: search p50 {np.percentile(timings, 50):.0f} us, "
+          f"p99 {np.percentile(timings, 99):.0f} us over {len(timings)} queries")
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        _bench()
+    else:
+        for match in base.search(" ".join(sys.argv[1:]), KNOWLEDGE_TOP_K):
+            print(f"{match.score:6.2f}  {match.confidence:.2f}  [{match.topic}] {match.question}")
@@ -0,0 +1,104 @@
+# filepath: lazy.py
+"""Deferred imports for heavy optional dependencies.
+
+lazy.module("google.generativeai") returns a stand-in that imports the real
+module the first time one of its attributes is used, so a gunicorn worker only
+pays for the Gemini/OpenAI SDKs, speech recognition or pyttsx3 once a request
+actually needs them. Its truth value says whether the module is installed
+(checked with importlib.util.find_spec, without importing it), which keeps the
+existing `if genai:` / `if not pyttsx3:` availability checks working.
+
+Whisper/torch (transcription.py), geopy (geocoding.py) and PIL (images.py)
+are already imported inside the functions that use them.
+
+    python lazy.py --bench
+
+starts the app in fresh interpreters (against a throwaway database) and
+reports import time, peak RSS and which heavy modules were loaded at startup.
+"""
+import sys
+import importlib
+import importlib.util
+import threading
+
+
+class LazyModule:
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import  # called once with the module, e.g. to configure an API key
+        self._module = None
+        self._available = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_import:
+                        self._on_import(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        # Only reached for attributes the stand-in itself does not have
+        return getattr(self._load(), attr)
+
+    def __bool__(self):
+        if self._available is None:
+            try:
+                self._available = importlib.util.find_spec(self._name) is not None
+            except (ImportError, ValueError):
+                self._available = False
+        return self._available
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def module(name, on_import=None) -> LazyModule:
+    return LazyModule(name, on_import)
+
+
+HEAVY_MODULES = ["torch", "whisper", "matplotlib", "pandas", "geopy", "PIL",
+                 "google.generativeai", "openai", "speech_recognition", "pyttsx3"]
+
+_BENCH_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "import_seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def _bench(runs=3):
+    import os
+    import json
+    import tempfile
+    import subprocess
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(tmp, "bench.db"))
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", _BENCH_SCRIPT % (HEAVY_MODULES,)],
+                                 capture_output=True, text=True, check=True, env=env).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+    best = min(results, key=lambda r: r["import_seconds"])
+    print(f"import app: {best['import_seconds'] * 1000:.0f} ms (best of {runs}), "
+          f"peak RSS {best['max_rss_mb']:.0f} MB per worker")
+    print(f"heavy modules loaded at startup: {', '.join(best['loaded']) or 'none'}")
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    _bench()
@@ -0,0 +1,95 @@
+# filepath: logs.py
+"""Structured JSON logs.
+
+Every log line is one JSON object on stdout (gunicorn and Docker collect it
+from there): the time, level and message, the id of the request being served
+and any fields passed by the caller, e.g.
+
+    {"ts": "2026-10-17T09:30:12.481Z", "level": "error", "msg": "Weather forecast failed",
+     "request_id": "3f2c...", "location": "Pune", "error": "..."}
+
+The request id comes from the X-Request-ID header set by nginx (a new one is
+made up otherwise) and is returned in the response's X-Request-ID header.
+Work handed to other threads keeps the id of the request that started it
+when the function is wrapped with bind(). LOG_FORMAT=text prints plain
+lines instead, which reads better in a terminal.
+"""
+import os
+import sys
+import json
+import uuid
+import threading
+import contextvars
+from datetime import datetime, timezone
+from functools import wraps
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").lower()  # debug, info, warning or error
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+MAX_REQUEST_ID = 64  # longer incoming ids are replaced
+
+_min_level = LEVELS.get(LOG_LEVEL, 20)
+_request_id = contextvars.ContextVar("request_id", default=None)
+_write_lock = threading.Lock()
+
+
+def new_request_id(incoming: str = None) -> str:
+    """Use the proxy's id if it looks sane, else make one up; it becomes the current request's id."""
+    request_id = incoming if incoming and len(incoming) <= MAX_REQUEST_ID and incoming.isprintable() else uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def request_id():
+    return _request_id.get()
+
+
+def bind(func):
+    """Wrap func so it logs under the current request id in whichever thread runs it."""
+    bound_id = _request_id.get()
+
+    @wraps(func)
+    def run(*args, **kwargs):
+        token = _request_id.set(bound_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _request_id.reset(token)
+    return run
+
+
+def log(level: str, msg: str, **fields):
+    if LEVELS[level] < _min_level:
+        return
+    record = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+              "level": level, "msg": msg}
+    current = _request_id.get()
+    if current:
+        record["request_id"] = current
+    record.update(fields)
+    if LOG_FORMAT == "text":
+        extra = " ".join(f"{k}={v}" for k, v in record.items() if k not in ("ts", "level", "msg"))
+        line = f"{record['ts']} {level.upper()} {msg}" + (f" {extra}" if extra else "")
+    else:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+    # One write per line so lines from different threads never interleave
+    with _write_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def debug(msg: str, **fields):
+    log("debug", msg, **fields)
+
+
+def info(msg: str, **fields):
+    log("info", msg, **fields)
+
+
+def warning(msg: str, **fields):
+    log("warning", msg, **fields)
+
+
+def error(msg: str, **fields):
+    log("error", msg, **fields)
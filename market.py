@@ -0,0 +1,394 @@
+# filepath: market.py
+"""Mandi price index for the market price answers.
+
+Price data is bulk-loaded from CSV (the data.gov.in / Agmarknet daily mandi
+price export: State, District, Market, Commodity, Arrival_Date, Min/Max/Modal
+price per quintal) into column arrays sorted by (crop, day), so all rows of a
+crop are one contiguous slice found by a dict lookup and a date window inside
+it is a binary search. Summaries (min/max/average, 7-day and period moving
+averages, volatility, trend) are computed with NumPy over that slice, well
+under a millisecond even with thousands of markets per crop.
+
+MARKET_PRICES_PATH may be a file or a directory of CSV files. It is checked
+every MARKET_RELOAD_INTERVAL seconds and re-ingested in a background thread
+when a file changed; requests keep using the previous index until the new one
+is swapped in. Without price files the index holds the built-in sample prices.
+
+Crop names are matched exactly, through aliases ("paddy", "corn"), without a
+plural "s", and finally by a close spelling match.
+"""
+import os
+import re
+import csv
+import time
+import difflib
+import threading
+from datetime import date, datetime
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import logs
+import intents
+
+MARKET_PRICES_PATH = os.getenv("MARKET_PRICES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "mandi_prices"))
+MARKET_RELOAD_INTERVAL = int(os.getenv("MARKET_RELOAD_INTERVAL", "300"))  # seconds between checks for new price files
+MARKET_TREND_DAYS = int(os.getenv("MARKET_TREND_DAYS", "30"))  # window of a summary
+MARKET_TREND_THRESHOLD = float(os.getenv("MARKET_TREND_THRESHOLD", "3"))  # % of the 7-day vs period average for rising/falling
+MARKET_VOLATILITY_THRESHOLD = float(os.getenv("MARKET_VOLATILITY_THRESHOLD", "5"))  # % daily price change std dev for volatile
+MARKET_ADVICE_TTL = int(os.getenv("MARKET_ADVICE_TTL", str(12 * 3600)))  # seconds a generated advisory is reused
+MARKET_ADVICE_CACHE_SIZE = int(os.getenv("MARKET_ADVICE_CACHE_SIZE", "512"))
+
+SHORT_WINDOW = 7  # days of the short moving average
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+# Used when no price files are installed: one snapshot per crop, with its trend
+SAMPLE_PRICES = {
+    "rice": {"min": 1800, "max": 2200, "avg": 2000, "trend": "stable"},
+    "wheat": {"min": 1900, "max": 2300, "avg": 2100, "trend": "rising"},
+    "cotton": {"min": 5500, "max": 6200, "avg": 5800, "trend": "falling"},
+    "sugarcane": {"min": 280, "max": 320, "avg": 300, "trend": "stable"},
+    "maize": {"min": 1700, "max": 1900, "avg": 1800, "trend": "rising"},
+    "potato": {"min": 1200, "max": 1800, "avg": 1500, "trend": "volatile"},
+    "tomato": {"min": 1500, "max": 2500, "avg": 2000, "trend": "falling"},
+    "onion": {"min": 1800, "max": 2800, "avg": 2300, "trend": "rising"},
+}
+
+PriceSummary = namedtuple("PriceSummary", [
+    "crop", "scope", "markets", "start", "end", "min", "max", "avg", "latest",
+    "ma_short", "ma_long", "volatility", "trend",
+])
+
+
+def _key(name) -> str:
+    return " ".join(str(name or "").lower().replace("_", " ").split())
+
+
+def _column(header: str) -> str:
+    # "Min_x0020_Price" / "Min Price" / "min_price" -> "min_price"
+    return "_".join(header.replace("_x0020_", " ").replace("(", " ").replace(")", " ").lower().split())
+
+
+def _parse_day(value: str) -> int:
+    value = value.strip()
+    for fmt in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d/%m/%y"):
+        try:
+            return datetime.strptime(value, fmt).date().toordinal()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognized date {value!r}")
+
+
+class PriceIndex:
+    """Immutable column store of price rows sorted by (crop, day)."""
+
+    def __init__(self, records, trend_labels=None, source="sample"):
+        """records: iterable of (crop, state, district, market, day ordinal, min, max, modal)."""
+        self.source = source
+        self.trend_labels = trend_labels or {}  # crop -> trend for crops with a single day of data
+        self._names = {}  # column -> {lowercased name: id}
+        self._values = {"crop": [], "state": [], "district": [], "market": []}  # column -> names by id
+
+        columns = {name: [] for name in ("crop", "state", "district", "market", "day", "min", "max", "modal")}
+        for crop, state, district, market, day, low, high, modal in records:
+            columns["crop"].append(self._intern("crop", crop))
+            columns["state"].append(self._intern("state", state))
+            columns["district"].append(self._intern("district", district))
+            columns["market"].append(self._intern("market", market))
+            columns["day"].append(day)
+            columns["min"].append(low)
+            columns["max"].append(high)
+            columns["modal"].append(modal)
+
+        crop = np.array(columns["crop"], dtype=np.int32)
+        day = np.array(columns["day"], dtype=np.int32)
+        order = np.lexsort((day, crop))
+        self.crop = crop[order]
+        self.day = day[order]
+        for name in ("state", "district", "market"):
+            setattr(self, name, np.array(columns[name], dtype=np.int32)[order])
+        for name in ("min", "max", "modal"):
+            setattr(self, name, np.array(columns[name], dtype=np.float32)[order])
+        # Rows of crop id i are self._offsets[i]:self._offsets[i + 1]
+        self._offsets = np.searchsorted(self.crop, np.arange(len(self._values["crop"]) + 1))
+
+        self.crops = {_key(name): i for i, name in enumerate(self._values["crop"])}
+        self.aliases = {}
+        for crop in self.crops:
+            # Agmarknet names carry qualifiers: "paddy(dhan)(common)" is also "paddy"
+            base = crop.split("(")[0].strip()
+            if base and base not in self.crops:
+                self.aliases.setdefault(base, crop)
+        for alias, canonical in intents.CROP_ALIASES.items():
+            if _key(canonical) in self.crops:
+                self.aliases[alias] = _key(canonical)
+        self._spellings = sorted(set(self.crops) | set(self.aliases))
+
+    def _intern(self, column, value):
+        value = " ".join(str(value or "").split())
+        names = self._names.setdefault(column, {})
+        key = _key(value)
+        if key not in names:
+            names[key] = len(self._values[column])
+            self._values[column].append(value)
+        return names[key]
+
+    def __len__(self):
+        return len(self.day)
+
+    def resolve(self, name: str):
+        """Return the canonical (lowercased) crop name for a user-supplied name, or None."""
+        key = _key(name)
+        if not key:
+            return None
+        for candidate in (key, key[:-1] if key.endswith("s") else None, key[:-2] if key.endswith("es") else None):
+            if candidate in self.crops:
+                return candidate
+            if candidate in self.aliases:
+                return self.aliases[candidate]
+        close = difflib.get_close_matches(key, self._spellings, n=1, cutoff=0.8)
+        if close:
+            return self.aliases.get(close[0], close[0])
+        return None
+
+    def find_in_text(self, text: str):
+        """Return the first crop named in free text (exact names and aliases only), or None."""
+        words = _WORD.findall((text or "").lower())
+        for size in (3, 2, 1):
+            for i in range(len(words) - size + 1):
+                term = " ".join(words[i:i + size])
+                for candidate in (term, term[:-1] if term.endswith("s") else None):
+                    if candidate in self.crops:
+                        return candidate
+                    if candidate in self.aliases:
+                        return self.aliases[candidate]
+        return None
+
+    def _place_mask(self, rows, location):
+        key = _key(location)
+        mask = np.zeros(rows.stop - rows.start, dtype=bool)
+        for column in ("state", "district", "market"):
+            place_id = self._names.get(column, {}).get(key)
+            if place_id is not None:
+                mask |= getattr(self, column)[rows] == place_id
+        return mask
+
+    def summary(self, crop_name: str, location: str = None, days: int = MARKET_TREND_DAYS):
+        """PriceSummary over the last `days` days of data for a crop (optionally one place), or None."""
+        crop = self.resolve(crop_name)
+        if crop is None:
+            return None
+        crop_id = self.crops[crop]
+        start, end = int(self._offsets[crop_id]), int(self._offsets[crop_id + 1])
+        if start == end:
+            return None
+
+        # Days are sorted within the crop's slice, so the window is a binary search
+        last_day = int(self.day[end - 1])
+        first_day = last_day - days + 1
+        rows = slice(start + int(np.searchsorted(self.day[start:end], first_day)), end)
+
+        scope = "All India"
+        day, modal, low, high, markets = (self.day[rows], self.modal[rows], self.min[rows],
+                                          self.max[rows], self.market[rows])
+        if location:
+            mask = self._place_mask(rows, location)
+            if mask.any():
+                scope = location.strip().title()
+                picked = np.flatnonzero(mask)
+                day, modal, low, high, markets = (column.take(picked) for column in (day, modal, low, high, markets))
+
+        # Mean modal price per day with data (rows are in day order)
+        offset = day - day[0]
+        counts = np.bincount(offset)
+        observed = counts > 0
+        daily = np.bincount(offset, weights=modal)[observed] / counts[observed]
+
+        ma_short = float(daily[-SHORT_WINDOW:].mean())
+        ma_long = float(daily.mean())
+        if len(daily) > 1:
+            volatility = float(np.std(np.diff(np.log(daily))) * 100)
+            change = (ma_short - ma_long) / ma_long * 100 if ma_long else 0.0
+            if volatility > MARKET_VOLATILITY_THRESHOLD:
+                trend = "volatile"
+            elif change > MARKET_TREND_THRESHOLD:
+                trend = "rising"
+            elif change < -MARKET_TREND_THRESHOLD:
+                trend = "falling"
+            else:
+                trend = "stable"
+        else:
+            volatility = 0.0
+            trend = self.trend_labels.get(crop, "stable")
+
+        return PriceSummary(
+            crop=self._values["crop"][crop_id],
+            scope=scope,
+            markets=int(np.count_nonzero(np.bincount(markets))),
+            start=date.fromordinal(int(day[0])),
+            end=date.fromordinal(int(day[-1])),
+            min=float(low.min()),
+            max=float(high.max()),
+            avg=float(modal.mean()),
+            latest=float(daily[-1]),
+            ma_short=ma_short,
+            ma_long=ma_long,
+            volatility=volatility,
+            trend=trend,
+        )
+
+
+def sample_index() -> PriceIndex:
+    today = date.today().toordinal()
+    records = [(crop, "", "", "All India", today, p["min"], p["max"], p["avg"]) for crop, p in SAMPLE_PRICES.items()]
+    return PriceIndex(records, {crop: p["trend"] for crop, p in SAMPLE_PRICES.items()}, source="sample")
+
+
+def _price_files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(".csv"))
+    return [path] if os.path.isfile(path) else []
+
+
+def read_price_files(paths):
+    """Yield index records from Agmarknet-style CSV files, skipping malformed rows."""
+    for path in paths:
+        skipped = 0
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            header = [_column(h) for h in next(reader, [])]
+            try:
+                crop_i = header.index("commodity")
+                day_i = header.index("arrival_date")
+                low_i, high_i, modal_i = header.index("min_price"), header.index("max_price"), header.index("modal_price")
+            except ValueError:
+                logs.warning("Skipping price file without commodity/arrival_date/min/max/modal price columns", path=path)
+                continue
+            place_i = [header.index(c) if c in header else None for c in ("state", "district", "market")]
+            days = {}  # a daily export has a handful of distinct dates, parse each once
+            for row in reader:
+                try:
+                    places = [row[i] if i is not None else "" for i in place_i]
+                    day = days.get(row[day_i])
+                    if day is None:
+                        day = days[row[day_i]] = _parse_day(row[day_i])
+                    yield (row[crop_i], *places, day,
+                           float(row[low_i]), float(row[high_i]), float(row[modal_i]))
+                except (ValueError, IndexError):
+                    skipped += 1
+        if skipped:
+            logs.warning("Skipped malformed price rows", path=path, rows=skipped)
+
+
+class PriceBook:
+    """Holds the current PriceIndex and re-ingests the price files when they change."""
+
+    def __init__(self, path=MARKET_PRICES_PATH, reload_interval=MARKET_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.index = sample_index()
+        self._signature = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        self.load_seconds = None
+
+    def _files_signature(self):
+        files = _price_files(self.path)
+        return tuple((p, os.path.getmtime(p), os.path.getsize(p)) for p in files)
+
+    def reload_if_changed(self) -> bool:
+        signature = self._files_signature()
+        if signature == self._signature:
+            return False
+        started = time.perf_counter()
+        if signature:
+            index = PriceIndex(read_price_files([p for p, _, _ in signature]), source=self.path)
+            if not len(index):
+                index = sample_index()
+        else:
+            index = sample_index()
+        self.index = index  # swapped in one assignment; readers keep the index they started with
+        self._signature = signature
+        self.loaded_at = time.time()
+        self.load_seconds = time.perf_counter() - started
+        if signature:
+            logs.info("Loaded mandi prices", prices=len(index), crops=len(index.crops), seconds=round(self.load_seconds, 2))
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logs.error("Market price load failed, keeping the current prices", error=str(e))
+            time.sleep(self.reload_interval)
+
+    def start(self):
+        """Load and then watch the price files from a background thread in this process.
+
+        Workers serve the sample prices until the first load finishes, so a
+        large price file does not delay startup.
+        """
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="market-prices", daemon=True)
+            self._thread.start()
+
+    def summary(self, crop_name, location=None):
+        return self.index.summary(crop_name, location)
+
+    def stats(self) -> dict:
+        return {
+            "source": self.index.source,
+            "rows": len(self.index),
+            "crops": len(self.index.crops),
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+        }
+
+
+class AdvisoryCache:
+    """Generated market advice per (crop, trend), reused for MARKET_ADVICE_TTL seconds.
+
+    generate(summary) -> advice text; None or an exception is not cached.
+    """
+
+    def __init__(self, generate, ttl=MARKET_ADVICE_TTL, cache_size=MARKET_ADVICE_CACHE_SIZE):
+        self.generate = generate
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._lru = OrderedDict()  # (crop, trend) -> (advice, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, summary: PriceSummary):
+        key = (_key(summary.crop), summary.trend)
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and entry[1] > now:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        advice = self.generate(summary)
+        if advice:
+            with self._lock:
+                self._lru[key] = (advice, now + self.ttl)
+                self._lru.move_to_end(key)
+                while len(self._lru) > self.cache_size:
+                    self._lru.popitem(last=False)
+        return advice
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._lru), "hits": self.hits, "misses": self.misses}
+
+
+prices = PriceBook()
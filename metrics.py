@@ -0,0 +1,242 @@
+# filepath: metrics.py
+"""Prometheus metrics for the request pipeline, served at /metrics.
+
+farmer_stage_duration_seconds times each stage of answering a farmer, by
+stage: intent_routing, geocoding, weather_fetch, llm (with provider and
+model labels), translation, tts, transcription and db_write (one batch
+transaction). farmer_http_request_duration_seconds times whole requests per
+route; for streamed answers that is the time to the first byte. The counters
+cover cache lookups (taken from the caches' own stats), LLM provider failures
+and answers that fell back to rule_based_advice.
+
+Each gunicorn worker keeps its metrics in memory and writes a snapshot to
+METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds (and on exit);
+/metrics adds up the snapshots of all workers, so a scrape covers the whole
+server whichever worker answers it. Snapshots of workers that have exited
+are kept so counters never go backwards; gunicorn empties the directory when
+it starts (see gunicorn.conf.py).
+"""
+import os
+import glob
+import json
+import time
+import bisect
+import atexit
+import threading
+from contextlib import contextmanager
+
+import logs
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR", "")  # default: .metrics next to the database
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))  # seconds
+METRICS_BUCKETS = tuple(sorted(float(b) for b in os.getenv(  # histogram bucket bounds, seconds
+    "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60").split(",")))
+
+PREFIX = "farmer_"
+METRICS = {  # name -> (type, help)
+    "stage_duration_seconds": ("histogram", "Time spent in each stage of the request pipeline."),
+    "http_request_duration_seconds": ("histogram", "Time to respond per route (first byte for streamed answers)."),
+    "cache_requests_total": ("counter", "Cache lookups by cache and result."),
+    "provider_failures_total": ("counter", "LLM provider calls that failed or answered after their timeout."),
+    "rule_based_fallbacks_total": ("counter", "General answers that fell back to rule_based_advice (no LLM answered)."),
+}
+_CACHE_RESULTS = {"hits": "hit", "near_hits": "near_hit", "stale_hits": "stale_hit", "misses": "miss",
+                  "segment_hits": "hit", "segment_misses": "miss"}
+
+
+def metrics_dir() -> str:
+    if METRICS_DIR:
+        return METRICS_DIR
+    import storage  # storage records db_write timings, so not imported at the top
+
+    return os.path.join(os.path.dirname(os.path.abspath(storage.DB_PATH)), ".metrics")
+
+
+def reset(directory=None):
+    """Delete all workers' snapshots (called by gunicorn before it starts the workers)."""
+    for path in glob.glob(os.path.join(directory or metrics_dir(), "*.json")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return PREFIX + name
+    return PREFIX + name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    def __init__(self, directory=None, buckets=METRICS_BUCKETS, enabled=METRICS_ENABLED,
+                 flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.buckets = buckets
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket (+Inf last), sum]
+        self._caches = {}  # cache name -> its stats() function
+        self._thread = None
+        self._pid = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked: what the parent recorded is in the parent's snapshot
+                self._counters, self._histograms = {}, {}
+            self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+        self._thread.start()
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        key = self._key(name, labels)
+        index = bisect.bisect_left(self.buckets, seconds)  # bounds are inclusive (le)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Observe the duration of the with block as a stage_duration_seconds sample."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def register_cache(self, name, stats):
+        """Report stats()'s hits/misses counters as cache_requests_total{cache=name}."""
+        self._caches[name] = stats
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(counts), total) for key, (counts, total) in self._histograms.items()}
+        for cache, stats in self._caches.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logs.warning("Cache stats for metrics failed", cache=cache, error=str(e))
+                continue
+            for field, result in _CACHE_RESULTS.items():
+                if field in values:
+                    key = ("cache_requests_total", (("cache", cache), ("result", result)))
+                    counters[key] = counters.get(key, 0) + values[field]
+        return {
+            "pid": os.getpid(),
+            "buckets": list(self.buckets),
+            "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+            "histograms": [[name, labels, counts, total] for (name, labels), (counts, total) in histograms.items()],
+        }
+
+    def dump(self):
+        """Write this worker's snapshot for /metrics in the other workers."""
+        directory = self.directory or metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.dump()
+            except Exception as e:
+                logs.error("Metrics snapshot failed", error=str(e))
+
+    def _merged(self):
+        counters, histograms = {}, {}
+        for path in glob.glob(os.path.join(self.directory or metrics_dir(), "*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # deleted by a restart meanwhile
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            if snapshot["buckets"] != list(self.buckets):
+                continue  # written before METRICS_BUCKETS changed
+            for name, labels, counts, total in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        return counters, histograms
+
+    def render(self) -> str:
+        """All workers' metrics in the Prometheus text exposition format."""
+        self._ensure_started()
+        self.dump()
+        counters, histograms = self._merged()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} {kind}"]
+            if kind == "counter":
+                for (_, labels), value in sorted(item for item in counters.items() if item[0][0] == name):
+                    lines.append(f"{_series(name, labels)} {value}")
+                continue
+            for (_, labels), (counts, total) in sorted(item for item in histograms.items() if item[0][0] == name):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else repr(bound)
+                    lines.append(f"{_series(name + '_bucket', labels, [('le', le)])} {cumulative}")
+                lines.append(f"{_series(name + '_sum', labels)} {total}")
+                lines.append(f"{_series(name + '_count', labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.enabled and self._pid == os.getpid():
+            try:
+                self.dump()
+            except Exception:
+                pass
+
+
+registry = Registry()
+atexit.register(registry.close)
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, **labels)
+
+
+def timer(stage, **labels):
+    return registry.timer(stage, **labels)
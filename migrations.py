@@ -0,0 +1,253 @@
+# filepath: migrations.py
+"""Versioned schema migrations for queries.db.
+
+The schema version lives in SQLite's user_version pragma. Every worker calls
+migrate() on startup; each pending migration runs in its own BEGIN IMMEDIATE
+transaction together with its version bump, and the version is re-read after
+the write lock is taken, so gunicorn workers starting at the same time apply
+every migration exactly once and a failing migration leaves the database at
+the previous version.
+
+Migrations are append-only: never edit one that has shipped, add a new one.
+"""
+import logs
+
+
+def add_missing_columns(c, table: str, columns: dict):
+    """Add columns introduced after a table was first created (existing databases)"""
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+def _baseline(c):
+    """Tables as created by init_db before migrations existed (idempotent for old databases)"""
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT,
+            response TEXT,
+            query_type TEXT DEFAULT 'general',
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+
+    # Image analysis table (content_hash/phash index past diagnoses for reuse)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS image_analysis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_path TEXT,
+            analysis_result TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            content_hash TEXT,
+            phash INTEGER
+        )"""
+    )
+    add_missing_columns(c, "image_analysis", {"content_hash": "TEXT", "phash": "INTEGER"})
+    c.execute("CREATE INDEX IF NOT EXISTS idx_image_analysis_content_hash ON image_analysis (content_hash)")
+
+    # Weather forecasts table (rows with a cell are the per grid cell forecast cache)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS weather_forecasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            location TEXT,
+            forecast_data TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            cell TEXT
+        )"""
+    )
+    add_missing_columns(c, "weather_forecasts", {"cell": "TEXT"})
+    c.execute("CREATE INDEX IF NOT EXISTS idx_weather_forecasts_cell ON weather_forecasts (cell, id)")
+
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS market_prices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            crop_name TEXT,
+            price_data TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS seasonal_crops (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            region TEXT,
+            season TEXT,
+            advice TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+
+    # Chatbot conversation log
+    c.execute("CREATE TABLE IF NOT EXISTS chat_queries (id INTEGER PRIMARY KEY, query TEXT, response TEXT, timestamp TEXT)")
+
+    # Geocoding cache (normalized location name -> coordinates)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS geocode_cache (
+            name TEXT PRIMARY KEY,
+            display_name TEXT,
+            latitude REAL,
+            longitude REAL,
+            source TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+
+    # Translation memory (sentence hash + target language -> translation)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS translation_memory (
+            source_hash TEXT,
+            language TEXT,
+            source TEXT,
+            translation TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (source_hash, language)
+        )"""
+    )
+
+    # Background jobs (image analysis, transcription, text-to-speech)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT,
+            status TEXT,
+            result TEXT,
+            error TEXT,
+            pid INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+
+
+def _query_metadata(c):
+    """Repair the queries table and record crop/location with every logged question.
+
+    Databases created by the first releases have queries(id, question,
+    response) only, and CREATE TABLE IF NOT EXISTS never added the rest.
+    timestamp cannot be added with ALTER TABLE (its default is not a
+    constant), so such tables are rebuilt; the old rows keep a NULL timestamp.
+    """
+    existing = {row[1] for row in c.execute("PRAGMA table_info(queries)")}
+    if not {"query_type", "timestamp"} <= existing:
+        c.execute(
+            """CREATE TABLE queries_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT,
+                response TEXT,
+                query_type TEXT DEFAULT 'general',
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )"""
+        )
+        query_type = "query_type" if "query_type" in existing else "'general'"
+        timestamp = "timestamp" if "timestamp" in existing else "NULL"
+        c.execute(
+            f"INSERT INTO queries_new (id, question, response, query_type, timestamp) "
+            f"SELECT id, question, response, {query_type}, {timestamp} FROM queries"
+        )
+        c.execute("DROP TABLE queries")
+        c.execute("ALTER TABLE queries_new RENAME TO queries")
+
+    add_missing_columns(c, "queries", {"crop": "TEXT", "location": "TEXT"})
+    add_missing_columns(c, "chat_queries", {"intent": "TEXT", "crop": "TEXT", "location": "TEXT"})
+
+
+def _admin_indexes(c):
+    """Indexes behind the admin history filters (see history.py).
+
+    Equality filters are (column, id) so a filtered page is one index range
+    walk in id order; timestamp indexes turn a date range into an id range.
+    """
+    statements = [
+        "CREATE INDEX IF NOT EXISTS idx_queries_type ON queries (query_type, id)",
+        "CREATE INDEX IF NOT EXISTS idx_queries_crop ON queries (crop COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_queries_location ON queries (location COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_queries_timestamp ON queries (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_queries_intent ON chat_queries (intent, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_queries_crop ON chat_queries (crop COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_queries_location ON chat_queries (location COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_queries_timestamp ON chat_queries (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_image_analysis_timestamp ON image_analysis (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_weather_forecasts_location ON weather_forecasts (location COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_weather_forecasts_timestamp ON weather_forecasts (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_market_prices_crop ON market_prices (crop_name COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_market_prices_timestamp ON market_prices (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_seasonal_crops_region ON seasonal_crops (region COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_seasonal_crops_season ON seasonal_crops (season, id)",
+        "CREATE INDEX IF NOT EXISTS idx_seasonal_crops_timestamp ON seasonal_crops (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at)",
+    ]
+    for statement in statements:
+        c.execute(statement)
+
+
+def _analytics_rollups(c):
+    """Answer source per logged question and the rollup tables (see analytics.py)"""
+    add_missing_columns(c, "queries", {"source": "TEXT"})
+    add_missing_columns(c, "chat_queries", {"source": "TEXT"})
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS stats_rollups (
+            period TEXT,
+            bucket TEXT,
+            dimension TEXT,
+            value TEXT,
+            count INTEGER,
+            PRIMARY KEY (period, bucket, dimension, value)
+        ) WITHOUT ROWID"""
+    )
+    c.execute("CREATE TABLE IF NOT EXISTS stats_watermarks (source_table TEXT PRIMARY KEY, last_id INTEGER)")
+
+
+def _seasonal_versions(c):
+    """Prompt version of precomputed seasonal advice (see seasonal.py); NULL for history rows"""
+    add_missing_columns(c, "seasonal_crops", {"version": "INTEGER"})
+    c.execute("CREATE INDEX IF NOT EXISTS idx_seasonal_crops_version ON seasonal_crops (version, region COLLATE NOCASE, season, id)")
+
+
+def _inflight_requests(c):
+    """Cross-worker leases of in-flight upstream calls (see singleflight.py)"""
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS inflight_requests (
+            key TEXT PRIMARY KEY,
+            owner TEXT,
+            state TEXT,
+            result TEXT,
+            expires_at REAL
+        ) WITHOUT ROWID"""
+    )
+
+
+# (version, description, function); append only
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "queries.query_type/timestamp repair, crop/location columns", _query_metadata),
+    (3, "admin history indexes", _admin_indexes),
+    (4, "answer source column, analytics rollup tables", _analytics_rollups),
+    (5, "seasonal advice version column", _seasonal_versions),
+    (6, "in-flight request leases", _inflight_requests),
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS) -> int:
+    """Apply the pending migrations and return the resulting schema version."""
+    for version, description, apply in migrations:
+        if schema_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have applied it while we waited for the lock
+            if schema_version(conn) < version:
+                c = conn.cursor()
+                apply(c)
+                c.execute(f"PRAGMA user_version = {int(version)}")
+                logs.info("Applied schema migration", version=version, description=description)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
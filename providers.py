@@ -0,0 +1,303 @@
+# filepath: providers.py
+"""Hedged fan-out over the LLM providers.
+
+get_advice used to call Gemini and, only once that failed, OpenAI, so the
+worst case was the sum of both latencies. ProviderChain instead starts the
+first healthy provider and, if it has not answered within LLM_HEDGE_DELAY_MS,
+starts the next one as well; the first good answer wins and the slower call is
+abandoned (its result is discarded, and a call that has not started yet is
+cancelled). A provider that fails is followed immediately by the next one.
+
+Each provider has its own timeout and a circuit breaker: after
+LLM_BREAKER_FAILURES consecutive failures or timeouts it is skipped for
+LLM_BREAKER_RESET seconds, after which a single trial call decides whether it
+is healthy again. Latency and outcome counters per provider are kept for
+/api/providers/stats.
+
+ProviderChain.stream is the streaming counterpart used by the chat endpoint:
+token streams cannot be hedged (the first chunk is already on its way to the
+client), so providers are tried in order and the next one is only used when a
+provider fails before producing any text. A provider that fails after its
+first chunk counts as a failure and the error is raised to the caller, which
+must not treat the partial text as an answer.
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import logs
+import metrics
+import concurrency
+
+LLM_HEDGE_DELAY_MS = int(os.getenv("LLM_HEDGE_DELAY_MS", "2500"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))  # seconds, per provider call
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "25"))  # seconds for the whole fan-out
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "60"))  # seconds
+# Enough for every upstream slot (greenlets under gevent), so a call never queues here
+# behind the upstream limits and spends its provider timeout waiting for a thread
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", str(concurrency.UPSTREAM_LIMIT_GEMINI + concurrency.UPSTREAM_LIMIT_OPENAI)))
+
+LATENCY_WINDOW = 200  # recent successful calls used for the percentiles
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half-open after `reset` seconds."""
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, reset=LLM_BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        """Give back a half-open trial whose call was cancelled before it started."""
+        with self._lock:
+            if self._opened_at is not None:
+                self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._trial_running or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class Provider:
+    """A named text-generation function with a timeout, breaker and latency stats.
+
+    call(prompt) returns the answer, or an empty string / raises on failure.
+    stream(prompt), if given, yields the answer in chunks as it is generated.
+    """
+
+    def __init__(self, name, call, timeout=LLM_TIMEOUT, breaker=None, stream=None):
+        self.name = name
+        self.call = call
+        self.stream = stream
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.wins = 0
+
+    def run(self, prompt):
+        started = time.monotonic()
+        try:
+            answer = self.call(prompt)
+        except Exception as e:
+            logs.error("LLM provider failed", provider=self.name, error=str(e))
+            answer = ""
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.calls += 1
+            if answer and elapsed <= self.timeout:
+                self.successes += 1
+                self._latencies.append(elapsed)
+            elif answer:
+                self.timeouts += 1  # answered, but after the caller gave up on it
+            else:
+                self.failures += 1
+        if not (answer and elapsed <= self.timeout):
+            metrics.inc("provider_failures_total", provider=self.name, reason="timeout" if answer else "error")
+        if answer and elapsed <= self.timeout:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return answer
+
+    def run_stream(self, prompt):
+        """Yield chunks from stream(prompt), recording the outcome like run().
+
+        An error after the first chunk is re-raised: the text so far is incomplete.
+        """
+        started = time.monotonic()
+        produced = False
+        try:
+            for chunk in self.stream(prompt):
+                if chunk:
+                    produced = True
+                    yield chunk
+        except GeneratorExit:
+            # The client went away mid-answer; the provider was answering fine
+            self.breaker.record_success()
+            raise
+        except Exception as e:
+            logs.error("LLM provider stream failed", provider=self.name, error=str(e), partial=produced)
+            with self._lock:
+                self.calls += 1
+                self.failures += 1
+            self.breaker.record_failure()
+            metrics.inc("provider_failures_total", provider=self.name, reason="error")
+            if produced:
+                raise
+            return
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.calls += 1
+            if produced:
+                self.successes += 1
+                self._latencies.append(elapsed)
+            else:
+                self.failures += 1
+        if produced:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+            metrics.inc("provider_failures_total", provider=self.name, reason="error")
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+            def percentile(p):
+                if not latencies:
+                    return None
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000)
+
+            return {
+                "state": self.breaker.state,
+                "calls": self.calls,
+                "successes": self.successes,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "skipped": self.skipped,
+                "wins": self.wins,
+                "p50_ms": percentile(0.5),
+                "p95_ms": percentile(0.95),
+            }
+
+
+class ProviderChain:
+    def __init__(self, providers, hedge_delay=LLM_HEDGE_DELAY_MS / 1000, total_timeout=LLM_TOTAL_TIMEOUT,
+                 max_workers=LLM_MAX_WORKERS):
+        self.providers = list(providers)
+        self.hedge_delay = hedge_delay
+        self.total_timeout = total_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    def _next_allowed(self, remaining):
+        while remaining:
+            provider = remaining.pop(0)
+            if provider.breaker.allow():
+                return provider
+            with provider._lock:
+                provider.skipped += 1
+        return None
+
+    @staticmethod
+    def _cancel(future, provider):
+        # A call that never started records no outcome; a half-open trial must be given back,
+        # or the breaker would wait for that trial forever
+        if future.cancel():
+            provider.breaker.release_trial()
+
+    def ask(self, prompt: str):
+        """Return (answer, provider name) for the first good answer, or ("", None)."""
+        remaining = list(self.providers)
+        started = time.monotonic()
+        deadline = started + self.total_timeout
+        running = {}  # future -> (provider, start time)
+
+        def launch():
+            provider = self._next_allowed(remaining)
+            if provider is not None:
+                running[self._executor.submit(logs.bind(provider.run), prompt)] = (provider, time.monotonic())
+            return provider is not None
+
+        launch()
+        next_hedge = time.monotonic() + self.hedge_delay
+        try:
+            while running:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                # Give up on calls that have run past their provider's timeout
+                for future, (provider, launched) in list(running.items()):
+                    if now - launched > provider.timeout:
+                        del running[future]
+                        self._cancel(future, provider)
+                if not running:
+                    if launch():
+                        next_hedge = time.monotonic() + self.hedge_delay
+                        continue
+                    break
+
+                wake = min([deadline, next_hedge if remaining else deadline]
+                           + [launched + provider.timeout for provider, launched in running.values()])
+                done, _ = wait(list(running), timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider, _ = running.pop(future)
+                    answer = future.result()
+                    if answer:
+                        with provider._lock:
+                            provider.wins += 1
+                        return answer, provider.name
+                    # Failed fast: start the next provider without waiting for the hedge delay
+                    if launch():
+                        next_hedge = time.monotonic() + self.hedge_delay
+                if remaining and time.monotonic() >= next_hedge:
+                    launch()
+                    next_hedge = time.monotonic() + self.hedge_delay
+                if not running and remaining and launch():
+                    next_hedge = time.monotonic() + self.hedge_delay
+        finally:
+            for future, (provider, _) in running.items():
+                self._cancel(future, provider)
+        return "", None
+
+    def stream(self, prompt: str):
+        """Yield (chunk, provider name) pairs from the first provider that produces text.
+
+        Yields nothing if every provider fails before its first chunk, and raises
+        the provider's error if it fails after it.
+        """
+        remaining = [provider for provider in self.providers if provider.stream is not None]
+        while True:
+            provider = self._next_allowed(remaining)
+            if provider is None:
+                return
+            produced = False
+            for chunk in provider.run_stream(prompt):
+                produced = True
+                yield chunk, provider.name
+            if produced:
+                with provider._lock:
+                    provider.wins += 1
+                return
+
+    def stats(self) -> dict:
+        return {provider.name: provider.stats() for provider in self.providers}
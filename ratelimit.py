@@ -0,0 +1,136 @@
+# filepath: ratelimit.py
+"""Per-client token bucket rate limits for the expensive endpoints.
+
+Each limit allows `per_minute` requests per client IP on average with bursts
+of up to `burst`. The buckets live in a small memory-mapped file next to the
+database (RATE_LIMIT_SLOTS buckets of two doubles, the client IP hashed to a
+slot), updated under an exclusive file lock, so all gunicorn workers enforce
+one shared limit per client instead of one each. Clients that hash to the
+same slot share a bucket; with the default 65536 slots that is rare.
+
+The client address is the peer address unless RATE_LIMIT_PROXIES is set:
+behind nginx every request comes from the proxy, so it is then taken from
+X-Forwarded-For, trusting the last RATE_LIMIT_PROXIES entries. Only set it
+when the app is reachable through the proxy alone, or any client can pick
+its own bucket with a forged header. Requests over the limit get 429 with a
+Retry-After header.
+"""
+import os
+import math
+import mmap
+import zlib
+import time
+import struct
+import threading
+from functools import wraps
+
+from flask import request, jsonify
+
+import logs
+import storage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: the Flask dev server runs a single process
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_PROXIES = int(os.getenv("RATE_LIMIT_PROXIES", "0"))  # trusted reverse proxies in X-Forwarded-For
+RATE_LIMIT_SLOTS = int(os.getenv("RATE_LIMIT_SLOTS", "65536"))  # buckets per limit
+RATE_LIMIT_CHAT = float(os.getenv("RATE_LIMIT_CHAT", "20"))  # requests per minute per client, 0 = no limit
+RATE_LIMIT_CHAT_BURST = int(os.getenv("RATE_LIMIT_CHAT_BURST", "10"))
+RATE_LIMIT_IMAGE = float(os.getenv("RATE_LIMIT_IMAGE", "6"))
+RATE_LIMIT_IMAGE_BURST = int(os.getenv("RATE_LIMIT_IMAGE_BURST", "3"))
+RATE_LIMIT_SPEECH = float(os.getenv("RATE_LIMIT_SPEECH", "10"))
+RATE_LIMIT_SPEECH_BURST = int(os.getenv("RATE_LIMIT_SPEECH_BURST", "5"))
+
+_BUCKET = struct.Struct("dd")  # tokens, last update (epoch seconds; 0 = never used)
+
+
+def client_ip() -> str:
+    forwarded = [ip.strip() for ip in request.headers.get("X-Forwarded-For", "").split(",") if ip.strip()]
+    if RATE_LIMIT_PROXIES and forwarded:
+        return forwarded[-min(RATE_LIMIT_PROXIES, len(forwarded))]
+    return request.remote_addr or "unknown"
+
+
+class TokenBucket:
+    def __init__(self, name, per_minute, burst, slots=RATE_LIMIT_SLOTS, directory=None, enabled=RATE_LIMIT_ENABLED):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = max(burst, 1)
+        self.slots = slots
+        self.enabled = enabled and per_minute > 0
+        self.path = os.path.join(directory or os.path.dirname(os.path.abspath(storage.DB_PATH)), f".ratelimit-{name}")
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self.allowed = 0
+        self.limited = 0
+
+    def _open(self):
+        # Per process: a lock on a descriptor inherited across fork would not exclude the parent
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = self.slots * _BUCKET.size
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)  # zero-filled: every bucket starts full
+        self._fd, self._map, self._pid = fd, mmap.mmap(fd, size), os.getpid()
+
+    def take(self, client: str) -> float:
+        """Spend one token of client's bucket; return 0 if allowed, else seconds until a token is available."""
+        offset = (zlib.crc32(client.encode("utf-8")) % self.slots) * _BUCKET.size
+        with self._lock:
+            self._open()
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                tokens, updated = _BUCKET.unpack_from(self._map, offset)
+                now = time.time()
+                tokens = self.burst if not updated else min(self.burst, tokens + max(now - updated, 0) * self.rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+                _BUCKET.pack_into(self._map, offset, tokens, now)
+            finally:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {"per_minute": round(self.rate * 60, 2), "burst": self.burst, "enabled": self.enabled,
+                "allowed": self.allowed, "limited": self.limited}
+
+
+def limited(bucket: TokenBucket, reply):
+    """Route decorator: answer 429 with reply(message) as JSON when the client is over bucket's limit."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if bucket.enabled:
+                try:
+                    wait = bucket.take(client_ip())
+                except OSError as e:
+                    # Never turn a broken limiter into an outage
+                    logs.error("Rate limit check failed", limit=bucket.name, error=str(e))
+                    wait = 0
+                if wait:
+                    seconds = math.ceil(wait)
+                    body = reply(f"Too many requests. Please try again in {seconds} seconds.")
+                    return jsonify(body), 429, {"Retry-After": str(seconds)}
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+chat = TokenBucket("chat", RATE_LIMIT_CHAT, RATE_LIMIT_CHAT_BURST)
+image = TokenBucket("image", RATE_LIMIT_IMAGE, RATE_LIMIT_IMAGE_BURST)
+speech = TokenBucket("speech", RATE_LIMIT_SPEECH, RATE_LIMIT_SPEECH_BURST)
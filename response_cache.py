@@ -0,0 +1,212 @@
+# filepath: response_cache.py
+"""Response cache for chatbot and advisory answers.
+
+Two tiers:
+  * exact: keyed on (intent, normalized query text), TTL + LRU eviction
+  * near-duplicate: a NumPy matrix of hashed n-gram vectors for the cached
+    queries; a lookup is a single matrix-vector product, so "What are the latest
+    innovations in agricultural technology?" and "what are latest innovations in
+    agricultural technology" share one answer. Questions that differ only in a
+    word or two still score high ("stem borer in paddy" / "... in maize"), so
+    a near match is only used when the crop, season and location named in
+    both questions (the entities callable, e.g. from intents.py) are equal.
+
+TTLs are per intent (weather answers go stale quickly, seasonal advice does
+not). The cache is warmed from the query history stored in queries.db.
+"""
+import os
+import re
+import time
+import zlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))  # 0 disables the near-duplicate tier
+# Weather/market/seasonal answers depend on a location, crop or season named in
+# the query, so by default only general questions may be answered by a near match.
+RESPONSE_CACHE_NEAR_DUP_INTENTS = set(os.getenv("RESPONSE_CACHE_NEAR_DUP_INTENTS", "general").split(","))
+
+DEFAULT_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+INTENT_TTLS = {
+    "weather": int(os.getenv("RESPONSE_CACHE_TTL_WEATHER", str(30 * 60))),
+    "market": int(os.getenv("RESPONSE_CACHE_TTL_MARKET", str(6 * 3600))),
+    "seasonal": int(os.getenv("RESPONSE_CACHE_TTL_SEASONAL", str(7 * 24 * 3600))),
+    "general": DEFAULT_TTL,
+}
+
+VECTOR_DIM = 1024
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace (any script)."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _vectorize(normalized: str) -> np.ndarray:
+    """Hashed bag of words + character trigrams, L2-normalized."""
+    vec = np.zeros(VECTOR_DIM, dtype=np.float32)
+    features = normalized.split()
+    padded = f" {normalized} "
+    features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    if not features:
+        return vec
+    idx = np.fromiter((zlib.crc32(f.encode("utf-8")) % VECTOR_DIM for f in features), dtype=np.int64, count=len(features))
+    np.add.at(vec, idx, 1.0)
+    norm = np.linalg.norm(vec)
+    if norm:
+        vec /= norm
+    return vec
+
+
+class _Entry:
+    __slots__ = ("response", "expires_at", "row", "entities")
+
+    def __init__(self, response, expires_at, row, entities):
+        self.response = response
+        self.expires_at = expires_at
+        self.row = row
+        self.entities = entities
+
+
+class ResponseCache:
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, similarity=RESPONSE_CACHE_SIMILARITY, entities=None):
+        """entities(query) -> the crop, season and location the query names; near matches must name the same."""
+        self.max_size = max_size
+        self.similarity = similarity
+        self.entities = entities or (lambda query: None)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (intent, normalized query) -> _Entry
+        self._vectors = np.zeros((max_size, VECTOR_DIM), dtype=np.float32)
+        self._row_keys = [None] * max_size
+        self._free_rows = list(range(max_size - 1, -1, -1))
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._vectors[entry.row] = 0.0
+        self._row_keys[entry.row] = None
+        self._free_rows.append(entry.row)
+
+    def _near_duplicate(self, intent, vec, entities, now):
+        sims = self._vectors @ vec
+        top = np.argpartition(sims, -5)[-5:] if len(sims) > 5 else np.arange(len(sims))
+        for row in top[np.argsort(sims[top])[::-1]]:
+            if sims[row] < self.similarity:
+                break
+            key = self._row_keys[row]
+            # Only answer from rows belonging to the same intent
+            if key is None or key[0] != intent:
+                continue
+            entry = self._entries[key]
+            # A close wording about another crop, season or place is a different question
+            if entry.entities == entities and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                return entry.response
+        return None
+
+    def get(self, query: str, intent: str = "general"):
+        key = (intent, normalize_query(query))
+        now = time.time()
+        near = self.similarity > 0 and intent in RESPONSE_CACHE_NEAR_DUP_INTENTS
+        entities = self.entities(query) if near else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.response
+                self._remove(key)
+
+            if near and self._entries:
+                response = self._near_duplicate(intent, _vectorize(key[1]), entities, now)
+                if response is not None:
+                    self.near_hits += 1
+                    return response
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, intent: str, response: str, created_at: float = None):
+        normalized = normalize_query(query)
+        if not normalized or not response:
+            return
+        ttl = INTENT_TTLS.get(intent, DEFAULT_TTL)
+        expires_at = (created_at or time.time()) + ttl
+        if expires_at <= time.time():
+            return
+
+        key = (intent, normalized)
+        vec = _vectorize(normalized)
+        entities = self.entities(query)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while not self._free_rows:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            row = self._free_rows.pop()
+            self._vectors[row] = vec
+            self._row_keys[row] = key
+            self._entries[key] = _Entry(response, expires_at, row, entities)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def warm_from_db(self, conn, classify, is_cacheable=lambda response, query: True, limit=None):
+        """Preload recent answers from the chat_queries and queries history tables.
+
+        classify(query) -> intent is used for chat rows, which don't record one.
+        Rows without a parseable timestamp are skipped since their age is unknown.
+        """
+        limit = limit or self.max_size
+        sources = [
+            ("SELECT query, response, timestamp FROM chat_queries ORDER BY id DESC LIMIT ?", classify),
+            ("SELECT question, response, timestamp FROM queries ORDER BY id DESC LIMIT ?", lambda q: "general"),
+        ]
+        loaded = 0
+        for sql, intent_of in sources:
+            try:
+                rows = conn.execute(sql, (limit,)).fetchall()
+            except sqlite3.OperationalError:
+                continue  # table or column missing in this database
+            # Oldest first so the newest answers end up most recently used
+            for query, response, timestamp in reversed(rows):
+                if not query or not response or not is_cacheable(response, query):
+                    continue
+                try:
+                    created_at = datetime.strptime(str(timestamp)[:19], "%Y-%m-%d %H:%M:%S").timestamp()
+                except ValueError:
+                    continue
+                self.put(query, intent_of(query), response, created_at=created_at)
+                loaded += 1
+        return loaded
@@ -0,0 +1,225 @@
+# filepath: seasonal.py
+"""Precomputed seasonal crop advice per (region, season).
+
+The advice only depends on the region and the season, so it is generated
+once per key and served from memory. Stored answers live in the
+seasonal_crops table with the SEASONAL_ADVICE_VERSION they were generated
+for (history rows logged by the web form have no version); bumping the
+version, e.g. after changing the prompt, makes every key regenerate.
+
+At startup each worker loads the current version's answers. One worker (the
+one holding the precompute file lock) then generates the missing or
+outdated answers for SEASONAL_REGIONS x summer/monsoon/winter in the
+background, pacing the LLM calls. A key nobody precomputed is generated on
+its first request (concurrent requests for it wait for that one call) and
+shared with the other workers through the table.
+"""
+import os
+import time
+import threading
+from datetime import datetime
+
+import logs
+import storage
+import intents
+import geocoding
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: the Flask dev server runs a single process
+
+SEASONAL_ADVICE_VERSION = int(os.getenv("SEASONAL_ADVICE_VERSION", "1"))  # bump to regenerate all stored advice
+SEASONAL_REGIONS = [r.strip() for r in os.getenv("SEASONAL_REGIONS", "").split(",") if r.strip()]  # default: all states
+SEASONAL_PRECOMPUTE = os.getenv("SEASONAL_PRECOMPUTE", "1") == "1"
+SEASONAL_REFRESH_DAYS = float(os.getenv("SEASONAL_REFRESH_DAYS", "30"))  # age at which stored advice is regenerated
+SEASONAL_PRECOMPUTE_DELAY = float(os.getenv("SEASONAL_PRECOMPUTE_DELAY", "2"))  # seconds between LLM calls in bulk runs
+SEASONAL_RELOAD_INTERVAL = int(os.getenv("SEASONAL_RELOAD_INTERVAL", "3600"))  # seconds between reloads from the table
+
+KEY_LOCK_STRIPES = 64  # locks shared by hash of (region, season): one generation per key at a time
+
+SEASONS = ("summer", "monsoon", "winter")
+_SEASON_NAMES = dict(intents.SEASONS, rainy="monsoon")  # kharif -> monsoon, rabi -> winter, zaid -> summer
+
+
+def current_season(month: int = None) -> str:
+    month = month or datetime.now().month
+    if 3 <= month <= 6:
+        return "summer"
+    if 7 <= month <= 10:
+        return "monsoon"
+    return "winter"
+
+
+def normalize_season(season: str = None) -> str:
+    key = (season or "").strip().lower()
+    return _SEASON_NAMES.get(key, key) if key else current_season()
+
+
+def canonical_region(region: str) -> str:
+    """Gazetteer name of a region ("trivandrum" -> "Thiruvananthapuram"), else the name title-cased."""
+    point = geocoding.geocoder.gazetteer.lookup(geocoding.normalize_location(region))
+    return point.name if point else " ".join((region or "").split()).title()
+
+
+def default_regions() -> list:
+    return [row["name"] for row in geocoding.geocoder.gazetteer.rows if row.get("type") == "state"]
+
+
+class SeasonalAdvisory:
+    """generate(region, season) -> advice text, or None when no LLM is available (nothing is stored)."""
+
+    def __init__(self, generate, version=SEASONAL_ADVICE_VERSION, regions=None, refresh_days=SEASONAL_REFRESH_DAYS):
+        self.generate = generate
+        self.version = version
+        self.regions = regions
+        self.max_age = refresh_days * 86400
+        self._advice = {}  # (region key, season) -> (region, advice, generated_at)
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+        self._thread = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+
+    @staticmethod
+    def _key(region, season):
+        return region.lower(), season
+
+    def _remember(self, region, season, advice, generated_at):
+        key = self._key(region, season)
+        with self._lock:
+            current = self._advice.get(key)
+            if current is None or current[2] <= generated_at:
+                self._advice[key] = (region, advice, generated_at)
+
+    def warm(self) -> int:
+        """Load this version's stored advice (the newest row per key wins)."""
+        rows = storage.query(
+            "SELECT region, season, advice, CAST(strftime('%s', timestamp) AS INTEGER) FROM seasonal_crops "
+            "WHERE version = ? ORDER BY id",
+            (self.version,),
+        )
+        for region, season, advice, generated_at in rows:
+            self._remember(region, season, advice, generated_at or 0)
+        return len(rows)
+
+    def _from_db(self, region, season):
+        rows = storage.query(
+            "SELECT advice, CAST(strftime('%s', timestamp) AS INTEGER) FROM seasonal_crops "
+            "WHERE region = ? COLLATE NOCASE AND season = ? AND version = ? ORDER BY id DESC LIMIT 1",
+            (region, season, self.version),
+        )
+        if not rows:
+            return None
+        self._remember(region, season, rows[0][0], rows[0][1] or 0)
+        return rows[0][0]
+
+    def _generate(self, region, season):
+        try:
+            advice = self.generate(region, season)
+        except Exception as e:
+            self.failures += 1
+            logs.error("Seasonal advice generation failed", region=region, season=season, error=str(e))
+            return None
+        if not advice:
+            return None
+        self.generated += 1
+        self._remember(region, season, advice, time.time())
+        storage.write(
+            "INSERT INTO seasonal_crops (region, season, advice, version) VALUES (?, ?, ?, ?)",
+            (region, season, advice, self.version),
+        )
+        return advice
+
+    def _key_lock(self, key):
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def get(self, region: str, season: str = None):
+        """Return the advice for (region, season), generating it if no worker has yet; None if unavailable."""
+        region, season = canonical_region(region), normalize_season(season)
+        key = self._key(region, season)
+        entry = self._advice.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+        with self._key_lock(key):
+            entry = self._advice.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            advice = self._from_db(region, season)
+            if advice is not None:
+                self.hits += 1
+                return advice
+            self.misses += 1
+            return self._generate(region, season)
+
+    def precompute(self) -> int:
+        """Generate missing and outdated advice for the configured regions and every key seen so far."""
+        self.warm()
+        now = time.time()
+        with self._lock:
+            seen = [(key, region, generated_at) for key, (region, _, generated_at) in self._advice.items()]
+        # Only refresh places the geocoder knows: older routing stored advice for words like "Winter"
+        keys = {key: (region, generated_at) for key, region, generated_at in seen if geocoding.known_place(region)}
+        for region in self.regions or default_regions():
+            for season in SEASONS:
+                keys.setdefault(self._key(region, season), (region, 0))
+
+        count = 0
+        for (_, season), (region, generated_at) in sorted(keys.items()):
+            if now - generated_at < self.max_age:
+                continue
+            if self._generate(region, season) is None:
+                # No LLM configured, or it is failing: try again on the next run
+                break
+            count += 1
+            time.sleep(SEASONAL_PRECOMPUTE_DELAY)
+        return count
+
+    def _precompute_exclusively(self):
+        """Run precompute() in the one worker that holds the lock file; the others reload what it stored."""
+        lock_path = os.path.join(os.path.dirname(os.path.abspath(storage.DB_PATH)), ".seasonal_precompute.lock")
+        with open(lock_path, "a") as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    self.warm()
+                    return
+            count = self.precompute()
+            if count:
+                logs.info("Precomputed seasonal advisories", count=count)
+
+    def _run(self):
+        while True:
+            try:
+                if SEASONAL_PRECOMPUTE:
+                    self._precompute_exclusively()
+                else:
+                    self.warm()
+            except Exception as e:
+                logs.error("Seasonal advice precompute failed", error=str(e))
+            time.sleep(SEASONAL_RELOAD_INTERVAL)
+
+    def start(self):
+        """Warm from the table now, then precompute/reload in a background thread of this process."""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        try:
+            self.warm()
+        except Exception as e:
+            logs.error("Seasonal advice warm-up failed", error=str(e))
+        self._thread = threading.Thread(target=self._run, name="seasonal-advice", daemon=True)
+        self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._advice)
+        return {"size": size, "hits": self.hits, "misses": self.misses,
+                "generated": self.generated, "failures": self.failures, "version": self.version}
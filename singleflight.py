@@ -0,0 +1,211 @@
+# filepath: singleflight.py
+"""Single-flight coalescing of identical upstream calls.
+
+A double-tapped send button, or many farmers asking the same thing at once,
+used to start one LLM (or weather/price) call per request. SingleFlight.do
+runs the call once per key and hands its result to every concurrent caller
+with the same key; the app keys calls on (intent, normalized query).
+
+Within a worker, callers of a key that is already in flight wait on the
+first caller's call. Across gunicorn workers, the first caller takes a lease
+on the key in the inflight_requests table (a BEGIN IMMEDIATE claim, so only
+one worker wins); callers in other workers poll the row every
+COALESCE_POLL_INTERVAL seconds and read the result once the leader stores
+it. The result stays readable for COALESCE_RESULT_TTL seconds for requests
+that arrive just after it finished. A leader that dies leaves a lease that
+expires after COALESCE_LEASE seconds, after which the next caller takes over;
+a leader whose call raises gives up its lease, and the waiting callers then
+make their own calls. Results must be JSON-serializable: callers in other
+workers get them back through json (tuples become lists).
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import logs
+import storage
+import providers
+import concurrency
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"
+COALESCE_CROSS_WORKER = os.getenv("COALESCE_CROSS_WORKER", "1") == "1"  # 0 = coalesce within each worker only
+COALESCE_LEASE = float(os.getenv("COALESCE_LEASE", str(providers.LLM_TOTAL_TIMEOUT + 5)))  # seconds
+COALESCE_RESULT_TTL = float(os.getenv("COALESCE_RESULT_TTL", "10"))  # seconds a finished result is shared
+COALESCE_POLL_INTERVAL = float(os.getenv("COALESCE_POLL_INTERVAL", "0.1"))  # seconds
+
+CLEANUP_INTERVAL = 60  # seconds between deletions of expired leases
+
+_FAILED = object()  # the leader's call raised (or never finished)
+_LEAD = object()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = _FAILED
+        self.leased = False
+
+
+class SingleFlight:
+    def __init__(self, enabled=COALESCE_ENABLED, cross_worker=COALESCE_CROSS_WORKER, lease=COALESCE_LEASE,
+                 result_ttl=COALESCE_RESULT_TTL, poll_interval=COALESCE_POLL_INTERVAL):
+        self.enabled = enabled
+        self.cross_worker = cross_worker
+        self.lease = lease
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._next_cleanup = 0.0
+        self.leaders = 0
+        self.local_followers = 0
+        self.remote_followers = 0
+        self.takeovers = 0
+        self.errors = 0
+
+    @staticmethod
+    def _db_key(key) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    @staticmethod
+    def _owner(flight) -> str:
+        return f"{os.getpid()}:{id(flight)}"
+
+    def _claim(self, db_key, flight):
+        """Take the lease on db_key; return _LEAD, a finished result, or None if another worker holds it."""
+        now = time.time()
+        row = storage.query("SELECT state, result, expires_at FROM inflight_requests WHERE key = ?", (db_key,))
+        if row and row[0][2] > now:
+            return json.loads(row[0][1]) if row[0][0] == "done" else None
+        # BEGIN IMMEDIATE can wait on the write lock: off the gevent hub
+        return concurrency.offload(self._take_lease, db_key, flight, now)
+
+    def _take_lease(self, db_key, flight, now):
+        conn = storage.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the write lock: another worker may have claimed it meanwhile
+            row = conn.execute("SELECT state, result, expires_at FROM inflight_requests WHERE key = ?", (db_key,)).fetchone()
+            if row and row[2] > now:
+                conn.commit()
+                return json.loads(row[1]) if row[0] == "done" else None
+            if row and row[0] == "running":
+                self.takeovers += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO inflight_requests (key, owner, state, result, expires_at) "
+                "VALUES (?, ?, 'running', NULL, ?)",
+                (db_key, self._owner(flight), now + self.lease),
+            )
+            if now >= self._next_cleanup:
+                self._next_cleanup = now + CLEANUP_INTERVAL
+                conn.execute("DELETE FROM inflight_requests WHERE expires_at < ?", (now,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        flight.leased = True
+        return _LEAD
+
+    def _wait_for_lease(self, db_key, flight):
+        deadline = time.monotonic() + self.lease
+        while True:
+            claimed = self._claim(db_key, flight)
+            if claimed is not None:
+                return claimed
+            if time.monotonic() >= deadline:
+                return _LEAD  # the lease should have expired by now; don't wait any longer
+            time.sleep(self.poll_interval)
+
+    def _acquire(self, key):
+        """Return (flight, None) if the caller must make the call, else (None, shared result or _FAILED)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self.local_followers += 1
+            flight.done.wait(self.lease)
+            return None, flight.result
+
+        if self.cross_worker:
+            try:
+                shared = self._wait_for_lease(self._db_key(key), flight)
+            except sqlite3.Error as e:
+                self.errors += 1
+                logs.error("Request coalescing lease failed", error=str(e))
+                shared = _LEAD
+            if shared is not _LEAD:
+                self.remote_followers += 1
+                self._release(key, flight, shared)
+                return None, shared
+        self.leaders += 1
+        return flight, None
+
+    def _release(self, key, flight, result):
+        if flight.leased:
+            db_key, owner = self._db_key(key), self._owner(flight)
+            try:
+                if result is _FAILED:
+                    storage.execute("DELETE FROM inflight_requests WHERE key = ? AND owner = ?", (db_key, owner))
+                else:
+                    storage.execute(
+                        "UPDATE inflight_requests SET state = 'done', result = ?, expires_at = ? "
+                        "WHERE key = ? AND owner = ?",
+                        (json.dumps(result, ensure_ascii=False), time.time() + self.result_ttl, db_key, owner),
+                    )
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                self.errors += 1
+                logs.error("Request coalescing release failed", error=str(e))
+        flight.result = result
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.done.set()
+
+    def do(self, key, fn):
+        """Return fn(), sharing one call among concurrent callers with the same key."""
+        if not self.enabled:
+            return fn()
+        flight, shared = self._acquire(key)
+        if flight is None:
+            return fn() if shared is _FAILED else shared
+        result = _FAILED
+        try:
+            result = fn()
+            return result
+        finally:
+            self._release(key, flight, result)
+
+    def stream(self, key, fn):
+        """do() for a generator of (chunk, source) pairs.
+
+        The caller that makes the call streams it; the others get the whole
+        text as one chunk once it is complete (nothing if it was empty).
+        """
+        if not self.enabled:
+            yield from fn()
+            return
+        flight, shared = self._acquire(key)
+        if flight is None:
+            if shared is _FAILED:
+                yield from fn()
+            elif shared[0]:
+                yield shared[0], shared[1]
+            return
+        chunks, source, result = [], None, _FAILED
+        try:
+            for chunk, source in fn():
+                chunks.append(chunk)
+                yield chunk, source
+            result = ("".join(chunks), source)
+        finally:
+            # Also reached when the client disconnects mid-stream (GeneratorExit)
+            self._release(key, flight, result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._flights)
+        return {"in_flight": in_flight, "leaders": self.leaders, "local_followers": self.local_followers,
+                "remote_followers": self.remote_followers, "takeovers": self.takeovers, "errors": self.errors}
@@ -0,0 +1,182 @@
+# filepath: storage.py
+"""SQLite storage layer.
+
+Every thread gets one long-lived connection (WAL mode, so readers never block
+the writer), and INSERTs from the request path go through a background
+write-behind queue that commits them in batches. Request latency therefore no
+longer includes an fsync, and the gunicorn workers hold the database write
+lock for one short transaction per batch instead of one per request.
+
+Under gevent the connections still belong to native threads, not greenlets:
+the request greenlets of a worker share its main thread's connection for
+reads (SQLite calls never yield, so they cannot interleave), and every write
+that can wait on the write lock (batch commits, execute(), migrations,
+leases, rollups) runs through concurrency.offload on the hub's thread pool,
+whose threads have their own connections.
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+
+import logs
+import metrics
+import concurrency
+
+DB_PATH = os.getenv("DATABASE_PATH", "queries.db")
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "100"))
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "0.5"))  # seconds
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "10"))  # seconds
+
+
+def _thread_local():
+    # gevent patches threading.local to be greenlet-local: one connection per request
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey and monkey.is_module_patched("threading"):
+        return monkey.get_original("threading", "local")()
+    return threading.local()
+
+
+_local = _thread_local()
+
+
+def _connect(path=DB_PATH):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL is durable against application crashes; only an OS crash
+    # can lose the last committed batch.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def get_connection():
+    """Return this (native) thread's pooled connection, opening it on first use.
+
+    Connections are re-opened after a fork so gunicorn workers never share one.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def query(sql, params=()):
+    """Run a read query on the pooled connection and return all rows."""
+    return get_connection().execute(sql, params).fetchall()
+
+
+def execute(sql, params=()):
+    """Run one INSERT/UPDATE in its own short transaction, bypassing the write-behind queue.
+
+    For the rare write that other workers must see as soon as the call returns.
+    """
+    concurrency.offload(_execute, sql, params)
+
+
+def _execute(sql, params):
+    conn = get_connection()
+    with conn:
+        conn.execute(sql, params)
+
+
+class BatchWriter:
+    """Background thread that groups queued INSERTs into batched transactions.
+
+    A batch is committed when DB_BATCH_SIZE statements are queued or
+    DB_FLUSH_INTERVAL seconds after the first statement of the batch arrived.
+    """
+
+    def __init__(self, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None and self._pid != os.getpid():
+                    # Forked: statements queued by the parent belong to the parent
+                    self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, sql, params=()):
+        self._ensure_started()
+        self._queue.put((sql, params))
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been committed."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        statements = [item for item in batch if not isinstance(item, threading.Event)]
+        if statements:
+            with metrics.timer("db_write"):
+                concurrency.offload(self._commit, statements)
+        # Set here, not in the offloaded call: gevent events belong to the hub's thread
+        for item in batch:
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _commit(self, statements):
+        conn = get_connection()
+        try:
+            with conn:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+            self.written += len(statements)
+        except sqlite3.Error as e:
+            logs.error("Batched database write failed, retrying statements individually", error=str(e))
+            self._write_individually(conn, statements)
+
+    def _write_individually(self, conn, statements):
+        for sql, params in statements:
+            try:
+                with conn:
+                    conn.execute(sql, params)
+                self.written += 1
+            except sqlite3.Error as e:
+                self.failed += 1
+                logs.error("Database write dropped", error=str(e))
+
+
+writer = BatchWriter()
+
+
+def write(sql, params=()):
+    """Queue an INSERT/UPDATE for the background writer (does not block on disk)."""
+    writer.submit(sql, params)
+
+
+atexit.register(writer.flush, 5)
@@ -0,0 +1,40 @@
+# filepath: tests/conftest.py
+"""Test setup: the app modules on sys.path and a throwaway database.
+
+storage reads DATABASE_PATH at import time, so it is pointed at a temporary
+file before any test imports it, and the migrations are applied once.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="farmer-tests-")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp, "queries.db")
+os.environ.setdefault("METRICS_ENABLED", "0")
+
+import pytest  # noqa: E402
+
+import storage  # noqa: E402
+import migrations  # noqa: E402
+
+migrations.migrate(storage.get_connection())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.time() for the module under test: clock(module) patches it, .now moves it."""
+    class Clock:
+        now = 1_000_000.0
+
+        def __call__(self, module):
+            monkeypatch.setattr(module, "time", type("FakeTime", (), {
+                "time": staticmethod(lambda: self.now),
+                "monotonic": staticmethod(lambda: self.now),
+                "sleep": staticmethod(lambda seconds: None),
+            }))
+            return self
+
+    return Clock()
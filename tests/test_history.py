@@ -0,0 +1,57 @@
+# filepath: tests/test_history.py
+import pytest
+
+import history
+import storage
+
+CROP = "keyset-test-crop"
+
+
+@pytest.fixture(scope="module")
+def rows():
+    ids = []
+    for day in range(1, 11):
+        storage.execute(
+            "INSERT INTO queries (question, response, query_type, crop, location, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            (f"q{day}", f"a{day}", "market" if day % 2 else "general", CROP, "Pune", f"2024-01-{day:02d} 12:00:00"),
+        )
+        ids.append(storage.query("SELECT MAX(id) FROM queries")[0][0])
+    return ids
+
+
+def _all_pages(params):
+    seen, before = [], None
+    while True:
+        result = history.page("queries", dict(params, before=before) if before else params)
+        seen += [item["id"] for item in result["items"]]
+        before = result["next_before"]
+        if before is None:
+            return seen
+
+
+def test_pages_walk_every_row_newest_first(rows):
+    assert _all_pages({"crop": CROP, "limit": "3"}) == rows[::-1]
+
+
+def test_last_page_has_no_cursor(rows):
+    result = history.page("queries", {"crop": CROP, "limit": "10"})
+    assert len(result["items"]) == 10
+    assert result["next_before"] is None
+
+
+def test_filters_are_combined_with_the_cursor(rows):
+    assert _all_pages({"crop": CROP.upper(), "type": "market", "limit": "2"}) == rows[::2][::-1]
+
+
+def test_date_range_is_inclusive_of_whole_days(rows):
+    assert _all_pages({"crop": CROP, "since": "2024-01-03", "until": "2024-01-05", "limit": "2"}) == rows[2:5][::-1]
+    assert history.page("queries", {"crop": CROP, "since": "2030-01-01"})["items"] == []
+
+
+def test_bad_parameters():
+    with pytest.raises(ValueError):
+        history.page("queries", {"limit": "many"})
+    with pytest.raises(ValueError):
+        history.page("queries", {"since": "yesterday"})
+    with pytest.raises(KeyError):
+        history.page("nope")
@@ -0,0 +1,66 @@
+# filepath: tests/test_images.py
+import numpy as np
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import images
+import storage
+
+
+def _save(tmp_path, name, pixels):
+    path = tmp_path / name
+    Image.fromarray(np.asarray(pixels, dtype=np.uint8)).save(path)
+    return str(path)
+
+
+def _photo(seed):
+    rng = np.random.default_rng(seed)
+    return np.kron(rng.integers(0, 256, (8, 9)), np.ones((32, 32)))
+
+
+def test_hash_survives_resizing(tmp_path):
+    original = _save(tmp_path, "a.png", _photo(1))
+    with Image.open(original) as img:
+        img.resize((144, 128)).save(tmp_path / "small.jpg", quality=70)
+    distance = bin(images.perceptual_hash(original) ^ images.perceptual_hash(str(tmp_path / "small.jpg"))).count("1")
+    assert distance <= images.IMAGE_PHASH_DISTANCE
+    assert not images.is_degenerate(images.perceptual_hash(original))
+
+
+def test_different_photos_differ(tmp_path):
+    a = images.perceptual_hash(_save(tmp_path, "a.png", _photo(1)))
+    b = images.perceptual_hash(_save(tmp_path, "b.png", _photo(2)))
+    assert bin(a ^ b).count("1") > images.IMAGE_PHASH_DISTANCE
+
+
+@pytest.mark.parametrize("pixels", [
+    np.full((64, 64), 128),  # flat
+    np.full((64, 64), 128) + np.arange(64) % 2,  # low-contrast noise
+    np.tile(np.arange(64, 0, -1) * 3, (64, 1)),  # plain gradient
+])
+def test_flat_and_low_contrast_images_are_degenerate(tmp_path, pixels):
+    assert images.is_degenerate(images.perceptual_hash(_save(tmp_path, "flat.png", pixels)))
+
+
+def test_degenerate_images_only_reuse_identical_copies(tmp_path):
+    cache = images.ImageAnalysisCache(max_distance=6)
+    grey = _save(tmp_path, "grey.png", np.full((64, 64), 120))
+    cache.record(grey, "Looks like fog", "digest-grey", images.perceptual_hash(grey))
+    storage.writer.flush()
+
+    other_grey = _save(tmp_path, "other.png", np.full((64, 64), 40))
+    assert cache.lookup(other_grey, "digest-other") == (None, None)
+    assert cache.lookup(grey, "digest-grey") == ("Looks like fog", None)
+
+
+def test_near_duplicate_reuses_diagnosis(tmp_path):
+    cache = images.ImageAnalysisCache(max_distance=6)
+    leaf = _save(tmp_path, "leaf.png", _photo(3))
+    phash = images.perceptual_hash(leaf)
+    cache.record(leaf, "Leaf blight", "digest-leaf", phash)
+    storage.writer.flush()
+
+    copy = _save(tmp_path, "copy.png", np.clip(_photo(3) + 3, 0, 255))
+    assert cache.lookup(copy, "digest-copy")[0] == "Leaf blight"
+    assert cache.stats()["near_hits"] == 1
@@ -0,0 +1,80 @@
+# filepath: tests/test_intents.py
+import pytest
+
+import geocoding
+import intents
+from intents import IntentRouter
+
+PLACES = {"kerala": "Kerala", "pune": "Pune", "thrissur": "Thrissur"}
+
+
+@pytest.fixture
+def router():
+    known = {"nashik": "Nashik"}
+    return IntentRouter(PLACES, resolve=known.get)
+
+
+@pytest.mark.parametrize("query, intent", [
+    ("What is the weather forecast for Pune?", "weather"),
+    ("current market price of onion", "market"),
+    ("which crops to grow in kharif season", "seasonal"),
+    ("best fertilizer for rice", "general"),
+])
+def test_intent(router, query, intent):
+    assert router.route(query).intent == intent
+
+
+def test_crop_season_and_dictionary_location(router):
+    route = router.route("Rice prices in Thrissur this rabi")
+    assert (route.intent, route.crop, route.season, route.location) == ("market", "rice", "winter", "Thrissur")
+
+
+@pytest.mark.parametrize("query", [
+    "Is it good to plant wheat in winter?",
+    "rain forecast for paddy",
+    "best fertilizer for rice",
+    "latest innovations in agricultural technology",
+    "What crops are best for monsoons?",
+])
+def test_keywords_crops_and_seasons_are_not_places(router, query):
+    route = router.route(query)
+    assert route.location is None
+    assert route.place is None or route.place.lower() not in router._not_places
+
+
+def test_fallback_word_resolved_by_the_geocoder(router):
+    route = router.route("onion price in nashik")
+    assert (route.intent, route.location, route.place) == ("market", "Nashik", None)
+
+
+def test_unresolved_fallback_word_is_never_a_location(router):
+    route = router.route("seasonal crops to sow in technology")
+    assert route.location is None
+    assert route.place == "Technology"
+    assert IntentRouter(PLACES).route("weather in nashik").location is None
+
+
+def test_known_place_matches_exact_names_only(monkeypatch):
+    monkeypatch.setattr(geocoding.geocoder, "_from_nominatim", lambda location: pytest.fail("network lookup"))
+    assert geocoding.known_place("thrissur") == "Thrissur"
+    assert geocoding.known_place("Trivandrum") == "Thiruvananthapuram"  # alias
+    assert geocoding.known_place("winter") is None
+    # Prefix and fuzzy matches are for explicit geocoding only
+    assert geocoding.geocoder.gazetteer.lookup("sale").name == "Salem"
+    assert geocoding.known_place("sale") is None
+    assert geocoding.known_place("thrisur") is None
+
+
+@pytest.mark.parametrize("query", ["rice for sale", "onion price for sale near me", "tips for goats"])
+def test_common_words_are_not_locations(query):
+    names = {name: point.name for name, point in geocoding.geocoder.gazetteer.places.items()}
+    route = IntentRouter(names, resolve=geocoding.known_place).route(query)
+    assert route.location is None
+
+
+def test_router_with_gazetteer_resolver():
+    names = {name: point.name for name, point in geocoding.geocoder.gazetteer.places.items()}
+    router = IntentRouter(names, resolve=geocoding.known_place)
+    assert router.route("Is it good to plant wheat in winter?").location is None
+    assert router.route("latest innovations in agricultural technology").location is None
+    assert intents.Route("general", {}, None, None, None).place is None
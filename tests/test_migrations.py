@@ -0,0 +1,53 @@
+# filepath: tests/test_migrations.py
+import os
+import shutil
+
+import migrations
+import storage
+
+SHIPPED_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "queries.db")
+
+
+def _schema(conn):
+    return conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def test_shipped_database_migrates_and_keeps_its_rows(tmp_path):
+    path = str(tmp_path / "queries.db")
+    shutil.copy(SHIPPED_DB, path)
+    conn = storage._connect(path)
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("queries", "chat_queries", "image_analysis", "market_prices")}
+
+    assert migrations.migrate(conn) == migrations.MIGRATIONS[-1][0]
+    for table, count in counts.items():
+        assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == count
+    assert {"query_type", "crop", "location", "source", "timestamp"} <= _columns(conn, "queries")
+    assert {"intent", "crop", "location", "source"} <= _columns(conn, "chat_queries")
+    assert "version" in _columns(conn, "seasonal_crops")
+    assert conn.execute("SELECT COUNT(*) FROM queries WHERE query_type IS NULL").fetchone()[0] == 0
+
+
+def test_migrate_is_idempotent(tmp_path):
+    path = str(tmp_path / "queries.db")
+    shutil.copy(SHIPPED_DB, path)
+    conn = storage._connect(path)
+    version = migrations.migrate(conn)
+    schema = _schema(conn)
+
+    assert migrations.migrate(conn) == version
+    assert migrations.migrate(storage._connect(path)) == version
+    assert _schema(conn) == schema
+
+
+def test_fresh_database_gets_every_migration(tmp_path):
+    conn = storage._connect(str(tmp_path / "new.db"))
+    assert migrations.schema_version(conn) == 0
+    assert migrations.migrate(conn) == migrations.MIGRATIONS[-1][0]
+    assert {"queries", "chat_queries", "image_analysis", "seasonal_crops"} <= {
+        name for _, name, _ in _schema(conn)
+    }
@@ -0,0 +1,133 @@
+# filepath: tests/test_providers.py
+import time
+import threading
+
+import pytest
+
+from providers import CircuitBreaker, Provider, ProviderChain
+
+
+def answer(text, delay=0.0):
+    def call(prompt):
+        time.sleep(delay)
+        return text
+    return call
+
+
+def fail(prompt):
+    raise RuntimeError("down")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=2, reset=60)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_allows_one_trial_when_half_open():
+    breaker = CircuitBreaker(failures=1, reset=0)
+    breaker.record_failure()
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failures=3, reset=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_first_provider_answers():
+    chain = ProviderChain([Provider("a", answer("A")), Provider("b", answer("B"))], hedge_delay=1)
+    assert chain.ask("q") == ("A", "a")
+
+
+def test_failure_falls_through_without_waiting_for_the_hedge():
+    chain = ProviderChain([Provider("a", fail), Provider("b", answer("B"))], hedge_delay=5)
+    started = time.monotonic()
+    assert chain.ask("q") == ("B", "b")
+    assert time.monotonic() - started < 1
+
+
+def test_slow_provider_is_hedged():
+    slow, fast = Provider("slow", answer("S", delay=0.5)), Provider("fast", answer("F"))
+    chain = ProviderChain([slow, fast], hedge_delay=0.05)
+    started = time.monotonic()
+    assert chain.ask("q") == ("F", "fast")
+    assert time.monotonic() - started < 0.4
+
+
+def test_total_timeout_gives_up():
+    chain = ProviderChain([Provider("a", answer("A", delay=0.5))], hedge_delay=1, total_timeout=0.1)
+    assert chain.ask("q") == ("", None)
+
+
+def test_open_provider_is_skipped():
+    broken = Provider("a", answer("A"), breaker=CircuitBreaker(failures=1, reset=60))
+    broken.breaker.record_failure()
+    chain = ProviderChain([broken, Provider("b", answer("B"))], hedge_delay=1)
+    assert chain.ask("q") == ("B", "b")
+    assert broken.stats()["skipped"] == 1
+
+
+def test_cancelled_trial_is_released():
+    # The executor is saturated, so the half-open provider's trial is still queued when the
+    # chain gives up; it is cancelled before it runs and must not hold the trial slot forever
+    trial = Provider("trial", answer("T"), breaker=CircuitBreaker(failures=1, reset=0))
+    trial.breaker.record_failure()
+    chain = ProviderChain([Provider("a", answer("A")), trial], hedge_delay=0.01, total_timeout=0.1, max_workers=1)
+    busy = threading.Event()
+    chain._executor.submit(busy.wait)
+    try:
+        assert chain.ask("q") == ("", None)
+    finally:
+        busy.set()
+    assert trial.stats()["calls"] == 0
+    assert trial.breaker.allow()
+
+
+def test_stream_falls_through_to_the_next_provider():
+    def broken_stream(prompt):
+        raise RuntimeError("down")
+        yield
+
+    chain = ProviderChain([
+        Provider("a", fail, stream=broken_stream),
+        Provider("b", answer("B"), stream=lambda prompt: iter(["B1", "B2"])),
+    ])
+    assert list(chain.stream("q")) == [("B1", "b"), ("B2", "b")]
+
+
+def test_stream_failing_midway_raises_and_counts_as_failure():
+    def truncated_stream(prompt):
+        yield "Half an"
+        raise RuntimeError("connection reset")
+
+    provider = Provider("a", fail, breaker=CircuitBreaker(failures=1, reset=60), stream=truncated_stream)
+    stream = ProviderChain([provider, Provider("b", answer("B"), stream=lambda prompt: iter(["B"]))]).stream("q")
+    assert next(stream) == ("Half an", "a")
+    with pytest.raises(RuntimeError):
+        next(stream)
+    stats = provider.stats()
+    assert (stats["successes"], stats["failures"], stats["wins"]) == (0, 1, 0)
+    assert provider.breaker.state == "open"
+
+
+def test_abandoned_stream_releases_the_trial():
+    provider = Provider("a", fail, breaker=CircuitBreaker(failures=1, reset=0),
+                        stream=lambda prompt: iter(["x", "y"]))
+    provider.breaker.record_failure()
+    stream = ProviderChain([provider]).stream("q")
+    assert next(stream) == ("x", "a")
+    stream.close()
+    assert provider.breaker.state == "closed"
@@ -0,0 +1,53 @@
+# filepath: tests/test_ratelimit.py
+import pytest
+
+import ratelimit
+from ratelimit import TokenBucket
+
+
+@pytest.fixture
+def bucket(tmp_path, clock):
+    clock(ratelimit)
+    return TokenBucket("test", per_minute=60, burst=3, slots=64, directory=str(tmp_path), enabled=True)
+
+
+def test_burst_then_limited(bucket):
+    assert [bucket.take("1.2.3.4") for _ in range(3)] == [0, 0, 0]
+    assert bucket.take("1.2.3.4") == pytest.approx(1.0)
+    assert bucket.stats()["allowed"] == 3
+    assert bucket.stats()["limited"] == 1
+
+
+def test_tokens_refill_at_the_rate(bucket, clock):
+    for _ in range(3):
+        bucket.take("1.2.3.4")
+    clock.now += 1.5
+    assert bucket.take("1.2.3.4") == 0
+    assert bucket.take("1.2.3.4") == pytest.approx(0.5)
+    clock.now += 3600
+    assert [bucket.take("1.2.3.4") for _ in range(4)][-1] > 0  # refills to the burst, no further
+
+
+def test_clients_have_separate_buckets(bucket):
+    for _ in range(3):
+        bucket.take("1.2.3.4")
+    assert bucket.take("1.2.3.4") > 0
+    assert bucket.take("5.6.7.8") == 0
+
+
+def test_buckets_are_shared_through_the_file(bucket, tmp_path):
+    for _ in range(3):
+        bucket.take("1.2.3.4")
+    other_worker = TokenBucket("test", per_minute=60, burst=3, slots=64, directory=str(tmp_path), enabled=True)
+    assert other_worker.take("1.2.3.4") > 0
+
+
+def test_client_ip_ignores_forwarded_for_by_default(monkeypatch):
+    flask = pytest.importorskip("flask")
+    app = flask.Flask(__name__)
+    headers = {"X-Forwarded-For": "6.6.6.6, 9.9.9.9"}
+    with app.test_request_context(headers=headers, environ_base={"REMOTE_ADDR": "10.0.0.2"}):
+        monkeypatch.setattr(ratelimit, "RATE_LIMIT_PROXIES", 0)
+        assert ratelimit.client_ip() == "10.0.0.2"
+        monkeypatch.setattr(ratelimit, "RATE_LIMIT_PROXIES", 1)
+        assert ratelimit.client_ip() == "9.9.9.9"
@@ -0,0 +1,95 @@
+# filepath: tests/test_response_cache.py
+import pytest
+
+import intents
+import response_cache
+from response_cache import ResponseCache, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  What's the  PRICE of Rice?? ") == "what s the price of rice"
+
+
+def test_exact_hit_ignores_case_and_punctuation():
+    cache = ResponseCache(max_size=10)
+    cache.put("Best fertilizer for rice?", "general", "Use urea.")
+    assert cache.get("best fertilizer for rice", "general") == "Use urea."
+    assert cache.stats()["hits"] == 1
+
+
+def test_intents_are_separate():
+    cache = ResponseCache(max_size=10, similarity=0)
+    cache.put("rice", "market", "Rs 2000")
+    assert cache.get("rice", "general") is None
+
+
+def test_entries_expire_after_their_intent_ttl(clock):
+    clock(response_cache)
+    cache = ResponseCache(max_size=10, similarity=0)
+    cache.put("weather in pune", "weather", "Sunny")
+    clock.now += response_cache.INTENT_TTLS["weather"] - 1
+    assert cache.get("weather in pune", "weather") == "Sunny"
+    clock.now += 2
+    assert cache.get("weather in pune", "weather") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_old_history_rows_are_not_cached(clock):
+    clock(response_cache)
+    cache = ResponseCache(max_size=10)
+    cache.put("q", "weather", "a", created_at=clock.now - response_cache.INTENT_TTLS["weather"] - 1)
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_size=2, similarity=0)
+    cache.put("one", "general", "1")
+    cache.put("two", "general", "2")
+    assert cache.get("one", "general") == "1"  # "two" is now the oldest
+    cache.put("three", "general", "3")
+    assert cache.get("two", "general") is None
+    assert cache.get("one", "general") == "1"
+    assert cache.get("three", "general") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_near_duplicate_is_answered():
+    cache = ResponseCache(max_size=10, similarity=0.9)
+    cache.put("What are the latest innovations in agricultural technology?", "general", "Drones.")
+    assert cache.get("what are latest innovations in agricultural technology", "general") == "Drones."
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_unrelated_query_is_not_a_near_duplicate():
+    cache = ResponseCache(max_size=10, similarity=0.9)
+    cache.put("What are the latest innovations in agricultural technology?", "general", "Drones.")
+    assert cache.get("how do I treat leaf blight on tomato", "general") is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("best time to plant tomato seedlings in kerala", "best time to plant onion seedlings in kerala"),
+    ("how to control stem borer in paddy", "how to control stem borer in maize"),
+    ("when to sow wheat in punjab in rabi", "when to sow wheat in punjab in kharif"),
+])
+def test_near_duplicate_about_another_crop_or_season_misses(cached, asked):
+    router = intents.IntentRouter({"kerala": "Kerala", "punjab": "Punjab"})
+    cache = ResponseCache(max_size=10, similarity=0.5,
+                          entities=lambda query: router.route(query)[2:])
+    cache.put(cached, "general", "Cached answer.")
+    assert cache.get(asked, "general") is None
+    assert cache.get(cached.upper(), "general") == "Cached answer."
+
+
+def test_near_duplicates_only_for_allowed_intents():
+    cache = ResponseCache(max_size=10, similarity=0.5)
+    cache.put("weather in pune today", "weather", "Sunny")
+    # A near match could name a different place, so weather is exact-only by default
+    assert cache.get("weather in pune tomorrow", "weather") is None
+
+
+def test_near_duplicate_respects_expiry(clock):
+    clock(response_cache)
+    cache = ResponseCache(max_size=10, similarity=0.9)
+    cache.put("What are the latest innovations in agricultural technology?", "general", "Drones.")
+    clock.now += response_cache.DEFAULT_TTL + 1
+    assert cache.get("what are latest innovations in agricultural technology", "general") is None
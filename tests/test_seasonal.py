@@ -0,0 +1,43 @@
+# filepath: tests/test_seasonal.py
+import fcntl
+import itertools
+import os
+
+import pytest
+
+import seasonal
+import storage
+
+
+_versions = itertools.count(1000)  # one advice version per test, so rows of other tests are not loaded
+
+
+@pytest.fixture
+def version():
+    return next(_versions)
+
+
+def test_worker_without_the_lock_reloads_refreshed_advice(version, monkeypatch):
+    leader = seasonal.SeasonalAdvisory(lambda region, season: "Sow early", version=version, regions=["Kerala"])
+    follower = seasonal.SeasonalAdvisory(lambda region, season: "follower generated", version=version)
+    leader._generate("Kerala", "winter")
+    storage.writer.flush()
+    assert follower.get("Kerala", "winter") == "Sow early"
+
+    # The lock holder regenerates the advice; the follower loses the lock and must pick it up
+    storage.execute("INSERT INTO seasonal_crops (region, season, advice, version, timestamp) "
+                    "VALUES ('Kerala', 'winter', 'Sow late', ?, datetime('now', '+1 minute'))", (version,))
+    lock_path = os.path.join(os.path.dirname(os.path.abspath(storage.DB_PATH)), ".seasonal_precompute.lock")
+    monkeypatch.setattr(follower, "precompute", lambda: pytest.fail("precompute without the lock"))
+    with open(lock_path, "a") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        follower._precompute_exclusively()
+    assert follower.get("Kerala", "winter") == "Sow late"
+
+
+def test_key_locks_are_bounded(version):
+    advisory = seasonal.SeasonalAdvisory(lambda region, season: f"{region} {season}", version=version)
+    for i in range(500):
+        advisory.get(f"Region {i}", "summer")
+    assert len(advisory._key_locks) == seasonal.KEY_LOCK_STRIPES
+    assert advisory._key_lock(("kerala", "winter")) is advisory._key_lock(("kerala", "winter"))
@@ -0,0 +1,93 @@
+# filepath: tests/test_singleflight.py
+import threading
+import time
+
+import storage
+from singleflight import SingleFlight
+
+
+def _lease(flights, key, owner, state, result, expires_in):
+    storage.execute(
+        "INSERT OR REPLACE INTO inflight_requests (key, owner, state, result, expires_at) VALUES (?, ?, ?, ?, ?)",
+        (flights._db_key(key), owner, state, result, time.time() + expires_in),
+    )
+
+
+def _row(flights, key):
+    return storage.query("SELECT state, result FROM inflight_requests WHERE key = ?", (flights._db_key(key),))
+
+
+def test_expired_lease_of_a_dead_leader_is_taken_over():
+    flights = SingleFlight(enabled=True, cross_worker=True, lease=5, result_ttl=10, poll_interval=0.01)
+    _lease(flights, ("general", "dead leader"), "1:1", "running", None, -1)
+    assert flights.do(("general", "dead leader"), lambda: "fresh") == "fresh"
+    assert flights.stats()["takeovers"] == 1
+    assert _row(flights, ("general", "dead leader")) == [("done", '"fresh"')]
+
+
+def test_live_lease_is_waited_for_until_it_expires():
+    flights = SingleFlight(enabled=True, cross_worker=True, lease=5, result_ttl=10, poll_interval=0.01)
+    _lease(flights, ("general", "slow leader"), "1:2", "running", None, 0.2)
+    started = time.monotonic()
+    assert flights.do(("general", "slow leader"), lambda: "mine") == "mine"
+    assert time.monotonic() - started >= 0.15
+    assert flights.stats()["takeovers"] == 1
+
+
+def test_result_of_another_worker_is_shared():
+    flights = SingleFlight(enabled=True, cross_worker=True, lease=5, result_ttl=10, poll_interval=0.01)
+    _lease(flights, ("market", "rice"), "1:3", "done", '["Rs 2000", "gemini"]', 10)
+    assert flights.do(("market", "rice"), lambda: "not called") == ["Rs 2000", "gemini"]
+    assert flights.stats()["remote_followers"] == 1
+
+
+def test_failed_leader_gives_up_its_lease():
+    flights = SingleFlight(enabled=True, cross_worker=True, lease=5, result_ttl=10, poll_interval=0.01)
+
+    def fail():
+        raise RuntimeError("upstream down")
+
+    try:
+        flights.do(("general", "failing"), fail)
+    except RuntimeError:
+        pass
+    assert _row(flights, ("general", "failing")) == []
+    assert flights.do(("general", "failing"), lambda: "retry") == "retry"
+
+
+def test_stream_failing_midway_is_not_shared():
+    flights = SingleFlight(enabled=True, cross_worker=True, lease=5, result_ttl=10, poll_interval=0.01)
+
+    def truncated():
+        yield "Half an", "gemini"
+        raise RuntimeError("connection reset")
+
+    stream = flights.stream(("general", "truncated"), truncated)
+    assert next(stream) == ("Half an", "gemini")
+    try:
+        next(stream)
+    except RuntimeError:
+        pass
+    assert _row(flights, ("general", "truncated")) == []
+    assert list(flights.stream(("general", "truncated"), lambda: iter([("Whole", "openai")]))) == [("Whole", "openai")]
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight(enabled=True, cross_worker=False)
+    calls, release = [], threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return "answer"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", slow))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["answer"] * 4
+    assert len(calls) == 1
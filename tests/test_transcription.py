@@ -0,0 +1,36 @@
+# filepath: tests/test_transcription.py
+import os
+import stat
+
+import pytest
+
+import transcription
+
+
+def test_socket_directory_is_private(tmp_path):
+    address = str(tmp_path / "whisper" / "whisper.sock")
+    directory = transcription._private_dir(address)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+def test_shared_socket_directory_is_refused(tmp_path):
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    os.chmod(directory, 0o1777)
+    with pytest.raises(PermissionError):
+        transcription._private_dir(str(directory / "whisper.sock"))
+
+
+def test_authkey_is_generated_once_per_deployment(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcription, "WHISPER_AUTHKEY", "")
+    address = str(tmp_path / "whisper" / "whisper.sock")
+    key = transcription._authkey(address)
+    assert len(key) == 64
+    assert transcription._authkey(address) == key
+    assert stat.S_IMODE(os.stat(tmp_path / "whisper" / "authkey").st_mode) == 0o600
+    assert transcription._authkey(str(tmp_path / "other" / "whisper.sock")) != key
+
+
+def test_configured_authkey_wins(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcription, "WHISPER_AUTHKEY", "s3cret")
+    assert transcription._authkey(str(tmp_path / "whisper.sock")) == b"s3cret"
@@ -0,0 +1,329 @@
+# filepath: transcription.py
+"""Shared Whisper transcription service.
+
+Loading Whisper (and torch with it) is slow and takes hundreds of MB of RAM,
+so instead of every gunicorn worker loading the model at import time a single
+local transcription server owns it. Workers talk to the server over a Unix
+socket; the first worker that needs a transcription starts the server if it
+is not running. The server loads the model on its first job and exits after
+WHISPER_IDLE_TIMEOUT seconds without work, freeing the memory again.
+
+Set WHISPER_MODE=inprocess to load the model lazily inside the calling
+process instead (useful on platforms without Unix sockets).
+
+The socket lives in a directory only the app's user can enter (by default
+.whisper/ next to the database), created with mode 0700 and checked before
+every use, and connections are authenticated with a key generated once per
+deployment into that directory (or WHISPER_AUTHKEY). Jobs and replies are
+pickled, so nobody else on the host may be able to bind or reach the socket.
+
+Audio is decoded and trimmed to its speech by audio.py, and the resulting
+30 s chunks are decoded by the model as one batch. A language hint (e.g. "ml"
+or "hi", per request or WHISPER_LANGUAGE) skips Whisper's language detection.
+"""
+import os
+import sys
+import gc
+import time
+import socket
+import threading
+import subprocess
+from multiprocessing.connection import Listener, Client
+
+import logs
+import storage
+
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL", "base")
+WHISPER_IDLE_TIMEOUT = int(os.getenv("WHISPER_IDLE_TIMEOUT", "600"))  # seconds, 0 disables unloading
+WHISPER_TIMEOUT = int(os.getenv("WHISPER_TIMEOUT", "300"))  # max seconds to wait for one transcription
+WHISPER_START_TIMEOUT = int(os.getenv("WHISPER_START_TIMEOUT", "30"))
+WHISPER_SOCKET = os.getenv("WHISPER_SOCKET") or os.path.join(
+    os.path.dirname(os.path.abspath(storage.DB_PATH)), ".whisper", "whisper.sock")  # its directory must be private
+WHISPER_MODE = os.getenv("WHISPER_MODE", "shared" if hasattr(socket, "AF_UNIX") else "inprocess")
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE") or None  # default language hint, empty = detect
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "8"))  # 30 s chunks decoded together
+WHISPER_AUTHKEY = os.getenv("WHISPER_AUTHKEY", "")  # empty = generated into the socket directory
+
+
+def _private_dir(address) -> str:
+    """Create (mode 0700) or check the socket's directory; refuse one other users could write to."""
+    directory = os.path.dirname(os.path.abspath(address))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{directory} must be owned by this user with mode 0700 (it holds the Whisper socket)")
+    return directory
+
+
+def _authkey(address) -> bytes:
+    """WHISPER_AUTHKEY, or the random key stored next to the socket (created by whoever needs it first)."""
+    if WHISPER_AUTHKEY:
+        return WHISPER_AUTHKEY.encode()
+    path = os.path.join(_private_dir(address), "authkey")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w") as f:
+            f.write(os.urandom(32).hex())
+    for _ in range(50):
+        with open(path) as f:
+            key = f.read().strip()
+        if key:
+            return key.encode()
+        time.sleep(0.01)  # another process has created the file but not written the key yet
+    raise RuntimeError(f"Empty Whisper authkey file: {path}")
+
+
+class WhisperModelHolder:
+    """Loads the Whisper model on first use and drops it again when idle."""
+
+    def __init__(self, model_size=WHISPER_MODEL_SIZE, idle_timeout=WHISPER_IDLE_TIMEOUT):
+        self.model_size = model_size
+        self.idle_timeout = idle_timeout
+        self._model = None
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._active = 0
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def _get_model(self):
+        if self._model is None:
+            import whisper
+            logs.info("Loading Whisper model", model=self.model_size)
+            started = time.monotonic()
+            self._model = whisper.load_model(self.model_size)
+            logs.info("Whisper model loaded", model=self.model_size, seconds=round(time.monotonic() - started, 1))
+        return self._model
+
+    def transcribe(self, file_path: str, language: str = None) -> str:
+        self._active += 1
+        try:
+            import audio
+
+            try:
+                chunks, duration = audio.speech_chunks(file_path)
+            except Exception as e:
+                logs.warning("Audio pipeline failed, transcribing the file directly", error=str(e))
+                chunks = None
+            # Whisper inference is not thread-safe and saturates the CPU anyway,
+            # so jobs are run one at a time.
+            with self._lock:
+                if chunks is None:
+                    result = self._get_model().transcribe(file_path, language=language or WHISPER_LANGUAGE)
+                    return result.get("text", "").strip()
+                if not chunks:
+                    return ""
+                speech = sum(len(chunk) for chunk in chunks) / audio.SAMPLE_RATE
+                logs.info("Transcribing speech", speech_seconds=round(speech, 1), clip_seconds=round(duration, 1),
+                          chunks=len(chunks))
+                return self._decode_chunks(chunks, language or WHISPER_LANGUAGE)
+        finally:
+            self._active -= 1
+            self._last_used = time.monotonic()
+
+    def _decode_chunks(self, chunks, language):
+        import torch
+        import whisper
+
+        model = self._get_model()
+        options = whisper.DecodingOptions(language=language, without_timestamps=True,
+                                          fp16=model.device.type == "cuda")
+        texts = []
+        for i in range(0, len(chunks), WHISPER_BATCH_SIZE):
+            mels = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(chunk)), n_mels=model.dims.n_mels)
+                for chunk in chunks[i:i + WHISPER_BATCH_SIZE]
+            ]).to(model.device)
+            with torch.no_grad():
+                texts += [result.text.strip() for result in model.decode(mels, options)]
+        return " ".join(text for text in texts if text)
+
+    def idle_for(self):
+        if self._active:
+            return 0.0
+        return time.monotonic() - self._last_used
+
+    def unload(self):
+        with self._lock:
+            if self._model is not None:
+                self._model = None
+                gc.collect()
+                logs.info("Whisper model unloaded after idle timeout")
+
+    def start_idle_reaper(self, on_idle=None):
+        """Unload the model (or call on_idle) once it has been idle long enough."""
+        if self.idle_timeout <= 0:
+            return
+
+        def reap():
+            while True:
+                time.sleep(min(self.idle_timeout, 30))
+                if self.idle_for() >= self.idle_timeout:
+                    if on_idle:
+                        on_idle()
+                    elif self.loaded:
+                        self.unload()
+
+        threading.Thread(target=reap, name="whisper-idle-reaper", daemon=True).start()
+
+
+# --- Server side ---
+def serve(address=WHISPER_SOCKET):
+    """Run the transcription server until it has been idle for WHISPER_IDLE_TIMEOUT."""
+    authkey = _authkey(address)
+    # Another server may have won the race to start; leave it alone.
+    try:
+        Client(address, family="AF_UNIX", authkey=authkey).close()
+        logs.info("Transcription server already running")
+        return
+    except (OSError, EOFError):
+        pass
+
+    if os.path.exists(address):
+        os.unlink(address)
+
+    holder = WhisperModelHolder()
+    # The socket is created 0600 rather than chmod-ed after bind (no window where others can connect)
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(umask)
+    logs.info("Transcription server listening", address=address, model=holder.model_size)
+
+    def shutdown():
+        logs.info("Transcription server idle, shutting down")
+        try:
+            os.unlink(address)
+        except OSError:
+            pass
+        os._exit(0)
+
+    holder.start_idle_reaper(on_idle=shutdown)
+
+    def handle(conn):
+        with conn:
+            try:
+                job = conn.recv()
+                if job.get("request_id"):
+                    logs.new_request_id(job["request_id"])
+                if job.get("command") == "ping":
+                    conn.send({"ok": True, "loaded": holder.loaded})
+                    return
+                text = holder.transcribe(job["path"], job.get("language"))
+                conn.send({"ok": True, "text": text})
+            except Exception as e:
+                logs.error("Transcription server error", error=str(e))
+                try:
+                    conn.send({"ok": False, "error": str(e)})
+                except OSError:
+                    pass
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            logs.error("Transcription server accept error", error=str(e))
+            continue
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+# --- Client side ---
+class TranscriptionClient:
+    """Sends transcription jobs to the shared server, starting it on demand."""
+
+    def __init__(self, address=WHISPER_SOCKET):
+        self.address = address
+        self._lock_path = address + ".lock"
+        self._authkey = None
+
+    def _connect(self):
+        if self._authkey is None:
+            self._authkey = _authkey(self.address)
+        else:
+            _private_dir(self.address)
+        return Client(self.address, family="AF_UNIX", authkey=self._authkey)
+
+    def _start_server(self):
+        import fcntl
+
+        # Serialize server start-up between gunicorn workers.
+        with open(self._lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return self._connect()
+            except (OSError, EOFError):
+                pass
+
+            logs.info("Starting shared transcription server")
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--serve"],
+                cwd=os.getcwd(),
+                start_new_session=True,
+            )
+            deadline = time.monotonic() + WHISPER_START_TIMEOUT
+            while time.monotonic() < deadline:
+                try:
+                    return self._connect()
+                except (OSError, EOFError):
+                    time.sleep(0.1)
+            raise RuntimeError("Transcription server did not start in time")
+
+    def _request(self, job):
+        try:
+            conn = self._connect()
+        except (OSError, EOFError):
+            conn = self._start_server()
+
+        with conn:
+            conn.send(job)
+            if not conn.poll(WHISPER_TIMEOUT):
+                raise TimeoutError("Transcription timed out")
+            reply = conn.recv()
+
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "Transcription failed"))
+        return reply
+
+    def transcribe(self, file_path: str, language: str = None) -> str:
+        job = {"path": os.path.abspath(file_path), "language": language, "request_id": logs.request_id()}
+        try:
+            return self._request(job)["text"]
+        except EOFError:
+            # The server shut down for idleness between connect and send; retry once.
+            return self._request(job)["text"]
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Return the transcription backend for this process, created on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                if WHISPER_MODE == "inprocess":
+                    _service = WhisperModelHolder()
+                    _service.start_idle_reaper()
+                else:
+                    _service = TranscriptionClient()
+    return _service
+
+
+def transcribe(file_path: str, language: str = None) -> str:
+    """Transcribe an audio file; language is an optional Whisper language code hint."""
+    return get_service().transcribe(file_path, language)
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        serve()
+    else:
+        print("Usage: python transcription.py --serve")
@@ -0,0 +1,130 @@
+# filepath: translation.py
+"""Translation memory for translate_text.
+
+Responses are split into sentences, and every sentence is looked up by
+(hash of the source text, target language), first in an in-memory LRU and then
+in the translation_memory table shared by all workers. Only the sentences not
+seen before go to the model, all of them in one batched request, so the canned
+answers (rule-based advice, price summaries, seasonal crop lists) are
+translated once per language and then served without an API call.
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import storage
+
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "5000"))  # in-memory segments per worker
+
+# Sentence ends (including the Devanagari danda) and line breaks; the separators are kept
+_SEGMENT_BREAK = re.compile(r"((?<=[.!?।])[ \t]+|\s*\n\s*)")
+_HAS_LETTERS = re.compile(r"[^\W\d_]")
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def split_segments(text):
+    """Split text into alternating [segment, separator, segment, ...] pieces."""
+    return _SEGMENT_BREAK.split(text)
+
+
+def segment_key(segment):
+    return hashlib.sha256(segment.encode("utf-8")).hexdigest()[:32]
+
+
+def parse_batch_reply(reply, expected):
+    """Return the list of translations in a batched reply, or None if it is malformed."""
+    try:
+        items = json.loads(_CODE_FENCE.sub("", reply.strip()))
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != expected or not all(isinstance(i, str) for i in items):
+        return None
+    return items
+
+
+class TranslationMemory:
+    """translate_batch(segments, language) -> list of translations, same order and length."""
+
+    def __init__(self, translate_batch, cache_size=TRANSLATION_CACHE_SIZE):
+        self.translate_batch = translate_batch
+        self.cache_size = cache_size
+        self._lru = OrderedDict()  # (segment key, language) -> translation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _from_memory(self, key):
+        with self._lock:
+            translation = self._lru.get(key)
+            if translation is not None:
+                self._lru.move_to_end(key)
+            return translation
+
+    def _remember(self, key, translation):
+        with self._lock:
+            self._lru[key] = translation
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+    def _from_db(self, keys, language):
+        found = {}
+        hashes = [key for key, _ in keys]
+        for i in range(0, len(hashes), 500):  # stay under SQLite's bound parameter limit
+            chunk = hashes[i:i + 500]
+            rows = storage.query(
+                f"SELECT source_hash, translation FROM translation_memory WHERE language = ? "
+                f"AND source_hash IN ({','.join('?' * len(chunk))})",
+                [language] + chunk,
+            )
+            found.update(rows)
+        return found
+
+    def translate(self, text, language):
+        pieces = split_segments(text)
+        language_key = language.strip().lower()
+        translations = {}  # segment -> translation
+        missing = OrderedDict()  # segment -> cache key
+
+        for segment in pieces[::2]:
+            if not _HAS_LETTERS.search(segment) or segment in translations or segment in missing:
+                continue
+            key = (segment_key(segment), language_key)
+            cached = self._from_memory(key)
+            if cached is not None:
+                translations[segment] = cached
+            else:
+                missing[segment] = key
+
+        if missing:
+            stored = self._from_db(list(missing.values()), language_key)
+            for segment, key in list(missing.items()):
+                if key[0] in stored:
+                    translations[segment] = stored[key[0]]
+                    self._remember(key, stored[key[0]])
+                    del missing[segment]
+
+        self.hits += len(translations)
+        self.misses += len(missing)
+        if missing:
+            batch = self.translate_batch(list(missing), language)
+            if batch is None:
+                return None
+            for (segment, key), translation in zip(missing.items(), batch):
+                translations[segment] = translation
+                self._remember(key, translation)
+                storage.write(
+                    "INSERT OR REPLACE INTO translation_memory (source_hash, language, source, translation) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key[0], language_key, segment, translation),
+                )
+
+        # Reassemble with the original separators; untranslatable pieces stay as they were
+        return "".join(translations.get(piece, piece) if i % 2 == 0 else piece for i, piece in enumerate(pieces))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._lru), "segment_hits": self.hits, "segment_misses": self.misses}
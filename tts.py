@@ -0,0 +1,114 @@
+# filepath: tts.py
+"""Text-to-speech with a long-lived engine and a content-addressed audio cache.
+
+Each worker initializes pyttsx3 once and reuses it (calls are serialized, the
+engine is not thread-safe). Output files are named after a hash of (text,
+voice, language), so every request gets its own file, repeated answers such as
+the rule-based advice are synthesized only once, and the files never change
+and can be cached by browsers and served by nginx from static/audio. The
+directory is kept under TTS_CACHE_MAX_MB by deleting the least recently used
+files.
+"""
+import os
+import hashlib
+import threading
+
+import lazy
+
+TTS_DIR = os.getenv("TTS_DIR", os.path.join("static", "audio"))
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "200"))
+TTS_FORMAT = os.getenv("TTS_FORMAT", "wav")  # pyttsx3's espeak and SAPI drivers write WAV data
+TTS_VOICE = os.getenv("TTS_VOICE") or None  # engine voice id, default: the engine's own
+
+pyttsx3 = lazy.module("pyttsx3")  # imported on the first synthesis
+
+
+class Synthesizer:
+    def __init__(self, directory=TTS_DIR, max_bytes=TTS_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._engine = None
+        self._pid = None
+        self._voices = {}  # language code -> voice id
+        self._default_voice = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _get_engine(self):
+        if self._engine is None or self._pid != os.getpid():
+            self._engine = pyttsx3.init()
+            self._pid = os.getpid()
+            self._voices = {}
+            self._default_voice = self._engine.getProperty("voice")
+            for voice in self._engine.getProperty("voices"):
+                for language in getattr(voice, "languages", None) or []:
+                    if isinstance(language, bytes):
+                        language = language.decode("utf-8", "ignore").lstrip("\x05")
+                    self._voices.setdefault(str(language).split("-")[0].split("_")[0].lower(), voice.id)
+        return self._engine
+
+    def filename(self, text, voice=None, language=None):
+        key = "\x00".join([voice or TTS_VOICE or "", language or "", text])
+        return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.{TTS_FORMAT}"
+
+    def synthesize(self, text, voice=None, language=None):
+        """Return the path of the audio file for text, synthesizing it if not cached."""
+        path = os.path.join(self.directory, self.filename(text, voice, language))
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)  # mark as recently used for the LRU
+            return path
+        if not pyttsx3:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self._lock:
+            if os.path.exists(path):
+                self.hits += 1
+                return path
+            self.misses += 1
+            engine = self._get_engine()
+            voice_id = voice or self._voices.get((language or "").lower()) or TTS_VOICE or self._default_voice
+            try:
+                # Set on every call: the engine keeps whatever voice the previous request used
+                if voice_id:
+                    engine.setProperty("voice", voice_id)
+                engine.save_to_file(text, tmp_path)
+                engine.runAndWait()
+            except Exception:
+                # A broken engine is rebuilt on the next call
+                self._engine = None
+                raise
+        if not os.path.exists(tmp_path):
+            return None
+        os.replace(tmp_path, path)
+        self._evict()
+        return path
+
+    def _evict(self):
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.is_file() and not e.name.endswith(".tmp")]
+        except OSError:
+            return
+        total = sum(e.stat().st_size for e in entries)
+        if total <= self.max_bytes:
+            return
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+                self.evicted += 1
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+
+synthesizer = Synthesizer()
@@ -0,0 +1,154 @@
+# filepath: weather.py
+"""Weather forecast cache bucketed by grid cell.
+
+Farmers in the same area ask for the weather within minutes of each other, so
+the OpenWeatherMap forecast and the Gemini farming advice generated for it are
+cached per grid cell (lat/lon rounded to WEATHER_GRID_SIZE degrees, ~11 km at
+the default 0.1) rather than per location name.
+
+Lookups go through an in-memory LRU, then the weather_forecasts table in
+queries.db (rows with a cell key, shared by all workers). An entry older than
+WEATHER_CACHE_TTL is still served immediately while a background thread
+refreshes it; only entries older than WEATHER_CACHE_MAX_STALE (or missing
+ones) make the caller wait for the upstream APIs.
+"""
+import os
+import json
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+import logs
+import storage
+
+WEATHER_GRID_SIZE = float(os.getenv("WEATHER_GRID_SIZE", "0.1"))  # degrees
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", str(30 * 60)))  # seconds an entry is fresh
+WEATHER_CACHE_MAX_STALE = int(os.getenv("WEATHER_CACHE_MAX_STALE", str(6 * 3600)))  # oldest entry served while refreshing
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "512"))
+
+Forecast = namedtuple("Forecast", ["summary", "advice", "fetched_at"])
+
+
+def grid_cell(lat: float, lon: float, size: float = WEATHER_GRID_SIZE) -> str:
+    """Key of the grid cell containing (lat, lon), e.g. "10.0,76.3"."""
+    decimals = max(0, len(f"{size:g}".partition(".")[2]))
+    return f"{round(lat / size) * size:.{decimals}f},{round(lon / size) * size:.{decimals}f}"
+
+
+class WeatherCache:
+    """Stale-while-revalidate cache of forecasts per grid cell.
+
+    load(lat, lon) -> Forecast fetches a fresh forecast; it should raise (or
+    return None) when the upstream API fails so nothing is cached.
+    """
+
+    def __init__(self, load, ttl=WEATHER_CACHE_TTL, max_stale=WEATHER_CACHE_MAX_STALE, cache_size=WEATHER_CACHE_SIZE):
+        self.load = load
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.cache_size = cache_size
+        self._lru = OrderedDict()  # cell -> Forecast
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_failures = 0
+
+    def _remember(self, cell, forecast):
+        with self._lock:
+            current = self._lru.get(cell)
+            if current is not None and current.fetched_at > forecast.fetched_at:
+                return
+            self._lru[cell] = forecast
+            self._lru.move_to_end(cell)
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+    def _from_memory(self, cell):
+        with self._lock:
+            forecast = self._lru.get(cell)
+            if forecast is not None:
+                self._lru.move_to_end(cell)
+            return forecast
+
+    def _from_db(self, cell):
+        rows = storage.query(
+            "SELECT forecast_data FROM weather_forecasts WHERE cell = ? ORDER BY id DESC LIMIT 1", (cell,)
+        )
+        if not rows:
+            return None
+        try:
+            data = json.loads(rows[0][0])
+            return Forecast(data["summary"], data.get("advice", ""), float(data["fetched_at"]))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def _store(self, cell, forecast):
+        storage.write(
+            "INSERT INTO weather_forecasts (location, forecast_data, cell) VALUES (?, ?, ?)",
+            (f"grid:{cell}", json.dumps(forecast._asdict()), cell),
+        )
+
+    def _fetch(self, cell, lat, lon):
+        forecast = self.load(lat, lon)
+        if forecast is None:
+            return None
+        self._remember(cell, forecast)
+        self._store(cell, forecast)
+        return forecast
+
+    def _refresh(self, cell, lat, lon):
+        try:
+            if self._fetch(cell, lat, lon) is None:
+                self.refresh_failures += 1
+        except Exception as e:
+            self.refresh_failures += 1
+            logs.error("Weather refresh failed", cell=cell, error=str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(cell)
+
+    def _refresh_in_background(self, cell, lat, lon):
+        with self._lock:
+            if cell in self._refreshing:
+                return
+            self._refreshing.add(cell)
+        threading.Thread(target=self._refresh, args=(cell, lat, lon), name=f"weather-refresh-{cell}", daemon=True).start()
+
+    def get(self, lat: float, lon: float):
+        """Return the Forecast for the cell containing (lat, lon), or None if unavailable."""
+        cell = grid_cell(lat, lon)
+        now = time.time()
+
+        forecast = self._from_memory(cell)
+        if forecast is None or now - forecast.fetched_at > self.ttl:
+            # Another worker may have refreshed the cell already
+            stored = self._from_db(cell)
+            if stored is not None and (forecast is None or stored.fetched_at > forecast.fetched_at):
+                forecast = stored
+                self._remember(cell, forecast)
+
+        if forecast is not None:
+            age = now - forecast.fetched_at
+            if age <= self.ttl:
+                self.hits += 1
+                return forecast
+            if age <= self.max_stale:
+                self.stale_hits += 1
+                self._refresh_in_background(cell, lat, lon)
+                return forecast
+
+        self.misses += 1
+        return self._fetch(cell, lat, lon)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._lru),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshing": len(self._refreshing),
+                "refresh_failures": self.refresh_failures,
+            }